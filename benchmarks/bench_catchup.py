@@ -0,0 +1,110 @@
+# End-to-end history catch-up benchmark
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or any later version.
+#
+# See http://www.gnu.org/licenses/
+
+"""Run a full history catch-up through KlimaLoggDriver.genStartupRecords and
+the real RF thread against a simulated console with a filled logger memory.
+
+Time runs --speedup times faster than real time, so the sleeps of the RF
+loop and of genStartupRecords cost little wall time while the radio timing
+seen by the driver stays realistic.  Reported are the wall time, the
+simulated (radio) time, frames exchanged, records/sec, CPU time and peak
+RSS.  --weather-refresh runs the driver in catch-up mode.
+
+    python benchmarks/bench_catchup.py --records 51200 --batch-size 1800"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kloggpro import klimalogg
+from kloggpro.klimalogg import history_intervals
+from simulator import AcceleratedClock, SimulatedTransceiver
+
+
+def run(records, batch_size, comm_interval, history_interval, timing,
+        speedup, weather_refresh=None):
+    clock = AcceleratedClock(speedup)
+    clock.install(klimalogg)
+    try:
+        sim = SimulatedTransceiver(num_records=records,
+                                   history_interval=history_interval,
+                                   clock=clock)
+        start_ts = clock.time()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        driver = klimalogg.KlimaLoggDriver(
+            transceiver=sim, batch_size=batch_size,
+            comm_interval=comm_interval, timing=timing,
+            catchup_mode=weather_refresh is not None,
+            catchup_weather_refresh=weather_refresh or 0)
+        received = 0
+        try:
+            for _ in driver.genStartupRecords(0):
+                received += 1
+        finally:
+            driver.shutDown()
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        radio = clock.time() - start_ts
+    finally:
+        clock.uninstall()
+    return {
+        'records': records,
+        'batch_size': batch_size,
+        'weather_refresh': weather_refresh,
+        'comm_interval': comm_interval,
+        'history_interval': history_intervals[history_interval],
+        'received': received,
+        'frames': sim.frames_sent,
+        'history_frames': sim.history_frames,
+        'wall_seconds': round(wall, 3),
+        'radio_seconds': round(radio, 1),
+        'cpu_seconds': round(cpu, 3),
+        'records_per_sec_wall': round(received / wall, 1),
+        'records_per_sec_radio': round(received / radio, 2),
+        'cpu_ms_per_frame': round(1000.0 * cpu / max(sim.frames_sent, 1), 3),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--records', type=int, default=51200,
+                        help='records stored in the logger (default 51200)')
+    parser.add_argument('--batch-size', type=int, default=1800)
+    parser.add_argument('--comm-interval', type=int, default=8)
+    parser.add_argument('--history-interval', type=int, default=1,
+                        choices=sorted(history_intervals),
+                        help='HI_* code of the logger (default 1 = 5 min)')
+    parser.add_argument('--timing', type=int, default=300,
+                        help='first sleep of the RF loop in ms')
+    parser.add_argument('--speedup', type=float, default=1000.0)
+    parser.add_argument('--weather-refresh', type=int, default=None,
+                        help='run in catch-up mode with this many seconds'
+                        ' between weather updates')
+    parser.add_argument('--json', action='store_true',
+                        help='print the result as JSON')
+    options = parser.parse_args()
+
+    result = run(options.records, options.batch_size, options.comm_interval,
+                 options.history_interval, options.timing, options.speedup,
+                 options.weather_refresh)
+    if options.json:
+        print(json.dumps(result, indent=2))
+    else:
+        for k, v in result.items():
+            print('%-24s %s' % (k, v))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,240 @@
+# Microbenchmarks for the decode and frame-building hot paths
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or any later version.
+#
+# See http://www.gnu.org/licenses/
+
+"""Measure ops/sec and the memory allocated per op of the decoders and of
+the frame handling in CommunicationService, using synthetic frames.
+
+    python benchmarks/bench_hotpaths.py             compare with baseline
+    python benchmarks/bench_hotpaths.py --save      store a new baseline
+    python benchmarks/bench_hotpaths.py -k history  run matching cases only
+
+The exit status is 1 if a case is slower or allocates more than the
+baseline allows (see --tolerance), and 2 if there is no baseline to
+compare with.  The baseline depends on the machine, so none is shipped;
+store one with --save before changing the code."""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import frames
+from kloggpro.klimalogg import (CommunicationService, CurrentData, Decode,
+                                HistoryData, StationConfig, SensorProjection,
+                                ACTION_GET_HISTORY, KL_SENSOR_MAP)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'baseline.json')
+DEVICE_ID = 0x1234
+INTERVAL = 300
+
+
+def make_service():
+    values = dict(('sensor_text%d' % i, None) for i in range(1, 9))
+    service = CommunicationService(0.3, values, batch_size=10 ** 9)
+    service.transceiver_settings.device_id = DEVICE_ID
+    return service
+
+
+def history_frames(count):
+    """consecutive history frames, six records each, ending now; the first
+    frame follows index 6 (the driver treats a frame at index 6 specially)"""
+    now = int(time.time())
+    last_ts = now - now % INTERVAL
+    latest = 6 * count + 6
+    result = []
+    for n in range(1, count + 1):
+        records = []
+        for i in range(6 * n + 1, 6 * n + 7):
+            ts = last_ts - (latest - i) * INTERVAL
+            records.append((ts, [18.0 + 0.1 * ((i + j) % 50) for j in range(9)],
+                            [40 + (i + j) % 30 for j in range(9)]))
+        result.append(frames.history_frame(records, 6 * n + 6, latest,
+                                           DEVICE_ID))
+    return result
+
+
+def build_cases():
+    _, cur = frames.current_frame(DEVICE_ID)
+    hist = history_frames(200)
+    _, hbuf = hist[0]
+    _, cfgbuf, cfgcs = frames.config_frame(DEVICE_ID)
+    cases = dict()
+
+    cases['Decode.toTemperature_3_1'] = \
+        lambda: Decode.toTemperature_3_1(cur, CurrentData.BUFMAP[0][2], 0)
+    cases['Decode.toDateTime10'] = \
+        lambda: Decode.toDateTime10(hbuf, HistoryData.BUFMAPHIS[1][0], 1, 'x')
+    cases['Decode.toDateTime8'] = \
+        lambda: Decode.toDateTime8(cur, CurrentData.BUFMAP[0][3], 0, 'x')
+    cases['CurrentData.read'] = lambda: CurrentData().read(cur)
+    history_data = HistoryData()
+    # one HistoryData for all frames, as in CommunicationService
+    cases['HistoryData.read_reused'] = lambda: history_data.read(hbuf)
+    cases['HistoryData.as_dict'] = lambda: history_data.as_dict(6)
+    cases['StationConfig.read'] = lambda: StationConfig().read(cfgbuf)
+    config = StationConfig()
+    config.read(cfgbuf)
+    cases['StationConfig.testConfigChanged'] = config.testConfigChanged
+    projection = SensorProjection(KL_SENSOR_MAP)
+    current_data = CurrentData()
+    current_data.read(cur)
+    cases['SensorProjection.apply'] = \
+        lambda: projection.apply(current_data.values, {'usUnits': 0})
+    cases['SensorProjection.apply_current'] = \
+        lambda: projection.apply_current(current_data, {'usUnits': 0})
+
+    service = make_service()
+    service.command = ACTION_GET_HISTORY
+    cases['buildACKFrame'] = \
+        lambda: service.buildACKFrame(hbuf, ACTION_GET_HISTORY, 0x1234, 100)
+
+    current_service = make_service()
+    current_service.station_config.read(cfgbuf)
+    current_service.last_stat.last_weather_ts = 0
+    current_frame = (0xE5, frames.current_frame(DEVICE_ID, cs=cfgcs)[1])
+
+    def current():
+        current_service.last_stat.last_weather_ts = 0
+        current_service.generateResponse(*current_frame)
+    cases['generateResponse[current]'] = current
+
+    # feed consecutive frames to a service that is caching history
+    state = {'service': None, 'n': 0}
+
+    def history():
+        n = state['n']
+        if n == 0 or n >= len(hist):
+            s = make_service()
+            s.station_config.read(cfgbuf)
+            s.startCachingHistory(since_ts=0)
+            s.history_cache.start_index = 6
+            s.history_cache.next_index = 6
+            state['service'] = s
+            n = 0
+        state['service'].generateResponse(*hist[n])
+        state['n'] = n + 1
+    cases['generateResponse[history]'] = history
+    return cases
+
+
+def measure(fn, min_time, repeat):
+    """best ops/sec over repeat runs of at least min_time seconds each"""
+    fn()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 10:
+            break
+        number *= 2
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    best = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        best = max(best, number / elapsed)
+    return best
+
+
+def allocated(fn, number=20):
+    """peak bytes allocated by one op"""
+    tracemalloc.start()
+    try:
+        peak = 0
+        for _ in range(number):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            fn()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def compare(name, result, baseline, tolerance):
+    """return a list of regressions of result against the baseline"""
+    ref = baseline.get(name)
+    if ref is None:
+        return []
+    problems = []
+    if result['ops'] < ref['ops'] * (1.0 - tolerance):
+        problems.append('%s: %.0f ops/s, baseline %.0f ops/s' %
+                        (name, result['ops'], ref['ops']))
+    # allow some noise for cases that allocate next to nothing
+    if result['alloc'] > ref['alloc'] * (1.0 + tolerance) + 256:
+        problems.append('%s: %d bytes/op, baseline %d bytes/op' %
+                        (name, result['alloc'], ref['alloc']))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-k', dest='pattern', default=None,
+                        help='run only cases containing this string')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative regression (default 0.25)')
+    parser.add_argument('--min-time', type=float, default=0.2)
+    parser.add_argument('--repeat', type=int, default=3)
+    options = parser.parse_args()
+
+    baseline = dict()
+    if os.path.exists(options.baseline):
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+    elif not options.save:
+        print('no baseline at %s; nothing to compare with, store one with'
+              ' --save' % options.baseline, file=sys.stderr)
+
+    results = dict()
+    problems = []
+    print('%-36s %14s %12s %10s' % ('case', 'ops/s', 'bytes/op', 'vs base'))
+    for name, fn in build_cases().items():
+        if options.pattern and options.pattern not in name:
+            continue
+        result = {'ops': measure(fn, options.min_time, options.repeat),
+                  'alloc': allocated(fn)}
+        results[name] = result
+        ref = baseline.get(name)
+        ratio = '%9.2fx' % (result['ops'] / ref['ops']) if ref else '         -'
+        print('%-36s %14.0f %12d %s' % (name, result['ops'], result['alloc'],
+                                        ratio))
+        problems.extend(compare(name, result, baseline, options.tolerance))
+
+    if options.save:
+        baseline.update(results)
+        with open(options.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print('baseline saved to %s' % options.baseline)
+    elif problems:
+        print('\nregressions against %s:' % options.baseline)
+        for p in problems:
+            print('  %s' % p)
+        return 1
+    elif not baseline:
+        return 2
+    else:
+        missing = sorted(set(results) - set(baseline))
+        if missing:
+            print('\nnot in the baseline: %s' % ', '.join(missing))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
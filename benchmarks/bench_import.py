@@ -0,0 +1,92 @@
+# Import-time budget for the kloggpro modules
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or any later version.
+#
+# See http://www.gnu.org/licenses/
+
+"""Check the import time of the kloggpro modules against a budget.
+
+Each module is imported in a fresh interpreter and the best cumulative
+time of --repeat runs, as reported by python -X importtime, is compared
+with its budget.  The package is byte-compiled first so that compiling is
+not measured.  The check also fails if importing a module loads one of
+the lazily imported dependencies (pyusb, http.server).
+
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --scale 2    on a slow machine"""
+
+import argparse
+import compileall
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# budget in milliseconds per module
+BUDGETS = {
+    'kloggpro.protocol': 40,
+    'kloggpro.klimalogg': 60,
+}
+
+# modules that must not be loaded by importing the driver
+LAZY_MODULES = ('usb', 'http.server')
+
+
+def python(*args):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p])
+    return subprocess.run((sys.executable,) + args, cwd=ROOT, env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+
+
+def import_time(module):
+    """cumulative import time of module in ms"""
+    result = python('-X', 'importtime', '-c', 'import %s' % module)
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) / 1000.0
+    raise RuntimeError('no import time reported for %s' % module)
+
+
+def lazy_modules_loaded(module):
+    result = python('-c', 'import sys, %s; print(" ".join(m for m in %r '
+                    'if m in sys.modules))' % (module, LAZY_MODULES))
+    return result.stdout.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiply the budgets by this factor')
+    options = parser.parse_args()
+
+    compileall.compile_dir(os.path.join(ROOT, 'kloggpro'), quiet=1)
+    problems = []
+    print('%-24s %10s %10s  %s' % ('module', 'ms', 'budget', 'loaded'))
+    for module, budget in sorted(BUDGETS.items()):
+        budget *= options.scale
+        ms = min(import_time(module) for _ in range(options.repeat))
+        loaded = lazy_modules_loaded(module)
+        print('%-24s %10.1f %10.1f  %s' % (module, ms, budget,
+                                          ' '.join(loaded) or '-'))
+        if ms > budget:
+            problems.append('%s: %.1f ms, budget %.1f ms' % (module, ms, budget))
+        for m in loaded:
+            problems.append('%s: imports %s' % (module, m))
+    if problems:
+        print('\nover budget:')
+        for p in problems:
+            print('  %s' % p)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
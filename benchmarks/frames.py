@@ -0,0 +1,134 @@
+# Synthetic KlimaLogg frames
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or any later version.
+#
+# See http://www.gnu.org/licenses/
+
+"""Synthetic KlimaLogg frames for the benchmarks.  The values are encoded
+nibble by nibble the way the Decode methods read them."""
+
+import time
+
+from kloggpro.klimalogg import (CurrentData, HistoryData, StationConfig,
+                                SensorLimits, index_to_addr, HI_05MIN)
+
+
+def put_digits(buf, start, start_on_hi_nibble, digits):
+    """write decimal digits as consecutive nibbles, the way Decode reads
+    them"""
+    pos = start * 2 + (0 if start_on_hi_nibble else 1)
+    for d in digits:
+        i = pos // 2
+        if pos % 2 == 0:
+            buf[i] = (buf[i] & 0x0F) | (d << 4)
+        else:
+            buf[i] = (buf[i] & 0xF0) | d
+        pos += 1
+
+
+def put_temperature(buf, start, hi, value):
+    raw = int(round((value + SensorLimits.temperature_offset) * 10))
+    put_digits(buf, start, hi, (raw // 100, raw // 10 % 10, raw % 10))
+
+
+def put_humidity(buf, start, hi, value):
+    raw = int(value)
+    put_digits(buf, start, hi, (raw // 10, raw % 10))
+
+
+def put_datetime10(buf, start, tm):
+    put_digits(buf, start, 1, (tm.tm_year % 100 // 10, tm.tm_year % 10,
+                               tm.tm_mon // 10, tm.tm_mon % 10,
+                               tm.tm_mday // 10, tm.tm_mday % 10,
+                               tm.tm_hour // 10, tm.tm_hour % 10,
+                               tm.tm_min // 10, tm.tm_min % 10))
+
+
+def put_datetime8(buf, start, hi, tm):
+    h = tm.tm_hour
+    if h < 10:
+        tim1, tim2 = h, tm.tm_min // 10
+    elif h < 20:
+        tim1, tim2 = h - 10, tm.tm_min // 10 + 10
+    else:
+        tim1, tim2 = h - 10, tm.tm_min // 10
+    put_digits(buf, start, hi, (tm.tm_year % 100 // 10, tm.tm_year % 10,
+                                tm.tm_mon, tm.tm_mday // 10, tm.tm_mday % 10,
+                                tim1, tim2, tm.tm_min % 10))
+
+
+def frame_header(buf, device_id, logger_id, resp, quality, cs):
+    buf[0] = (device_id >> 8) & 0xFF
+    buf[1] = device_id & 0xFF
+    buf[2] = logger_id
+    buf[3] = resp
+    buf[4] = quality
+    buf[5] = (cs >> 8) & 0xFF
+    buf[6] = cs & 0xFF
+
+
+def current_frame(device_id=0x1234, logger_id=0, cs=0, ts=None,
+                  temps=None, hums=None, quality=100):
+    """a 229 byte current weather frame"""
+    if ts is None:
+        ts = time.time()
+    tm = time.localtime(ts)
+    temps = temps or [20.0 + 0.5 * i for i in range(9)]
+    hums = hums or [40 + i for i in range(9)]
+    buf = [0] * 0x131
+    frame_header(buf, device_id, logger_id, 0x30, quality, cs)
+    for x in range(9):
+        m = CurrentData.BUFMAP[x]
+        put_temperature(buf, m[0], 0, temps[x] + 1.5)
+        put_temperature(buf, m[1], 1, temps[x] - 1.5)
+        put_temperature(buf, m[2], 0, temps[x])
+        put_datetime8(buf, m[3], 0, tm)
+        put_datetime8(buf, m[4], 0, tm)
+        put_humidity(buf, m[5], 1, hums[x] + 5)
+        put_humidity(buf, m[6], 1, hums[x] - 5)
+        put_humidity(buf, m[7], 1, hums[x])
+        put_datetime8(buf, m[8], 1, tm)
+        put_datetime8(buf, m[9], 1, tm)
+    return 0xE5, buf
+
+
+def history_frame(records, this_index, latest_index, device_id=0x1234,
+                  logger_id=0, cs=0, quality=100):
+    """a 181 byte history frame holding up to six (ts, temps, hums)
+    records, oldest first"""
+    buf = [0] * 0x131
+    frame_header(buf, device_id, logger_id, 0x40, quality, cs)
+    for i, a in ((7, index_to_addr(latest_index)),
+                 (10, index_to_addr(this_index))):
+        buf[i] = (a >> 16) & 0xFF
+        buf[i + 1] = (a >> 8) & 0xFF
+        buf[i + 2] = a & 0xFF
+    for pos, (ts, temps, hums) in enumerate(records, 1):
+        m = HistoryData.BUFMAPHIS[pos]
+        put_datetime10(buf, m[0], time.localtime(ts))
+        for j in range(9):
+            put_temperature(buf, m[1][j], j % 2, temps[j])
+            put_humidity(buf, m[2][j], 1, hums[j])
+    return 0xB5, buf
+
+
+def config_frame(device_id=0x1234, logger_id=0,
+                 history_interval=HI_05MIN, quality=100):
+    """a 125 byte config frame whose checksum matches what the driver
+    would send back, so that no set config is triggered"""
+    cfg = StationConfig()
+    cfg.values['HistoryInterval'] = history_interval
+    for x in range(9):
+        cfg.values['Temp%dMax' % x] = 40.0
+        cfg.values['Temp%dMin' % x] = 0.0
+        cfg.values['Humidity%dMax' % x] = 70
+        cfg.values['Humidity%dMin' % x] = 20
+    _, buf = cfg.testConfigChanged()
+    buf = list(buf) + [0] * (0x131 - len(buf))
+    frame_header(buf, device_id, logger_id, 0x20, quality, 0)
+    buf[5] = cfg.values['Settings']
+    buf[6] = cfg.values['TimeZone']
+    cs = cfg.values['OutBufCS']
+    return 0x7D, buf, cs
@@ -0,0 +1,224 @@
+# Simulated KlimaLogg console
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or any later version.
+#
+# See http://www.gnu.org/licenses/
+
+"""A stand-in for the USB transceiver and the KlimaLogg console.
+
+SimulatedTransceiver implements the methods of klimalogg.Transceiver that
+the CommunicationService uses and answers each reply of the driver the way
+the console does, serving history records from a simulated logger memory.
+AcceleratedClock lets the RF loop run faster than real time."""
+
+import time as _time
+
+from kloggpro.klimalogg import (
+    ACTION_GET_HISTORY, ACTION_REQ_SET_TIME, ACTION_REQ_SET_CONFIG,
+    ACTION_GET_CONFIG, ACTION_SEND_CONFIG,
+    ACTION_SEND_TIME, RESPONSE_DATA_WRITTEN, RESPONSE_REQ_SET_CONFIG,
+    RESPONSE_REQ_SET_TIME, HI_05MIN, history_intervals, addr_to_index,
+    bytes_to_addr)
+
+import frames
+
+MAX_RECORDS = 51200
+
+
+class AcceleratedClock(object):
+    """a replacement for the time module in which time passes factor times
+    faster; install() patches it into the given modules"""
+
+    def __init__(self, factor=1.0, start=None):
+        self.factor = float(factor)
+        self.real_start = _time.time()
+        self.start = self.real_start if start is None else start
+        self.patched = []
+
+    def time(self):
+        return self.start + (_time.time() - self.real_start) * self.factor
+
+    def sleep(self, secs):
+        if secs > 0:
+            _time.sleep(secs / self.factor)
+
+    def localtime(self, secs=None):
+        return _time.localtime(self.time() if secs is None else secs)
+
+    def __getattr__(self, name):
+        return getattr(_time, name)
+
+    def install(self, *modules):
+        for m in modules:
+            self.patched.append((m, m.time))
+            m.time = self
+
+    def uninstall(self):
+        for m, t in reversed(self.patched):
+            m.time = t
+        self.patched = []
+
+
+class SimulatedTransceiver(object):
+    """the transceiver and the console behind it"""
+
+    def __init__(self, num_records=MAX_RECORDS, history_interval=HI_05MIN,
+                 device_id=0x1234, logger_id=0, clock=_time):
+        self.clock = clock
+        self.device_id = device_id
+        self.logger_id = logger_id
+        self.interval = 60 * history_intervals[history_interval]
+        self.num_records = min(num_records, MAX_RECORDS)
+        now = int(clock.time())
+        self.latest_index = (self.num_records - 1) % MAX_RECORDS
+        self.latest_ts = now - now % self.interval
+        _, self.config_buf, self.config_cs = frames.config_frame(
+            device_id, logger_id, history_interval)
+        self.comm_interval = 8
+        self.last_current_ts = 0
+        self.pending = None
+        self.reply = None
+        self.frames_sent = 0
+        self.frames_received = 0
+        self.history_frames = 0
+        self.timeout = 1000
+        self.last_dump = None
+
+    # logger memory
+
+    def advance(self):
+        """store new history records for the time that has passed"""
+        now = self.clock.time()
+        while now >= self.latest_ts + self.interval:
+            self.latest_ts += self.interval
+            self.latest_index = (self.latest_index + 1) % MAX_RECORDS
+            self.num_records = min(self.num_records + 1, MAX_RECORDS)
+
+    def record(self, idx):
+        age = (self.latest_index - idx) % MAX_RECORDS
+        ts = self.latest_ts - age * self.interval
+        step = (ts // self.interval) % 100
+        temps = [15.0 + 0.1 * ((step + 7 * j) % 100) for j in range(9)]
+        hums = [30 + (step + 3 * j) % 50 for j in range(9)]
+        return ts, temps, hums
+
+    def history(self, haddr):
+        if haddr == 0xFFFFFF:
+            # unknown address: start at the eldest record
+            idx = self.latest_index - self.num_records + 1
+        else:
+            idx = int(addr_to_index(haddr))
+        ahead = (self.latest_index - idx) % MAX_RECORDS
+        last = idx + min(ahead, 6) if ahead else self.latest_index
+        first = last - 5
+        records = [self.record(i % MAX_RECORDS) for i in range(first, last + 1)]
+        self.history_frames += 1
+        return frames.history_frame(records, last % MAX_RECORDS,
+                                    self.latest_index, self.device_id,
+                                    self.logger_id, self.config_cs)
+
+    def current(self):
+        self.last_current_ts = self.clock.time()
+        return frames.current_frame(self.device_id, self.logger_id,
+                                    self.config_cs, self.clock.time())
+
+    def short_frame(self, resp):
+        buf = [0] * 0x131
+        frames.frame_header(buf, self.device_id, self.logger_id, resp, 100,
+                            self.config_cs)
+        return 0x07, buf
+
+    def respond(self, nbytes, data):
+        """prepare the frame the console sends in reply to our frame"""
+        action = data[3]
+        if nbytes == 0x7D and action == ACTION_SEND_CONFIG:
+            self.config_buf[5:123] = data[5:123]
+            self.config_cs = (data[123] << 8) | data[124]
+            self.config_buf[123] = data[123]
+            self.config_buf[124] = data[124]
+            return self.short_frame(RESPONSE_DATA_WRITTEN)
+        if nbytes == 0x0D and action == ACTION_SEND_TIME:
+            return self.short_frame(RESPONSE_DATA_WRITTEN)
+        if nbytes != 0x0B:
+            return self.current()
+        action &= 0xF
+        self.comm_interval = data[7]
+        if action == ACTION_GET_HISTORY:
+            haddr = bytes_to_addr(data[8], data[9], data[10])
+            # with nothing new to read the console sends current weather
+            # once per communication interval, else the latest records
+            if (haddr != 0xFFFFFF and
+                    int(addr_to_index(haddr)) == self.latest_index and
+                    self.clock.time() - self.last_current_ts >=
+                    self.comm_interval):
+                return self.current()
+            return self.history(haddr)
+        if action == ACTION_GET_CONFIG:
+            buf = list(self.config_buf)
+            frames.frame_header(buf, self.device_id, self.logger_id, 0x20,
+                                100, 0)
+            buf[5] = self.config_buf[5]
+            buf[6] = self.config_buf[6]
+            return 0x7D, buf
+        if action == ACTION_REQ_SET_CONFIG:
+            return self.short_frame(RESPONSE_REQ_SET_CONFIG)
+        if action == ACTION_REQ_SET_TIME:
+            return self.short_frame(RESPONSE_REQ_SET_TIME)
+        return self.current()
+
+    # transceiver interface
+
+    def open(self, vid, pid, serial):
+        pass
+
+    def close(self):
+        pass
+
+    def readConfigFlash(self, addr, nbytes):
+        buf = [0] * 0x15
+        if addr == 0x1F9:
+            buf[5] = (self.device_id >> 8) & 0xFF
+            buf[6] = self.device_id & 0xFF
+        return buf
+
+    def writeReg(self, regAddr, data):
+        pass
+
+    def execute(self, command):
+        pass
+
+    def setPreamblePattern(self, pattern):
+        pass
+
+    def setState(self, state):
+        pass
+
+    def getState(self):
+        self.advance()
+        if self.pending is None and self.reply is None:
+            # the console broadcasts current weather when not asked
+            self.pending = self.current()
+        return [0x16 if self.pending is not None else 0x15, 0]
+
+    def getFrame(self):
+        nbytes, buf = self.pending
+        self.pending = None
+        self.frames_sent += 1
+        return nbytes, list(buf)
+
+    def setFrame(self, nbytes, data):
+        self.reply = (nbytes, list(data[:nbytes]))
+
+    def setTX(self):
+        self.frames_received += 1
+        nbytes, data = self.reply
+        self.reply = None
+        self.pending = self.respond(nbytes, data)
+
+    def setRX(self):
+        self.reply = None
+
+    def dump(self, cmd, buf, fmt='auto', length=301):
+        pass
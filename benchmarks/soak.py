@@ -0,0 +1,221 @@
+# Memory soak test for the KlimaLogg driver
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or any later version.
+#
+# See http://www.gnu.org/licenses/
+
+"""Run the driver for simulated days against a simulated console and watch
+its memory.
+
+The main loop consumes KlimaLoggDriver.genLoopPackets the way a long
+running integration does and periodically caches and fetches the history
+records since the previous fetch.  At every sample the traced Python
+memory, the RSS and the number of live CurrentData, HistoryData and
+(gc-tracked) dict objects are recorded.  After a warm-up a series that
+grows from one quarter of the run to the next, and by more than the
+tolerance overall, is reported as a leak and the exit status is 1.
+
+    python benchmarks/soak.py --days 7 --history-every 900"""
+
+import argparse
+import gc
+import json
+import os
+import resource
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kloggpro import klimalogg
+from simulator import AcceleratedClock, SimulatedTransceiver
+
+# the types whose live instances are counted
+COUNTED_TYPES = ('CurrentData', 'HistoryData', 'dict')
+
+# the series checked for growth
+SERIES = ('rss_kb', 'traced_kb') + COUNTED_TYPES
+
+# leave out the memory allocated by this harness and the simulator
+HARNESS_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+    tracemalloc.Filter(False, os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '*')),
+]
+
+
+def rss_kb():
+    """current resident set size, the peak where /proc is not available"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() // 1024
+    except (IOError, OSError, IndexError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def count_objects():
+    gc.collect()
+    counts = dict((name, 0) for name in COUNTED_TYPES)
+    for obj in gc.get_objects():
+        name = type(obj).__name__
+        if name in counts:
+            counts[name] += 1
+    return counts
+
+
+def fetch_history(driver, clock, since_ts, timeout=900):
+    """cache the history records since since_ts, return them and clear the
+    cache, as a consumer of the driver does"""
+    driver.start_caching_history(since_ts=since_ts)
+    deadline = clock.time() + timeout
+    try:
+        while clock.time() < deadline:
+            clock.sleep(1)
+            if (driver.get_uncached_history_count() == 0 and
+                    driver.get_next_history_index() ==
+                    driver.get_latest_history_index()):
+                break
+    finally:
+        driver.stop_caching_history()
+    records = list(driver.get_history_cache_records())
+    driver.clear_history_cache()
+    return records
+
+
+def growth(values, tolerance):
+    """return the relative growth of values if the mean grows from each
+    quarter to the next and the total growth exceeds tolerance, else
+    None"""
+    n = len(values) // 4
+    if n == 0:
+        return None
+    means = [sum(values[i * n:(i + 1) * n]) / float(n) for i in range(4)]
+    if not all(a < b for a, b in zip(means, means[1:])):
+        return None
+    rel = (means[-1] - means[0]) / max(means[0], 1.0)
+    return rel if rel > tolerance else None
+
+
+def soak(days, speedup, polling_interval, comm_interval, history_every,
+         sample_every, records, nframes, warmup):
+    clock = AcceleratedClock(speedup)
+    clock.install(klimalogg)
+    tracemalloc.start(nframes)
+    samples = []
+    snapshots = []
+    driver = None
+    try:
+        sim = SimulatedTransceiver(num_records=records, clock=clock)
+        driver = klimalogg.KlimaLoggDriver(transceiver=sim,
+                                           polling_interval=polling_interval,
+                                           comm_interval=comm_interval)
+        driver.clear_wait_at_start()
+        start = clock.time()
+        end = start + days * 86400
+        next_sample = start
+        next_history = start + history_every
+        # the snapshot at this sample is the reference for the last one
+        reference = int(days * 86400 / sample_every * warmup)
+        since_ts = int(start)
+        fetched = 0
+        for _ in driver.genLoopPackets():
+            now = clock.time()
+            if now >= next_history:
+                history = fetch_history(driver, clock, since_ts)
+                if history:
+                    since_ts = history[-1]['dateTime']
+                    fetched += len(history)
+                next_history = clock.time() + history_every
+            if now >= next_sample or now >= end:
+                snapshot = tracemalloc.take_snapshot().filter_traces(
+                    HARNESS_FILTERS)
+                sample = {'hours': round((now - start) / 3600.0, 2),
+                          'rss_kb': rss_kb(),
+                          'traced_kb': sum(t.size for t in snapshot.traces) // 1024,
+                          'frames': sim.frames_sent,
+                          'history_fetched': fetched}
+                sample.update(count_objects())
+                samples.append(sample)
+                if len(samples) > reference:
+                    snapshots[1:] = [snapshot]
+                next_sample = now + sample_every
+            if now >= end:
+                break
+    finally:
+        if driver is not None:
+            driver.shutDown()
+        clock.uninstall()
+        tracemalloc.stop()
+    return samples, snapshots
+
+
+def top_growth(first, last, limit=10):
+    """the source lines whose allocations grew most between two snapshots"""
+    stats = last.compare_to(first, 'lineno')
+    return [s for s in stats if s.size_diff > 0][:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--days', type=float, default=1.0,
+                        help='simulated days to run (default 1)')
+    parser.add_argument('--speedup', type=float, default=100.0,
+                        help='tracemalloc slows the RF loop; keep this low '
+                        'enough for the radio timing to hold (default 100)')
+    parser.add_argument('--polling-interval', type=int, default=10)
+    parser.add_argument('--comm-interval', type=int, default=8)
+    parser.add_argument('--history-every', type=int, default=3600,
+                        help='simulated seconds between history fetches')
+    parser.add_argument('--sample-every', type=int, default=1800,
+                        help='simulated seconds between samples')
+    parser.add_argument('--records', type=int, default=1000,
+                        help='records in the logger at the start')
+    parser.add_argument('--warmup', type=float, default=0.25,
+                        help='fraction of the samples to ignore at the start')
+    parser.add_argument('--tolerance', type=float, default=0.02,
+                        help='allowed relative growth after the warm-up')
+    parser.add_argument('--frames', type=int, default=1,
+                        help='traceback depth kept by tracemalloc')
+    parser.add_argument('--json', action='store_true',
+                        help='print the samples as JSON')
+    options = parser.parse_args()
+
+    samples, snapshots = soak(options.days, options.speedup,
+                              options.polling_interval, options.comm_interval,
+                              options.history_every, options.sample_every,
+                              options.records, options.frames, options.warmup)
+    warmup = int(len(samples) * options.warmup)
+    checked = samples[warmup:]
+    leaks = dict()
+    for name in SERIES:
+        rel = growth([s[name] for s in checked], options.tolerance)
+        if rel is not None:
+            leaks[name] = rel
+
+    if options.json:
+        print(json.dumps({'samples': samples, 'warmup': warmup,
+                          'leaks': leaks}, indent=2))
+    else:
+        columns = ('hours', 'frames', 'history_fetched') + SERIES
+        print(' '.join('%12s' % c[:12] for c in columns))
+        for s in samples:
+            print(' '.join('%12s' % s[c] for c in columns))
+        if leaks:
+            print('\ngrowing after the first %d samples:' % warmup)
+            for name, rel in sorted(leaks.items()):
+                print('  %-12s +%.1f%%' % (name, 100.0 * rel))
+        else:
+            print('\nno monotonic growth after the first %d samples' % warmup)
+        if leaks and len(snapshots) == 2:
+            print('\nlargest allocation growth:')
+            for stat in top_growth(*snapshots):
+                print('  %s' % stat)
+    return 1 if leaks else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
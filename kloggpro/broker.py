@@ -0,0 +1,145 @@
+# Publish/subscribe broker for the KlimaLogg driver
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+# See http://www.gnu.org/licenses/
+
+"""In-process fan-out of observations and history records.
+
+The RF thread publishes each new observation and each history record once;
+every Subscription gets its own bounded queue.  When a queue is full the
+overflow policy of the subscription decides what happens:
+
+    drop_oldest  the oldest queued item is dropped (default)
+    drop_newest  the new item is dropped
+    block        the publisher waits up to block_timeout seconds for room,
+                 then drops the new item; the publisher is the RF thread,
+                 so keep the timeout well below the radio timing
+
+Dropped items are counted per subscription."""
+
+import collections
+import queue
+import threading
+
+TOPIC_OBSERVATION = 'observation'
+TOPIC_HISTORY = 'history'
+TOPICS = (TOPIC_OBSERVATION, TOPIC_HISTORY)
+
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_DROP_NEWEST = 'drop_newest'
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST,
+                     OVERFLOW_BLOCK)
+
+
+class Subscription(object):
+    """a bounded queue of (topic, item) tuples for one consumer"""
+
+    def __init__(self, broker, name, topics, maxsize, overflow,
+                 block_timeout):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('unknown overflow policy %s' % overflow)
+        self.broker = broker
+        self.name = name
+        self.topics = frozenset(topics)
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.items = collections.deque()
+        self.cond = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, topic, item):
+        """queue an item; called by the broker in the publishing thread"""
+        with self.cond:
+            if self.closed:
+                return
+            if len(self.items) >= self.maxsize:
+                if self.overflow == OVERFLOW_DROP_OLDEST:
+                    self.items.popleft()
+                    self.dropped += 1
+                elif self.overflow == OVERFLOW_BLOCK:
+                    self.cond.wait_for(
+                        lambda: len(self.items) < self.maxsize or self.closed,
+                        self.block_timeout)
+                if len(self.items) >= self.maxsize or self.closed:
+                    self.dropped += 1
+                    return
+            self.items.append((topic, item))
+            self.cond.notify_all()
+
+    def get(self, block=True, timeout=None):
+        """return the next (topic, item); raise queue.Empty if there is none
+        within the timeout or the subscription is closed"""
+        with self.cond:
+            if block:
+                self.cond.wait_for(lambda: self.items or self.closed, timeout)
+            if not self.items:
+                raise queue.Empty
+            topic_item = self.items.popleft()
+            self.cond.notify_all()
+            return topic_item
+
+    def __iter__(self):
+        """iterate the items until the subscription is closed"""
+        while True:
+            try:
+                yield self.get()
+            except queue.Empty:
+                if self.closed:
+                    return
+
+    def close(self):
+        self.broker.unsubscribe(self)
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class Broker(object):
+    """fan-out of published items to the subscriptions of their topic"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = ()
+
+    def subscribe(self, name=None, topics=TOPICS, maxsize=1000,
+                  overflow=OVERFLOW_DROP_OLDEST, block_timeout=0.05):
+        sub = Subscription(self, name, topics, maxsize, overflow,
+                           block_timeout)
+        with self.lock:
+            self.subscriptions = self.subscriptions + (sub,)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            self.subscriptions = tuple(s for s in self.subscriptions
+                                       if s is not sub)
+
+    def wants(self, topic):
+        """True if a subscription takes items of topic"""
+        for sub in self.subscriptions:
+            if topic in sub.topics:
+                return True
+        return False
+
+    def publish(self, topic, item):
+        # the tuple is replaced, not changed, so no lock is needed here
+        for sub in self.subscriptions:
+            if topic in sub.topics:
+                sub.put(topic, item)
+
+    def close(self):
+        for sub in self.subscriptions:
+            sub.close()
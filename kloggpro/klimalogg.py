@@ -27,64 +27,51 @@
 
 
 
+from collections.abc import Mapping
 from datetime import datetime
-import random
+import queue
 import sys
 import threading
 import time
-import traceback
-import usb
-from io import StringIO
+
+from .broker import (Broker, TOPICS, TOPIC_HISTORY, TOPIC_OBSERVATION,
+                     OVERFLOW_DROP_OLDEST)
+from .metrics import RFMetrics, RESPONSE_NAMES
+from .observation import DeadbandFilter, DeltaEncoder
+from .persist import Checkpoint, WarmStart
+# also re-exported, not all of these are used here
+from .protocol import (  # noqa: F401
+    MAX_RECORDS,
+    ACTION_GET_HISTORY, ACTION_REQ_SET_TIME, ACTION_REQ_SET_CONFIG,
+    ACTION_GET_CONFIG, ACTION_GET_CURRENT, ACTION_SEND_CONFIG,
+    ACTION_SEND_TIME,
+    RESPONSE_DATA_WRITTEN, RESPONSE_GET_CONFIG, RESPONSE_GET_CURRENT,
+    RESPONSE_GET_HISTORY, RESPONSE_REQUEST, RESPONSE_REQ_READ_HISTORY,
+    RESPONSE_REQ_FIRST_CONFIG, RESPONSE_REQ_SET_CONFIG, RESPONSE_REQ_SET_TIME,
+    HI_01MIN, HI_05MIN, HI_10MIN, HI_15MIN, HI_30MIN, HI_01STD, HI_02STD,
+    HI_03STD, HI_06STD, history_intervals, frequencies,
+    bytes_to_addr, addr_to_index, index_to_addr, get_datum_diff,
+    calc_checksum, get_index, tstr_to_ts, tuple_to_ts, datetime_to_ts,
+    TS_1900, TS_2010_07,
+    BadResponse, UnknownDeviceId, DataWritten, SensorLimits,
+    AX5051RegisterNames, Decode)
+from .trace import TraceBuffer
+
+# pyusb, imported when the first Transceiver is opened
+usb = None
 
 DRIVER_NAME = 'KlimaLogg'
 DRIVER_VERSION = '1.4.2'
 PRESS_USB = "press the USB button to start communication"
 
-
-ACTION_GET_HISTORY = 0x00
-ACTION_REQ_SET_TIME = 0x01
-ACTION_REQ_SET_CONFIG = 0x02
-ACTION_GET_CONFIG = 0x03    #in use!
-ACTION_GET_CURRENT = 0x04
-ACTION_SEND_CONFIG = 0x20
-ACTION_SEND_TIME = 0x60
-
-RESPONSE_DATA_WRITTEN = 0x10
-RESPONSE_GET_CONFIG = 0x20
-RESPONSE_GET_CURRENT = 0x30
-RESPONSE_GET_HISTORY = 0x40
-RESPONSE_REQUEST = 0x50  # the group of all 0x5x requests
-RESPONSE_REQ_READ_HISTORY = 0x50
-RESPONSE_REQ_FIRST_CONFIG = 0x51
-RESPONSE_REQ_SET_CONFIG = 0x52
-RESPONSE_REQ_SET_TIME = 0x53
-
-HI_01MIN = 0
-HI_05MIN = 1
-HI_10MIN = 2
-HI_15MIN = 3
-HI_30MIN = 4
-HI_01STD = 5
-HI_02STD = 6
-HI_03STD = 7
-HI_06STD = 8
-
-history_intervals = {
-    HI_01MIN: 1,
-    HI_05MIN: 5,
-    HI_10MIN: 10,
-    HI_15MIN: 15,
-    HI_30MIN: 30,
-    HI_01STD: 60,
-    HI_02STD: 120,
-    HI_03STD: 180,
-    HI_06STD: 360}
-
-# frequency standards and their associated transmission frequencies
-frequencies = {
-    'US': 905000000,
-    'EU': 868300000,
-}
+# reasons for skipping history records
+SKIP_TOO_OLD = 'too_old'            # older than the eldest valid timestamp
+SKIP_BEFORE_START = 'before_start'  # older than the requested start time
+SKIP_FUTURE = 'future'              # dateTime is in the future
+SKIP_DUPLICATE = 'duplicate'        # same dateTime as previous good record
+SKIP_PAST = 'past'                  # older than previous good record
+SKIP_GAP = 'gap'                    # more than 7 days after previous record
+SKIP_CORRUPT = 'corrupt'            # unexpected record index
 
 # flags for enabling/disabling debug verbosity
 DEBUG_COMM = 0
@@ -130,22 +117,45 @@ KL_SENSOR_MAP = {
 import logging
 log = logging.getLogger(__name__)
 
-def logdbg(msg):
-    log.debug(msg)
+# The arguments are merged into the message by the logging module only when
+# the message is actually emitted, so pass them separately instead of
+# formatting the message up front.
+def logdbg(msg, *args):
+    log.debug(msg, *args)
     #print(msg)
 
-def loginf(msg):
-    log.info(msg)
+def loginf(msg, *args):
+    log.info(msg, *args)
     #print(msg)
     
-def logtee(msg):
-    loginf(msg)
+def logtee(msg, *args):
+    loginf(msg, *args)
     #print("%s\r" % msg)
 
-def logerr(msg):
-    log.error(msg)
+def logerr(msg, *args):
+    log.error(msg, *args)
     #print(msg)
 
+def isdbg():
+    """True if debug messages are emitted; use it to guard log arguments
+    that are expensive to compute"""
+    return log.isEnabledFor(logging.DEBUG)
+
+_last_event_ts = dict()
+
+def logevent(event, interval, msg, *args, level=logging.INFO):
+    """Log msg as the structured event 'event', at most once per interval
+    seconds. The event name is available to handlers as the record
+    attribute 'event', the values as the record args."""
+    if not log.isEnabledFor(level):
+        return
+    now = time.monotonic()
+    last = _last_event_ts.get(event)
+    if last is not None and now - last < interval:
+        return
+    _last_event_ts[event] = now
+    log.log(level, msg, *args, extra={'event': event})
+
 def logconsole(): #Hiermit kann die Konsole als Logging-Anzeige gesetzt werden
     ch = logging.StreamHandler()
     ch.setLevel(logging.DEBUG)
@@ -153,147 +163,26 @@ def logconsole(): #Hiermit kann die Konsole als Logging-Anzeige gesetzt werden
     ch.setFormatter(formatter)
     log.addHandler(ch)
 
-def bytes_to_addr(a, b, c):
-    return (((a << 8) | b) << 8) | c
-
-def addr_to_index(addr):
-    return (addr - 0x070000) / 32
-
-def index_to_addr(idx):
-    return 32 * idx + 0x070000
-
-def get_datum_diff(v, np, ofl):
-    if abs(np - v) < 0.001 or abs(ofl - v) < 0.001:
-        return None
-    return v
-
-def calc_checksum(buf, start, end=None):
-    if end is None:
-        end = len(buf)
-    cs = 0
-    for i in range(start, end):
-        cs += buf[i]
-    return cs
-
-def get_index(idx):
-    if idx < 0:
-        return idx + KlimaLoggDriver.max_records
-    elif idx >= KlimaLoggDriver.max_records:
-        return idx - KlimaLoggDriver.max_records
-    return idx
-
-def tstr_to_ts(tstr):
-    try:
-        return int(time.mktime(time.strptime(tstr, "%Y-%m-%d %H:%M:%S")))
-    except (OverflowError, ValueError, TypeError):
-        pass
-    return None
-
-# The following classes and methods are adapted from the implementation by
-# eddie de pieri, which is in turn based on the HeavyWeather implementation.
-class BadResponse(Exception):
-    """raised when unexpected data found in frame buffer"""
-    pass
-
-class UnknownDeviceId(Exception):
-    """raised when unknown device ID found in frame buffer"""
-    pass
-
-class DataWritten(Exception):
-    """raised when message 'data written' in frame buffer"""
-    pass
-
-# NP - not present
-# OFL - outside factory limits
-class SensorLimits:
-    temperature_offset = 40.0
-    temperature_NP = 81.1
-    temperature_OFL = 136.0
-    humidity_NP = 110.0
-    humidity_OFL = 121.0
-
-class AX5051RegisterNames:
-    REVISION     = 0x0
-    SCRATCH      = 0x1
-    POWERMODE    = 0x2
-    XTALOSC      = 0x3
-    FIFOCTRL     = 0x4
-    FIFODATA     = 0x5
-    IRQMASK      = 0x6
-    IFMODE       = 0x8
-    PINCFG1      = 0x0C
-    PINCFG2      = 0x0D
-    MODULATION   = 0x10
-    ENCODING     = 0x11
-    FRAMING      = 0x12
-    CRCINIT3     = 0x14
-    CRCINIT2     = 0x15
-    CRCINIT1     = 0x16
-    CRCINIT0     = 0x17
-    FREQ3        = 0x20
-    FREQ2        = 0x21
-    FREQ1        = 0x22
-    FREQ0        = 0x23
-    FSKDEV2      = 0x25
-    FSKDEV1      = 0x26
-    FSKDEV0      = 0x27
-    IFFREQHI     = 0x28
-    IFFREQLO     = 0x29
-    PLLLOOP      = 0x2C
-    PLLRANGING   = 0x2D
-    PLLRNGCLK    = 0x2E
-    TXPWR        = 0x30
-    TXRATEHI     = 0x31
-    TXRATEMID    = 0x32
-    TXRATELO     = 0x33
-    MODMISC      = 0x34
-    FIFOCONTROL2 = 0x37
-    ADCMISC      = 0x38
-    AGCTARGET    = 0x39
-    AGCATTACK    = 0x3A
-    AGCDECAY     = 0x3B
-    AGCCOUNTER   = 0x3C
-    CICDEC       = 0x3F
-    DATARATEHI   = 0x40
-    DATARATELO   = 0x41
-    TMGGAINHI    = 0x42
-    TMGGAINLO    = 0x43
-    PHASEGAIN    = 0x44
-    FREQGAIN     = 0x45
-    FREQGAIN2    = 0x46
-    AMPLGAIN     = 0x47
-    TRKFREQHI    = 0x4C
-    TRKFREQLO    = 0x4D
-    XTALCAP      = 0x4F
-    SPAREOUT     = 0x60
-    TESTOBS      = 0x68
-    APEOVER      = 0x70
-    TMMUX        = 0x71
-    PLLVCOI      = 0x72
-    PLLCPEN      = 0x73
-    PLLRNGMISC   = 0x74
-    AGCMANUAL    = 0x78
-    ADCDCLEVEL   = 0x79
-    RFMISC       = 0x7A
-    TXDRIVER     = 0x7B
-    REF          = 0x7C
-    RXMISC       = 0x7D
-
-
-
 class CommunicationService(object):
 
-    def __init__(self, first_sleep, values, max_records=51200, batch_size=100):
+    def __init__(self, first_sleep, values, max_records=51200, batch_size=100,
+                 transceiver=None, response_deadline=0.1, decode_worker=False):
         logdbg('CommunicationService.init')
 
         self.first_sleep = first_sleep
         self.values = values
         self.reg_names = dict()
-        self.hid = Transceiver()
+        self.hid = transceiver if transceiver is not None else Transceiver()
         self.transceiver_settings = TransceiverSettings()
         self.last_stat = LastStat()
         self.station_config = StationConfig()
         self.current = CurrentData()
+        # reused for each history frame, one per thread that decodes them
+        self.history_data = HistoryData()
+        self.decoder_history_data = HistoryData()
+        # the last current data and config frames, for getWarmState
+        self.current_buf = None
+        self.config_buf = None
         self.comm_mode_interval = 8
         self.config_serial = None # optionally specified serial number
         self.logger_id = 0 # the default logger id
@@ -311,13 +200,39 @@ class CommunicationService(object):
         self.command = None
         self.history_cache = HistoryCache()
         self.ts_last_rec = 0
+        # timestamp of the last record of an earlier read that is resumed
+        self.ts_floor = 0
         self.records_skipped = 0
+        self.skip_counts = dict()
+        # guards the skip counts and num_cached_records, which the decode
+        # worker changes when it cannot decode accepted records
+        self.count_lock = threading.Lock()
+        self.history_started_ts = None
+        self.history_records_received = 0
 
         self.max_records = max_records
         self.batch_size = batch_size
+        self.metrics = RFMetrics()
+        # seconds from frame ready to setTX after which a reply is late
+        self.response_deadline = response_deadline
+        # seconds without a frame after a reply that count as silence
+        self.silence_timeout = 30
+        # (setTX time, 'on_time' or 'late') of the last reply
+        self.last_reply = None
+        # (key, frame) of the ACK most likely to be sent next
+        self.prepared_ack = None
+        # decodes current data and history records off the RF thread
+        self.decoder = FrameDecoder() if decode_worker else None
+        # catch-up mode: seconds between current weather requests while
+        # history is read, None to ask for it every few comm intervals
+        self.catchup_weather_refresh = None
+        self.trace = None
+        # called as publish(topic, item) with each new CurrentData and
+        # history record
+        self.publish = None
 
     def buildFirstConfigFrame(self, cs):
-        logdbg('buildFirstConfigFrame: cs=%04x' % cs)
+        logdbg('buildFirstConfigFrame: cs=%04x', cs)
         newlen = 11
         newbuf = [0] * newlen
         historyAddress = 0x010700
@@ -356,7 +271,7 @@ class CommunicationService(object):
 
     @staticmethod
     def buildTimeFrame(buf, cs):
-        logdbg("buildTimeFrame: cs=%04x" % cs)
+        logdbg("buildTimeFrame: cs=%04x", cs)
 
         tm = time.localtime()
 
@@ -382,11 +297,9 @@ class CommunicationService(object):
         newbuf[12] = (tm[0] - 2000) // 10                           # not used + year-hi
         return newlen, newbuf
 
-    def buildACKFrame(self, buf, action, cs, hidx=None):
-        if DEBUG_COMM > 1:
-            logdbg("buildACKFrame: action=%x cs=%04x historyIndex=%s" %
-                   (action, cs, hidx))
-
+    def ackAddress(self, buf1, action, hidx):
+        """return the action and history address of an ACK frame; buf1 is
+        the second byte of the frame received"""
         comInt = self.comm_mode_interval
 
         # When last weather is stale, change action to get current weather
@@ -396,53 +309,93 @@ class CommunicationService(object):
             age = now - self.last_stat.last_weather_ts
             # Morphing action only with GetHistory requests, 
             # and stale data after a period of twice the CommModeInterval,
+            # or of the weather refresh in catch-up mode,
             # but not with init GetHistory requests (0xF0)
+            refresh = self.catchup_weather_refresh
+            if refresh is None:
+                refresh = (comInt + 1) * 2
             if (action == ACTION_GET_HISTORY and
-                age >= (comInt + 1) * 2 and buf[1] != 0xF0):
+                age >= refresh and buf1 != 0xF0):
                 if DEBUG_COMM > 0:
                     logdbg('buildACKFrame: morphing action'
-                           ' from %d to 5 (age=%s)' % (action, age))
+                           ' from %d to 5 (age=%s)', action, age)
                 action = ACTION_GET_CURRENT
 
         if hidx == 0xFFFF:
             # At first config preset the address with DeviceId and logger_id
             haddr = (self.getDeviceID() << 8) + int(self.logger_id)
-            logdbg('buildACKFrame: first config haddr preset to deviceID and logger_id 0x%06x' % haddr)
+            logdbg('buildACKFrame: first config haddr preset to deviceID and logger_id 0x%06x', haddr)
         else:
             if hidx is None:
-                if self.last_stat.latest_history_index is not None:
+                if (self.command == ACTION_GET_HISTORY and
+                        self.history_cache.next_index is not None):
+                    # go on with the history read, asking for the latest
+                    # index would skip the records in between
+                    hidx = self.history_cache.next_index
+                elif self.last_stat.latest_history_index is not None:
                     hidx = self.last_stat.latest_history_index
             if hidx is None or hidx < 0 or hidx >= KlimaLoggDriver.max_records:
                 # If no hidx is present yet, preset haddr with 0xffffff
                 haddr = 0xFFFFFF
-                logdbg('buildACKFrame: no known haddr; preset with 0x%06x' % haddr)
+                logdbg('buildACKFrame: no known haddr; preset with 0x%06x', haddr)
             else:
                 haddr = index_to_addr(hidx)
         if DEBUG_COMM > 1:
-            logdbg('buildACKFrame: idx: {} addr: 0x{:04x}'.format(hidx, int(haddr)))
+            logdbg('buildACKFrame: idx: %s addr: 0x%04x', hidx, int(haddr))
+        return action, int(haddr)
 
+    @staticmethod
+    def ackFrame(key):
+        """the ACK frame for key, a tuple of the three header bytes, action,
+        checksum, history address and comm interval"""
+        b0, b1, b2, action, cs, haddr, comInt = key
         # d5 00 0b f0 f0 ff 03 ff ff 80 03 01 07 00
         #           0  1  2  3  4  5  6  7  8  9 10
-        newlen = 11
-        newbuf = [0] * newlen
-        newbuf[0] = buf[0]
-        newbuf[1] = buf[1]
-        newbuf[2] = buf[2]
-        newbuf[3] = action & 0xF
-        newbuf[4] = (cs >> 8) & 0xFF
-        newbuf[5] = (cs >> 0) & 0xFF
-        newbuf[6] = 0x80  # TODO: not known what this means
-        newbuf[7] = comInt & 0xFF
-        newbuf[8] = (int(haddr) >> 16) & 0xFF
-        newbuf[9] = (int(haddr) >> 8) & 0xFF
-        newbuf[10] = (int(haddr) >> 0) & 0xFF
-        return newlen, newbuf
+        return [b0, b1, b2, action,
+                (cs >> 8) & 0xFF, (cs >> 0) & 0xFF,
+                0x80,  # TODO: not known what this means
+                comInt,
+                (haddr >> 16) & 0xFF, (haddr >> 8) & 0xFF, (haddr >> 0) & 0xFF]
+
+    def buildACKFrame(self, buf, action, cs, hidx=None):
+        if DEBUG_COMM > 1:
+            logdbg("buildACKFrame: action=%x cs=%04x historyIndex=%s",
+                   action, cs, hidx)
+        action, haddr = self.ackAddress(buf[1], action, hidx)
+        key = (buf[0], buf[1], buf[2], action & 0xF, cs, haddr,
+               self.comm_mode_interval & 0xFF)
+        # the frames are not changed after they are built, so the prepared
+        # frame can be sent as it is
+        prepared = self.prepared_ack
+        if prepared is not None and prepared[0] == key:
+            return 11, prepared[1]
+        newbuf = self.ackFrame(key)
+        self.prepared_ack = (key, newbuf)
+        return 11, newbuf
+
+    def prepareACK(self):
+        """Build the most likely next reply while waiting for the console:
+        the ACK that asks for the history at the latest index, with the
+        checksum of the config and the header of the last ACK.  It is the
+        reply to current data and to history data when nothing is cached,
+        so buildACKFrame only has to compare it."""
+        prepared = self.prepared_ack
+        if prepared is None or self.last_stat.latest_history_index is None:
+            return
+        b0, b1, b2 = prepared[0][:3]
+        action, haddr = self.ackAddress(b1, ACTION_GET_HISTORY, None)
+        key = (b0, b1, b2, action & 0xF, self.station_config.getInBufCS(),
+               haddr, self.comm_mode_interval & 0xFF)
+        if key != prepared[0]:
+            self.prepared_ack = (key, self.ackFrame(key))
 
     def handleConfig(self, length, buf):
-        logdbg('handleConfig: %s' % self.timing())
+        if isdbg():
+            logdbg('handleConfig: %s', self.timing())
         if DEBUG_CONFIG_DATA > 2:
             self.hid.dump('InBuf', buf, fmt='long', length=length)
         self.station_config.read(buf)
+        self.config_buf = buf
         if DEBUG_CONFIG_DATA > 1:
             self.station_config.to_log()
         now = int(time.time())
@@ -455,7 +408,7 @@ class CommunicationService(object):
 
     def handleCurrentData(self, length, buf):
         if DEBUG_WEATHER_DATA > 1:
-            logdbg('handleCurrentData: %s' % self.timing())
+            logdbg('handleCurrentData: %s', self.timing())
 
         now = int(time.time())
 
@@ -464,15 +417,15 @@ class CommunicationService(object):
         if age >= self.comm_mode_interval:
             if DEBUG_WEATHER_DATA > 2:
                 self.hid.dump('CurWea', buf, fmt='long', length=length)
-            data = CurrentData()
-            data.read(buf)
-            self.current = data
-            if DEBUG_WEATHER_DATA > 0:
-                data.to_log()
+            if self.decoder is None:
+                self.decodeCurrentData(buf)
+            else:
+                # the frame is not used after the reply is built
+                self.decoder.put(self.decodeCurrentData, buf)
         else:
             if DEBUG_WEATHER_DATA > 1:
-                logdbg('new weather data within %s; skip data; ts=%s' % 
-                       (age, now))
+                logdbg('new weather data within %s; skip data; ts=%s',
+                       age, now)
 
         # update the connection cache
         self.last_stat.update(seen_ts=now,
@@ -480,8 +433,13 @@ class CommunicationService(object):
                               weather_ts=now)
 
         cs = buf[6] | (buf[5] << 8)
-        self.station_config.setSensorText(self.values)
-        changed, cfgbuf = self.station_config.testConfigChanged()
+        if (self.catchup_weather_refresh is not None and
+                self.command == ACTION_GET_HISTORY):
+            # a changed config is sent after the catch-up
+            changed = False
+        else:
+            self.station_config.setSensorText(self.values)
+            changed, cfgbuf = self.station_config.testConfigChanged()
         inBufCS = self.station_config.getInBufCS()
         if inBufCS == 0 or inBufCS != cs:
             # request for a get config
@@ -503,27 +461,75 @@ class CommunicationService(object):
             newlen, newbuf = self.buildACKFrame(buf, ACTION_GET_HISTORY, cs)
         return newlen, newbuf
 
+    def decodeCurrentData(self, buf):
+        data = CurrentData()
+        data.read(buf)
+        self.current = data
+        self.current_buf = buf
+        if self.publish is not None:
+            self.publish(TOPIC_OBSERVATION, data)
+        if DEBUG_WEATHER_DATA > 0 and isdbg():
+            data.to_log()
+
+    def appendHistoryRecords(self, data, positions, records):
+        for x in positions:
+            record = data.as_dict(x)
+            records.append(record)
+            if self.publish is not None:
+                self.publish(TOPIC_HISTORY, record)
+
+    def decodeHistoryRecords(self, buf, positions, records):
+        """decode the history frame in buf and append the records at
+        positions to records, the cache they were accepted for"""
+        data = self.decoder_history_data
+        n = len(records)
+        try:
+            data.read(buf)
+            if DEBUG_HISTORY_DATA > 1 and isdbg():
+                data.to_log()
+            self.appendHistoryRecords(data, positions, records)
+        except Exception as e:
+            # the RF thread counted these records as cached already
+            lost = len(positions) - (len(records) - n)
+            logerr('decodeHistoryRecords: %d record(s) not decoded: %s',
+                   lost, e)
+            self.countSkipped(SKIP_CORRUPT, lost)
+            with self.count_lock:
+                if records is self.history_cache.records:
+                    self.history_cache.num_cached_records -= lost
+
+    def countSkipped(self, reason, count=1):
+        with self.count_lock:
+            self.skip_counts[reason] = self.skip_counts.get(reason, 0) + count
+            self.records_skipped += count
+            self.metrics.history_skipped.inc(reason, amount=count)
+
     # timestamp of record with time 'None'
-    TS_1900 = tstr_to_ts(str(datetime(1900, 1, 1, 0, 0)))
+    TS_1900 = TS_1900
 
     # initially the clock of the KlimaLogg station starts at 1-jan-2010,
     # so skip all records elder than 1-jul-2010
     # eldest valid timestamp for history record
-    TS_2010_07 = tstr_to_ts(str(datetime(2010, 7, 1, 0, 0)))
+    TS_2010_07 = TS_2010_07
 
     def handleHistoryData(self, length, buf):
         if DEBUG_HISTORY_DATA > 1:
-            logdbg('handleHistoryData: %s' % self.timing())
+            logdbg('handleHistoryData: %s', self.timing())
 
         now = int(time.time())
         self.last_stat.update(seen_ts=now,
                               quality=(buf[4] & 0x7f),
                               history_ts=now)
 
-        data = HistoryData()
-        data.read(buf)
-        if DEBUG_HISTORY_DATA > 1:
-            data.to_log()
+        data = self.history_data
+        if self.decoder is None:
+            data.read(buf)
+            if DEBUG_HISTORY_DATA > 1 and isdbg():
+                data.to_log()
+        else:
+            # the reply needs the record times only, the worker decodes
+            # the sensor values
+            data.read_times(buf)
 
         cs = buf[6] | (buf[5] << 8)
         latestAddr = bytes_to_addr(buf[7], buf[8], buf[9])
@@ -531,9 +537,9 @@ class CommunicationService(object):
         latestIndex = addr_to_index(latestAddr)
         thisIndex = addr_to_index(thisAddr)
 
-        tsPos1 = tstr_to_ts(str(data.values['Pos1DT']))
-        tsPos2 = tstr_to_ts(str(data.values['Pos2DT']))
-        tsPos6 = tstr_to_ts(str(data.values['Pos6DT']))
+        tsPos1 = data.ts[1]
+        tsPos2 = data.ts[2]
+        tsPos6 = data.ts[6]
         if tsPos1 == self.TS_1900:
             # the first history record has date-time 1900-01-01 00:00:00
             # use the time difference with the second message
@@ -545,37 +551,36 @@ class CommunicationService(object):
         else:
             timeDiff = abs(now - tsFirstRec)
 
-        # FIXME: what if we do not have config data yet?
-        cfg = self.getConfigData().as_dict()
-        dcfOn = 'OFF' if int(cfg['settings']) & 0x4 == 0 else 'ON'
+        cfg = self.station_config.getView()
+        dcfOn = 'ON' if cfg.dcf_reception else 'OFF'
 
         # check for an actual history record (tsPos1 == tsPos2) with valid
         # timestamp (tsPos1 != TS_1900)
         # Take in account that communication might be stalled for 3 minutes during DCF reception and sensor scanning
         # if history date/time differs more than 5 min from now then
         # reqSetTime and initiate alarm
-        if data.values['Pos1Alarm'] == 0 and data.values['Pos6Alarm'] == 0:
+        if data.alarm[1] == 0 and data.alarm[6] == 0:
             # both records are history records
             if tsPos1 == tsPos6 and tsPos1 != self.TS_1900:
                 if timeDiff > 300:
                     self.station_config.setAlarmClockOffset()  # set Humidity0Min value to 99
-                    logerr('ERROR: DCF: %s; dateTime history record %s differs %s seconds from dateTime server; please check and set set the clock of your station' %
-                           (dcfOn, thisIndex, timeDiff))
-                    logerr('ERROR: tsPos1: %s, tsPos2: %s' % (tsPos1, tsPos6))
+                    logerr('ERROR: DCF: %s; dateTime history record %s differs %s seconds from dateTime server; please check and set set the clock of your station',
+                           dcfOn, thisIndex, timeDiff)
+                    logerr('ERROR: tsPos1: %s, tsPos2: %s', tsPos1, tsPos6)
                 else:
                     self.station_config.resetAlarmClockOffset()  # set Humidity0Min value to 20
                     if timeDiff > 30:
-                        logdbg('DCF = %s; dateTime history record %s differs %s seconds from dateTime server' %
-                               (dcfOn, thisIndex, timeDiff))
+                        logdbg('DCF = %s; dateTime history record %s differs %s seconds from dateTime server',
+                               dcfOn, thisIndex, timeDiff)
 
         # initially the first buffer presented is 6, in fact it starts at 0,
         # which has date None, so we start at 1
         if thisIndex == 6 and latestIndex > 12:
             thisIndex = 1
         nrec = get_index(latestIndex - thisIndex)
-        logdbg('handleHistoryData: time=%s this=%d (0x%04x) latest=%d (0x%04x) nrec=%d' %
-               (data.values['Pos1DT'],
-                thisIndex, thisAddr, latestIndex, latestAddr, nrec))
+        logdbg('handleHistoryData: time=%s this=%d (0x%04x) latest=%d (0x%04x) nrec=%d',
+               data.dt[1],
+               thisIndex, thisAddr, latestIndex, latestAddr, nrec)
 
         # track the latest history index
         self.last_stat.last_history_index = thisIndex
@@ -583,34 +588,50 @@ class CommunicationService(object):
 
         nextIndex = None
         if self.command == ACTION_GET_HISTORY:
-            if self.history_cache.start_index is None:
+            if (self.history_cache.start_index is None and
+                    self.history_cache.resume_index is not None):
+                idx = self.history_cache.resume_index
+                nreq = get_index(latestIndex - idx)
+                logtee('handleHistoryData: resume after index %s,'
+                       ' %s records to read', idx, nreq)
+                self.history_cache.start_index = idx
+                self.history_cache.next_index = idx
+                self.last_stat.last_history_index = idx
+                self.history_cache.num_outstanding_records = nreq
+                nextIndex = idx
+                self.records_skipped = 0
+                self.skip_counts = dict()
+                # no gap check against the record the read resumes after,
+                # else a gap of more than a week would end the download
+                self.ts_last_rec = 0
+                self.ts_floor = self.history_cache.resume_ts
+            elif self.history_cache.start_index is None:
                 if self.history_cache.num_rec > 0:
-                    logtee('handleHistoryData: request for %s records' %
+                    logtee('handleHistoryData: request for %s records',
                            self.history_cache.num_rec)
                     nreq = self.history_cache.num_rec
                 else:
                     if self.history_cache.since_ts > 0:
-                        logtee('handleHistoryData: request records since {}'.format(self.history_cache.since_ts))
+                        logtee('handleHistoryData: request records since %s', self.history_cache.since_ts)
                         span = int(time.time()) - self.history_cache.since_ts
-                        if cfg['history_interval'] is not None:
-                            arcint = 60 * history_intervals.get(cfg['history_interval'])
-                        else:
+                        arcint = cfg.history_interval_seconds
+                        if arcint is None:
                             arcint = 60 * 15  # use the typical history interval of 15 min if interval not known yet
                         # FIXME: this assumes a constant archive interval for
                         # all records in the station history
                         nreq = int(span / arcint) + 5  # FIXME: punt 5
                         if nrec > 0 and nreq > nrec:
-                            loginf('handleHistoryData: too many records requested (%d), clipping to number stored (%d)' %
-                                  (nreq, nrec))
+                            loginf('handleHistoryData: too many records requested (%d), clipping to number stored (%d)',
+                                   nreq, nrec)
                             nreq = nrec
                     else:
-                        loginf('handleHistoryData: no start date known (empty database), use number stored (%d)' % nrec)
+                        loginf('handleHistoryData: no start date known (empty database), use number stored (%d)', nrec)
                         nreq = nrec
                 # limit number of history records that will be read
-                logdbg('handleHistoryData: nreq=%s' % nreq)
+                logdbg('handleHistoryData: nreq=%s', nreq)
                 if nreq > self.max_records:
                     nreq = self.max_records
-                    loginf('Number of history records limited to: %s' % nreq)
+                    loginf('Number of history records limited to: %s', nreq)
                 if nreq >= KlimaLoggDriver.max_records:
                     nrec = KlimaLoggDriver.max_records - 1
                 idx = get_index(latestIndex - nreq)
@@ -619,10 +640,12 @@ class CommunicationService(object):
                 self.last_stat.last_history_index = idx
                 self.history_cache.num_outstanding_records = nreq
                 logdbg('handleHistoryData: start_index=%s'
-                       ' num_outstanding_records=%s' % (idx, nreq))
+                       ' num_outstanding_records=%s', idx, nreq)
                 nextIndex = idx
                 self.records_skipped = 0
+                self.skip_counts = dict()
                 self.ts_last_rec = 0
+                self.ts_floor = 0
             elif self.history_cache.next_index is not None:
 
                 # thisIndex should be the 1-6 record(s) after next_index (note: index cycles after 51199 to 0)
@@ -643,76 +666,87 @@ class CommunicationService(object):
 
                 if thisIndexOk:
                     # get the next 1-6 history record(s)
-                    for x in range(1, 7):
-                        if data.values['Pos%dAlarm' % x] == 0:
-                            # History record
-                            tsCurrentRec = tstr_to_ts(str(data.values['Pos%dDT' % x]))
-                            # skip records which are too old or elder than requested
-                            if tsCurrentRec >= self.TS_2010_07 and tsCurrentRec >= self.history_cache.since_ts:
-                                # skip records with dateTime in the future
-                                if tsCurrentRec > (now + 300):
-                                    logdbg('handleHistoryData: skipped record at Pos%d tsCurrentRec=%s'
-                                           ' DT is in the future' %
-                                           (x,tsCurrentRec))
-                                    self.records_skipped += 1
-                                # Check if two records in a row with the same ts
-                                elif tsCurrentRec == self.ts_last_rec:
-                                    if DEBUG_HISTORY_DATA > 1:
-                                        logdbg('handleHistoryData: skipped record at Pos%d tsCurrentRec=%s'
-                                               ' DT is the same' %
-                                               (x,tsCurrentRec))
-                                    self.records_skipped += 1
-                                # Check if this record elder than previous good record
-                                elif tsCurrentRec < self.ts_last_rec:
-                                    logdbg('handleHistoryData: skipped record at Pos%d tsCurrentRec=%s'
-                                           ' DT is in the past' %
-                                           (x,tsCurrentRec))
-                                    self.records_skipped += 1
-                                # Check if this record more than 7 days newer than previous good record
-                                elif self.ts_last_rec != 0 and tsCurrentRec > self.ts_last_rec + 604800:
-                                    logdbg('handleHistoryData: skipped record at Pos%d tsCurrentRec=%s'
-                                           ' DT has too big diff' %
-                                           (x,tsCurrentRec))
-                                    self.records_skipped += 1
-                                else:
-                                    if self.history_cache.num_cached_records < self.batch_size:
-                                        # append good record to the history
-                                        logdbg('handleHistoryData:  append record at Pos%d tsCurrentRec=%s' %
-                                               (x,tsCurrentRec))
-                                        self.history_cache.records.append(data.as_dict(x))
-                                        self.history_cache.num_cached_records += 1
-                                        # save only TS of good records
-                                        self.ts_last_rec = tsCurrentRec
-                                        # save index of last appended record
-                                        self.history_cache.last_this_index = thisIndex
-                                    else:
-                                        logdbg('handleHistoryData: record at Pos%d'
-                                               ' handled in next batch' %
-                                               (x))
-                                        time.sleep(20)
-                            # Check if this record is too old or has no date
-                            elif tsCurrentRec < self.TS_2010_07:
-                                logerr('handleHistoryData: skippd record at Pos%d tsCurrentRec=None DT is too old' % x)
-                                self.records_skipped += 1
-                            else:
-                                # this record is elder than the requested start dateTime
-                                logdbg('handleHistoryData: skipped record at Pos%d' %
-                                       (x))
-                                self.records_skipped += 1
-                        self.history_cache.next_index = thisIndex
+                    positions = [x for x in range(1, 7)
+                                 if data.alarm[x] == 0]
+                    end = self.history_cache.end_index
+                    if end is not None:
+                        # only the records after indexRequested up to end
+                        remaining = get_index(end - indexRequested)
+                        positions = [
+                            x for x in positions
+                            if 0 < get_index(thisIndex - 6 + x - indexRequested)
+                            <= remaining]
+                    timestamps = [data.ts[x] for x in positions]
+                    if end is None:
+                        limit = self.batch_size - self.history_cache.num_cached_records
+                    else:
+                        # a read up to end_index is bounded by end_index;
+                        # records deferred here would never be read
+                        limit = None
+                    accepted, deferred, skipped, self.ts_last_rec = \
+                        validate_history_batch(timestamps,
+                                               self.history_cache.since_ts,
+                                               self.ts_last_rec, now, limit,
+                                               self.ts_floor)
+                    for i in accepted:
+                        # append good record to the history
+                        logdbg('handleHistoryData:  append record at Pos%d tsCurrentRec=%s',
+                               positions[i], timestamps[i])
+                    accepted_positions = [positions[i] for i in accepted]
+                    if self.decoder is None:
+                        self.appendHistoryRecords(data, accepted_positions,
+                                                  self.history_cache.records)
+                    elif accepted:
+                        self.decoder.put(self.decodeHistoryRecords, buf,
+                                         accepted_positions,
+                                         self.history_cache.records)
+                    if accepted:
+                        with self.count_lock:
+                            self.history_cache.num_cached_records += len(accepted)
+                        # save index of last appended record; Pos6 is the
+                        # record at thisIndex
+                        self.history_cache.last_index = get_index(
+                            thisIndex - 6 + positions[accepted[-1]])
+                        self.history_records_received += len(accepted)
+                        self.metrics.history_records.inc(amount=len(accepted))
+                        if self.history_started_ts is not None:
+                            elapsed = time.time() - self.history_started_ts
+                            if elapsed > 0:
+                                self.metrics.history_rate.set(
+                                    self.history_records_received / elapsed)
+                    if skipped:
+                        if SKIP_TOO_OLD in skipped:
+                            logerr('handleHistoryData: skipped %d record(s) with DT too old',
+                                   skipped[SKIP_TOO_OLD])
+                        logdbg('handleHistoryData: skipped records: %s', skipped)
+                        for reason, count in skipped.items():
+                            self.countSkipped(reason, count)
+                    if deferred:
+                        # the next batch continues after last_index
+                        logdbg('handleHistoryData: %d record(s) handled in'
+                               ' next batch', len(deferred))
+                    self.history_cache.next_index = thisIndex
+                    if (end is not None and
+                            get_index(thisIndex - indexRequested) > remaining):
+                        self.history_cache.next_index = end
                 else:
                     if nrec > 0:
-                        logdbg('handleHistoryData: index mismatch: indexRequested: %s, thisIndex: %s' %
-                               (indexRequested, thisIndex))
+                        logdbg('handleHistoryData: index mismatch: indexRequested: %s, thisIndex: %s',
+                               indexRequested, thisIndex)
                     elif indexRequested != thisIndex:
-                        logdbg('handleHistoryData: skip corrupt record: indexRequested: %s, thisIndex: %s' %
-                               (indexRequested, thisIndex))
+                        logdbg('handleHistoryData: skip corrupt record: indexRequested: %s, thisIndex: %s',
+                               indexRequested, thisIndex)
                         self.history_cache.next_index += 1
-                        self.records_skipped += 1
+                        self.countSkipped(SKIP_CORRUPT)
                 nextIndex = self.history_cache.next_index
+            if (self.history_cache.end_index is not None and
+                    self.history_cache.next_index is not None):
+                nrec = get_index(self.history_cache.end_index -
+                                 self.history_cache.next_index)
             self.history_cache.num_outstanding_records = nrec
-            loginf('handleHistoryData: records cached=%s, records skipped=%s, next=%s' %
-                (self.history_cache.num_cached_records, self.records_skipped, nextIndex))
+            logevent('history_progress', 10,
+                     'handleHistoryData: records cached=%s, records skipped=%s, next=%s',
+                     self.history_cache.num_cached_records, self.records_skipped, nextIndex)
         self.setSleep(self.first_sleep, 0.010)
         newlen, newbuf = self.buildACKFrame(buf, ACTION_GET_HISTORY, cs, nextIndex)
         return newlen, newbuf
@@ -724,31 +758,31 @@ class CommunicationService(object):
         resp = buf[3]
         if resp == RESPONSE_REQ_READ_HISTORY:
             memPerc = buf[4]
-            logdbg('handleNextAction: %02x (MEM percentage not read to server: %s)' % (resp, memPerc))
+            logdbg('handleNextAction: %02x (MEM percentage not read to server: %s)', resp, memPerc)
             self.setSleep(0.075, 0.005)
             newlen = length
             newbuf = buf
         elif resp == RESPONSE_REQ_FIRST_CONFIG:
-            logdbg('handleNextAction: %02x (first-time config)' % resp)
+            logdbg('handleNextAction: %02x (first-time config)', resp)
             self.setSleep(0.075, 0.005)
             newlen, newbuf = self.buildFirstConfigFrame(cs)
         elif resp == RESPONSE_REQ_SET_CONFIG:
-            logdbg('handleNextAction: %02x (set config data)' % resp)
+            logdbg('handleNextAction: %02x (set config data)', resp)
             self.setSleep(0.075, 0.005)
             newlen, newbuf = self.buildConfigFrame(buf)
         elif resp == RESPONSE_REQ_SET_TIME:
-            logdbg('handleNextAction: %02x (set time data)' % resp)
+            logdbg('handleNextAction: %02x (set time data)', resp)
             self.setSleep(0.075, 0.005)
             newlen, newbuf = self.buildTimeFrame(buf, cs)
         else:
-            logdbg('handleNextAction: %02x' % resp)
+            logdbg('handleNextAction: %02x', resp)
             self.setSleep(self.first_sleep, 0.010)
             newlen, newbuf = self.buildACKFrame(buf, ACTION_GET_HISTORY, cs)
         return newlen, newbuf
 
     def generateResponse(self, length, buf):
         if DEBUG_COMM > 1:
-            logdbg('generateResponse: %s' % self.timing())
+            logdbg('generateResponse: %s', self.timing())
         if length == 0:
             raise BadResponse('zero length buffer')
 
@@ -756,12 +790,12 @@ class CommunicationService(object):
         loggerID = buf[2]
         respType = (buf[3] & 0xF0)
         if DEBUG_COMM > 1:
-            logdbg("generateResponse: id=%04x resp=%x length=%x" %
-                   (bufferID, respType, length))
+            logdbg("generateResponse: id=%04x resp=%x length=%x",
+                   bufferID, respType, length)
         deviceID = self.getDeviceID()
 
         if bufferID == 0xF0F0 or bufferID == 0xFFFF:
-            loginf('generateResponse: console not paired, attempting to pair to 0x%04x' % deviceID)
+            loginf('generateResponse: console not paired, attempting to pair to 0x%04x', deviceID)
             newlen, newbuf = self.buildACKFrame(buf, ACTION_GET_CONFIG, 0xFFFF, 0xFFFF)
         elif bufferID == deviceID:
             self.set_registered_device_id(bufferID, loggerID)  # the station and transceiver are paired now
@@ -796,7 +830,7 @@ class CommunicationService(object):
                 raise BadResponse('unexpected response type %x' % respType)
         else:
             if self.config_serial is None:
-                logerr('generateResponse: intercepted message from device %04x with length: %02x' % (bufferID, length))
+                logerr('generateResponse: intercepted message from device %04x with length: %02x', bufferID, length)
             self.setSleep(0.200, 0.005)
             raise UnknownDeviceId('unexpected device ID (id=%04x)' % bufferID)
         return newlen, newbuf
@@ -948,25 +982,76 @@ class CommunicationService(object):
     def getConfigData(self):
         return self.station_config
 
-    def startCachingHistory(self, since_ts=0, num_rec=0):
+    def getWarmState(self):
+        """return the last current data and config frames and the link
+        stats as a dict that restoreWarmState takes"""
+        data = self.current
+        return {'current_buf': self.current_buf,
+                'current_ts': data.timestamp,
+                'config_buf': self.config_buf,
+                'last_stat': dict(vars(self.last_stat))}
+
+    def restoreWarmState(self, state):
+        """restore what getWarmState returned before the RF thread starts.
+        The current data keeps its old timestamp and is marked stale; the
+        config is used as it is, so no config is read from the console
+        while its checksum matches."""
+        if state.get('config_buf'):
+            self.station_config.read(state['config_buf'])
+            self.config_buf = state['config_buf']
+        if state.get('current_buf') and state.get('current_ts'):
+            data = CurrentData()
+            data.read(state['current_buf'])
+            data.timestamp = state['current_ts']
+            data.stale = True
+            self.current = data
+            self.current_buf = state['current_buf']
+        for k, v in state.get('last_stat', {}).items():
+            # the history indices are read from the console again
+            if k in WARM_LAST_STAT:
+                setattr(self.last_stat, k, v)
+
+    def startCachingHistory(self, since_ts=0, num_rec=0, start_index=None,
+                            ts_last_rec=0, end_index=None):
+        """start reading history records; with start_index the records after
+        that logger index are read, ts_last_rec is then the timestamp of the
+        record at start_index if known.  With end_index the read stops at
+        the record at that index."""
         self.history_cache.clear_records()
         if since_ts is None:
             since_ts = 0
         self.history_cache.since_ts = since_ts
+        self.history_cache.resume_index = start_index
+        self.history_cache.resume_ts = ts_last_rec or 0
+        self.history_cache.end_index = end_index
         if num_rec > KlimaLoggDriver.max_records - 2:
             num_rec = KlimaLoggDriver.max_records - 2
         self.history_cache.num_rec = num_rec
+        self.history_started_ts = time.time()
+        self.history_records_received = 0
         self.command = ACTION_GET_HISTORY
 
     def stopCachingHistory(self):
         self.command = None
 
+    def setCatchupMode(self, weather_refresh):
+        """while history is read ask for current weather only every
+        weather_refresh seconds and do not check for a changed config;
+        None ends catch-up mode"""
+        self.catchup_weather_refresh = weather_refresh
+
     def getUncachedHistoryCount(self):
         return self.history_cache.num_outstanding_records
 
     def getNextHistoryIndex(self):
         return self.history_cache.next_index
 
+    def getHistoryStartIndex(self):
+        return self.history_cache.start_index
+
+    def getLastCachedHistoryIndex(self):
+        return self.history_cache.last_index
+
     def getCachedHistoryCount(self):
         return self.history_cache.num_cached_records
 
@@ -974,6 +1059,9 @@ class CommunicationService(object):
         return self.last_stat.latest_history_index
 
     def getHistoryCacheRecords(self):
+        if self.decoder is not None:
+            # wait for the records that are still being decoded
+            self.decoder.flush()
         return self.history_cache.records
 
     def clearHistoryCache(self):
@@ -987,6 +1075,8 @@ class CommunicationService(object):
             return
         logdbg('startRFThread: spawning RF thread')
         self.running = True
+        if self.decoder is not None:
+            self.decoder.start()
         self.child = threading.Thread(target=self.doRF)
         self.child.setName('RFComm')
         self.child.setDaemon(True)
@@ -996,11 +1086,14 @@ class CommunicationService(object):
         self.running = False
         loginf('stopRFThread: waiting for RF thread to terminate')
         self.child.join(self.thread_wait)
-        if self.child.isAlive():
+        if self.child.is_alive():
+            # the decoder keeps running for the jobs the RF thread queues
             logerr('unable to terminate RF thread after %d seconds' %
                    self.thread_wait)
         else:
             self.child = None
+            if self.decoder is not None:
+                self.decoder.stop()
 
     def isRunning(self):
         return self.running
@@ -1017,6 +1110,8 @@ class CommunicationService(object):
                 self.doRFCommunication()
         except Exception as e:
             logerr('exception in doRF: %s' % e)
+            if self.trace is not None:
+                self.trace.dump(logerr)
             self.running = False
             raise
         finally:
@@ -1040,6 +1135,7 @@ class CommunicationService(object):
         self.setSleep(0.075, 0.005)
 
     def doRFCommunication(self):
+        self.prepareACK()
         time.sleep(self.firstSleep)
         self.pollCount = 0
         while self.running:
@@ -1053,27 +1149,79 @@ class CommunicationService(object):
             self.pollCount += 1
             if statebuf[0] == 0x16:
                 break
+            if (self.last_reply is not None and time.perf_counter() -
+                    self.last_reply[0] > self.silence_timeout):
+                # counted now, the console may not send anything again
+                self.countOutcome(time.perf_counter(), 'silence')
             time.sleep(self.nextSleep)
         else:
             return
 
+        ready = time.perf_counter()
+        self.metrics.polls.observe(self.pollCount)
         framelen, framebuf = self.hid.getFrame()
+        resp = RESPONSE_NAMES.get(framebuf[3] & 0xF0, 'unknown')
+        self.metrics.frames.inc(resp)
         try:
+            start = time.perf_counter()
             framelen, framebuf = self.generateResponse(framelen, framebuf)
+            self.metrics.handler_time.observe(time.perf_counter() - start, resp)
             self.hid.setFrame(framelen, framebuf)
             self.hid.setTX()
+            sent = time.perf_counter()
+            latency = sent - ready
+            self.metrics.response_latency.observe(latency, resp)
+            self.countOutcome(ready, 'ok')
+            if latency > self.response_deadline:
+                logdbg('late reply to %s frame: %.1f ms (deadline %.1f ms)',
+                       resp, 1000 * latency, 1000 * self.response_deadline)
+                self.metrics.deadline_misses.inc(resp)
+                self.last_reply = (sent, 'late')
+            else:
+                self.last_reply = (sent, 'on_time')
         except DataWritten:
             logdbg('SetTime/SetConfig data written')
+            self.countOutcome(ready, 'ok')
             self.hid.setRX()
         except BadResponse as e:
             logerr('generateResponse failed: %s' % e)
+            self.metrics.bad_responses.inc()
+            self.countOutcome(ready, 'bad_response')
+            if self.trace is not None:
+                self.trace.dump(logerr)
             self.hid.setRX()
         except UnknownDeviceId as e:
+            self.metrics.unknown_devices.inc()
+            self.countOutcome(ready, 'unknown_device')
             if self.config_serial is None:
                 logerr("%s; use parameter 'serial' if more than one USB transceiver present" % e)
             self.hid.setRX()
 
+    def countOutcome(self, ready, outcome):
+        """count what followed the last reply: the frame that was ready at
+        ready had the given outcome, or it came after a silence.  A silence
+        is also counted while polling, without a frame."""
+        if self.last_reply is None:
+            return
+        sent, reply = self.last_reply
+        self.last_reply = None
+        if ready - sent > self.silence_timeout:
+            outcome = 'silence'
+        self.metrics.exchange_outcomes.inc(reply, outcome)
+        if reply == 'late' and outcome != 'ok':
+            logdbg('late reply was followed by %s', outcome)
+
     # these are for diagnostics and debugging
+    def enableTrace(self, size=1024):
+        self.disableTrace()
+        self.trace = TraceBuffer(size)
+        self.trace.attach(self)
+
+    def disableTrace(self):
+        if self.trace is not None:
+            self.trace.detach()
+            self.trace = None
+
     def setSleep(self, firstsleep, nextsleep):
         self.firstSleep = firstsleep
         self.nextSleep = nextsleep
@@ -1090,6 +1238,17 @@ class CommunicationService(object):
 
 
 class HistoryData(object):
+    """The decoded records of a history frame.  An instance is meant to be
+    reused: read and read_times fill fixed storage for the six positions,
+    so that decoding a frame allocates nothing per field.
+
+    values is a read-only mapping with the names used before, e.g.
+    values['Pos2Temp1'] is temp[2][1]."""
+
+    __slots__ = ('alarm', 'dt', 'ts', 'temp', 'humidity',
+                 'alarm_humidity_hi', 'alarm_humidity_lo', 'alarm_humidity',
+                 'alarm_temp_hi', 'alarm_temp_lo', 'alarm_temp',
+                 'alarm_data', 'alarm_sensor', 'decoded')
 
     BUFMAPHIS = {1: (176,
                      (174,173,171,170,168,167,165,164,162),
@@ -1117,150 +1276,192 @@ class HistoryData(object):
                  5: ( 68, 63, 62, 60, 58, 57, 56, 55, 54),
                  6: ( 40, 35, 34, 32, 30, 29, 28, 27, 26)}
 
+    # labels of the record times in the log messages of Decode
+    LABELS = tuple('HistoryData%d' % i for i in range(0, 7))
+
+    # the keys of a record in as_dict, per sensor
+    RECORD_KEYS = tuple(('Temp%d' % y, 'Humidity%d' % y) for y in range(0, 9))
+
+    # the names of values: name -> (slot, position, sensor or None, alarm)
+    # where alarm is None for the fields of both record types
+    FIELDS = dict(
+        [('Pos%d%s' % (i, suffix), (slot, i, None, alarm))
+         for i in range(1, 7)
+         for suffix, slot, alarm in (
+             ('Alarm', 'alarm', None),
+             ('DT', 'dt', None),
+             ('HumidityHi', 'alarm_humidity_hi', 1),
+             ('HumidityLo', 'alarm_humidity_lo', 1),
+             ('Humidity', 'alarm_humidity', 1),
+             ('TempHi', 'alarm_temp_hi', 1),
+             ('TempLo', 'alarm_temp_lo', 1),
+             ('Temp', 'alarm_temp', 1),
+             ('Alarmdata', 'alarm_data', 1),
+             ('Sensor', 'alarm_sensor', 1))] +
+        [('Pos%d%s%d' % (i, kind, y), (slot, i, y, 0))
+         for i in range(1, 7)
+         for y in range(0, 9)
+         for kind, slot in (('Temp', 'temp'), ('Humidity', 'humidity'))])
+
     def __init__(self):
-        self.values = {}
+        # all fields are indexed by position 1-6, index 0 is not used.  A
+        # read overwrites only the fields of the record type at a position,
+        # the others keep the values of an earlier frame.
+        t_np = SensorLimits.temperature_NP
+        h_np = SensorLimits.humidity_NP
+        self.alarm = [0] * 7
+        self.dt = [datetime(1900, 1, 1, 0, 0)] * 7
+        self.ts = [TS_1900] * 7
+        # history records
+        self.temp = [[t_np] * 9 for _ in range(0, 7)]
+        self.humidity = [[h_np] * 9 for _ in range(0, 7)]
+        # alarm records
+        self.alarm_humidity_hi = [h_np] * 7
+        self.alarm_humidity_lo = [h_np] * 7
+        self.alarm_humidity = [h_np] * 7
+        self.alarm_temp_hi = [t_np] * 7
+        self.alarm_temp_lo = [t_np] * 7
+        self.alarm_temp = [t_np] * 7
+        self.alarm_data = [0] * 7
+        self.alarm_sensor = [0] * 7
+        # False after read_times, the sensor values are not decoded
+        self.decoded = False
+
+    @property
+    def values(self):
+        return HistoryValues(self)
+
+    def set_time(self, i, dt):
+        self.dt[i] = dt
+        self.ts[i] = tuple_to_ts(dt.year, dt.month, dt.day, dt.hour,
+                                 dt.minute, dt.second)
+
+    def read_times(self, buf):
+        """read only the record types and times"""
         for i in range(1, 7):
-            self.values['Pos%dAlarm' % i] = 0
-            self.values['Pos%dDT' % i] = datetime(1900, 1, 1, 0, 0)
-            self.values['Pos%dHumidityHi' % i] = SensorLimits.humidity_NP
-            self.values['Pos%dHumidityLo' % i] = SensorLimits.humidity_NP
-            self.values['Pos%dHumidity' % i] = SensorLimits.humidity_NP
-            self.values['Pos%dTempHi' % i] = SensorLimits.temperature_NP
-            self.values['Pos%dTempLo' % i] = SensorLimits.temperature_NP
-            self.values['Pos%dTemp' % i] = SensorLimits.temperature_NP
-            self.values['Pos%dAlarmdata' % i] = 0
-            self.values['Pos%dSensor' % i] = 0
-            for j in range(0, 9):
-                self.values['Pos%dTemp%d' % (i, j)] = SensorLimits.temperature_NP
-                self.values['Pos%dHumidity%d' % (i, j)] = SensorLimits.humidity_NP
+            if buf[self.BUFMAPALA[i][0]] == 0xee:
+                self.alarm[i] = 1
+                self.set_time(i, Decode.toDateTime10(
+                    buf, self.BUFMAPALA[i][1], 1, self.LABELS[i]))
+            else:
+                self.alarm[i] = 0
+                self.set_time(i, Decode.toDateTime10(
+                    buf, self.BUFMAPHIS[i][0], 1, self.LABELS[i]))
+        self.decoded = False
 
     def read(self, buf):
-        values = {}
+        to_temp = Decode.toTemperature_3_1
+        to_humidity = Decode.toHumidity_2_0
         for i in range(1, 7):
-            values['Pos%dAlarm' % i] = 1 if buf[self.BUFMAPALA[i][0]] == 0xee else 0
-            if values['Pos%dAlarm' % i] == 0:
+            if buf[self.BUFMAPALA[i][0]] != 0xee:
                 # History record
-                values['Pos%dDT' % i] = Decode.toDateTime10(
-                    buf, self.BUFMAPHIS[i][0], 1, 'HistoryData%d' % i)
+                m = self.BUFMAPHIS[i]
+                self.alarm[i] = 0
+                self.set_time(i, Decode.toDateTime10(
+                    buf, m[0], 1, self.LABELS[i]))
+                temp = self.temp[i]
+                humidity = self.humidity[i]
                 for j in range(0, 9):
-                    values['Pos%dTemp%d' % (i, j)] = Decode.toTemperature_3_1(
-                        buf, self.BUFMAPHIS[i][1][j], j % 2)
-                    values['Pos%dHumidity%d' % (i, j)] = Decode.toHumidity_2_0(
-                        buf, self.BUFMAPHIS[i][2][j], 1)
+                    temp[j] = to_temp(buf, m[1][j], j % 2)
+                    humidity[j] = to_humidity(buf, m[2][j], 1)
             else:
                 # Alarm record
-                values['Pos%dDT' % i] = Decode.toDateTime10(
-                    buf, self.BUFMAPALA[i][1], 1, 'HistoryData%d' % i)
-                values['Pos%dHumidityHi' % i] = Decode.toHumidity_2_0(
-                    buf, self.BUFMAPALA[i][8], 1)
-                values['Pos%dHumidityLo' % i] = Decode.toHumidity_2_0(
-                    buf, self.BUFMAPALA[i][7], 1)
-                values['Pos%dHumidity' % i] = Decode.toHumidity_2_0(
-                    buf, self.BUFMAPALA[i][6], 1)
-                values['Pos%dTempHi' % i] = Decode.toTemperature_3_1(
-                    buf, self.BUFMAPALA[i][5], 1)
-                values['Pos%dTempLo' % i] = Decode.toTemperature_3_1(
-                    buf, self.BUFMAPALA[i][4], 0)
-                values['Pos%dTemp' % i] = Decode.toTemperature_3_1(
-                    buf, self.BUFMAPALA[i][3], 0)
-                values['Pos%dAlarmdata' % i] = (buf[self.BUFMAPALA[i][2]] >> 4) & 0xf
-                values['Pos%dSensor' % i] = buf[self.BUFMAPALA[i][2]] & 0xf
-        self.values = values
+                m = self.BUFMAPALA[i]
+                self.alarm[i] = 1
+                self.set_time(i, Decode.toDateTime10(
+                    buf, m[1], 1, self.LABELS[i]))
+                self.alarm_humidity_hi[i] = to_humidity(buf, m[8], 1)
+                self.alarm_humidity_lo[i] = to_humidity(buf, m[7], 1)
+                self.alarm_humidity[i] = to_humidity(buf, m[6], 1)
+                self.alarm_temp_hi[i] = to_temp(buf, m[5], 1)
+                self.alarm_temp_lo[i] = to_temp(buf, m[4], 0)
+                self.alarm_temp[i] = to_temp(buf, m[3], 0)
+                self.alarm_data[i] = (buf[m[2]] >> 4) & 0xf
+                self.alarm_sensor[i] = buf[m[2]] & 0xf
+        self.decoded = True
 
     def to_log(self):
         last_ts = None
         for i in range(1, 7):
-            if self.values['Pos%dAlarm' % i] == 0:
+            if self.alarm[i] == 0:
                 # History record
-                if self.values['Pos%dDT' % i] != last_ts:
+                if self.dt[i] != last_ts:
+                    temp = self.temp[i]
+                    humidity = self.humidity[i]
                     logdbg("Pos%dDT %s, Pos%dTemp0: %3.1f, Pos%sHumidity0: %3.1f" %
-                           (i, self.values['Pos%dDT' % i],
-                            i, self.values['Pos%dTemp0' % i],
-                            i, self.values['Pos%dHumidity0' % i]))
+                           (i, self.dt[i], i, temp[0], i, humidity[0]))
                     logdbg("Pos%dTemp 1-8:      %3.1f, %3.1f, %3.1f, %3.1f, %3.1f, %3.1f, %3.1f, %3.1f" %
-                           (i,
-                            self.values['Pos%dTemp1' % i],
-                            self.values['Pos%dTemp2' % i],
-                            self.values['Pos%dTemp3' % i],
-                            self.values['Pos%dTemp4' % i],
-                            self.values['Pos%dTemp5' % i],
-                            self.values['Pos%dTemp6' % i],
-                            self.values['Pos%dTemp7' % i],
-                            self.values['Pos%dTemp8' % i]))
+                           ((i,) + tuple(temp[1:])))
                     logdbg("Pos%dHumidity 1-8: %3.0f, %3.0f, %3.0f, %3.0f, %3.0f, %3.0f, %3.0f, %3.0f" %
-                           (i,
-                            self.values['Pos%dHumidity1' % i],
-                            self.values['Pos%dHumidity2' % i],
-                            self.values['Pos%dHumidity3' % i],
-                            self.values['Pos%dHumidity4' % i],
-                            self.values['Pos%dHumidity5' % i],
-                            self.values['Pos%dHumidity6' % i],
-                            self.values['Pos%dHumidity7' % i],
-                            self.values['Pos%dHumidity8' % i]))
-                last_ts = self.values['Pos%dDT' % i]
+                           ((i,) + tuple(humidity[1:])))
+                last_ts = self.dt[i]
             else:
                 # Alarm record
-                if self.values['Pos%dAlarmdata' % i] & 0x1:
+                alarm_data = self.alarm_data[i]
+                if alarm_data & 0x1:
                     logdbg('Alarm=%01x: Humidity%d: %3.0f above/reached Hi-limit (%3.0f) on %s' %
-                           (self.values['Pos%dAlarmdata' % i],
-                            self.values['Pos%dSensor' % i],
-                            self.values['Pos%dHumidity' % i],
-                            self.values['Pos%dHumidityHi' % i],
-                            self.values['Pos%dDT' % i]))
-                if self.values['Pos%dAlarmdata' % i] & 0x2:
+                           (alarm_data, self.alarm_sensor[i],
+                            self.alarm_humidity[i], self.alarm_humidity_hi[i],
+                            self.dt[i]))
+                if alarm_data & 0x2:
                     logdbg('Alarm=%01x: Humidity%d: %3.0f below/reached Lo-limit (%3.0f) on %s' %
-                           (self.values['Pos%dAlarmdata' % i],
-                            self.values['Pos%dSensor' % i],
-                            self.values['Pos%dHumidity' % i],
-                            self.values['Pos%dHumidityLo' % i],
-                            self.values['Pos%dDT' % i]))
-                if self.values['Pos%dAlarmdata' % i] & 0x4:
+                           (alarm_data, self.alarm_sensor[i],
+                            self.alarm_humidity[i], self.alarm_humidity_lo[i],
+                            self.dt[i]))
+                if alarm_data & 0x4:
                     logdbg('Alarm=%01x: Temp%d: %3.1f above/reached Hi-limit (%3.1f) on %s' %
-                           (self.values['Pos%dAlarmdata' % i],
-                            self.values['Pos%dSensor' % i],
-                            self.values['Pos%dTemp' % i],
-                            self.values['Pos%dTempHi' % i],
-                            self.values['Pos%dDT' % i]))
-                if self.values['Pos%dAlarmdata' % i] & 0x8:
+                           (alarm_data, self.alarm_sensor[i],
+                            self.alarm_temp[i], self.alarm_temp_hi[i],
+                            self.dt[i]))
+                if alarm_data & 0x8:
                     logdbg('Alarm=%01x: Temp%d: %3.1f below/reached Lo-limit(%3.1f) on %s' %
-                           (self.values['Pos%dAlarmdata' % i],
-                            self.values['Pos%dSensor' % i],
-                            self.values['Pos%dTemp' % i],
-                            self.values['Pos%dTempLo' % i],
-                            self.values['Pos%dDT' % i]))
+                           (alarm_data, self.alarm_sensor[i],
+                            self.alarm_temp[i], self.alarm_temp_lo[i],
+                            self.dt[i]))
 
     def as_dict(self, x=1):
         """emit historical data as a dict with weewx conventions"""
-        data = {'dateTime': tstr_to_ts(str(self.values['Pos%dDT' % x]))}
-        for y in range(0, 9):
-            data['Temp%d' % y] = self.values['Pos%dTemp%d' % (x, y)]
-            data['Humidity%d' % y] = self.values['Pos%dHumidity%d' % (x, y)]
+        data = {'dateTime': self.ts[x]}
+        temp = self.temp[x]
+        humidity = self.humidity[x]
+        for y, (temp_key, humidity_key) in enumerate(self.RECORD_KEYS):
+            data[temp_key] = temp[y]
+            data[humidity_key] = humidity[y]
         return data
 
 
+class HistoryValues(Mapping):
+    """read-only view of a HistoryData by the names in HistoryData.FIELDS.
+    Like the dict that HistoryData used to build, it has the sensor values
+    of the record type at each position only, and none after read_times."""
 
+    __slots__ = ('data',)
 
+    def __init__(self, data):
+        self.data = data
 
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        slot, i, y, _ = HistoryData.FIELDS[key]
+        v = getattr(self.data, slot)[i]
+        return v if y is None else v[y]
 
+    def __contains__(self, key):
+        field = HistoryData.FIELDS.get(key)
+        if field is None:
+            return False
+        alarm = field[3]
+        return alarm is None or (self.data.decoded and
+                                 self.data.alarm[field[1]] == alarm)
 
+    def __iter__(self):
+        for key in HistoryData.FIELDS:
+            if key in self:
+                yield key
 
-
-
-class HistoryCache:
-    def __init__(self):
-        self.wait_at_start = 1
-        self.clear_records()
-
-    def clear_records(self):
-        self.since_ts = 0
-        self.num_rec = 0
-        self.start_index = None
-        self.next_index = None
-        self.records = []
-        self.num_outstanding_records = None
-        self.num_cached_records = 0
-        self.last_ts = 0
-
+    def __len__(self):
+        return sum(1 for _ in self)
 
 
 
@@ -1269,271 +1470,194 @@ class HistoryCache:
 
 
 
-class Decode(object):
 
-    CHARMAP = (' ', '1', '2', '3', '4', '5', '6', '7', '8', '9',
-               '0', 'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I',
-               'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S',
-               'T', 'U', 'V', 'W', 'X', 'Y', 'Z', '-', '+', '(',
-               ')', 'o', '*', ',', '/', '\\', ' ', '.', ' ', ' ',
-               ' ', ' ', ' ', ' ', ' ', ' ', ' ', ' ', ' ', ' ',
-               ' ', ' ', ' ', '@')
 
-    CHARSTR = "!1234567890ABCDEFGHIJKLMNOPQRSTUVWXYZ-+()o*,/\ ."
+class FrameDecoder(object):
+    """A worker thread that runs the decode jobs of the RF thread.
 
-    @staticmethod
-    def toCharacters3_2(buf, start, startOnHiNibble):
-        """read 3 (4 bits) nibbles, presentation as 2 (6 bit) characters"""
-        if startOnHiNibble:
-            idx1 = ((buf[start + 1] >> 2) & 0x3C) + ((buf[start] >> 2) & 0x3)
-            idx2 = ((buf[start] << 4) & 0x30) + ((buf[start] >> 4) & 0xF)
-        else:
-            idx1 = ((buf[start + 1] << 2) & 0x3C) + ((buf[start + 1] >> 6) & 0x3)
-            idx2 = (buf[start + 1] & 0x30) + (buf[start] & 0xF)
-        return Decode.CHARMAP[idx1] + Decode.CHARMAP[idx2]
+    The RF thread takes from a frame what it needs for the reply (checksum,
+    addresses, record times) and leaves the decoding of the sensor values,
+    the caching and the publishing to the worker."""
 
-    @staticmethod
-    def isOFL2(buf, start, startOnHiNibble):
-        if startOnHiNibble:
-            result = ((buf[start + 0] >>  4) == 15 or
-                      (buf[start + 0] & 0xF) == 15)
-        else:
-            result = ((buf[start + 0] & 0xF) == 15 or
-                      (buf[start + 1] >>  4) == 15)
-        return result
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.thread = None
 
-    @staticmethod
-    def isOFL3(buf, start, startOnHiNibble):
-        if startOnHiNibble:
-            result = ((buf[start + 0] >>  4) == 15 or
-                      (buf[start + 0] & 0xF) == 15 or
-                      (buf[start + 1] >>  4) == 15)
-        else:
-            result = ((buf[start + 0] & 0xF) == 15 or
-                      (buf[start + 1] >>  4) == 15 or
-                      (buf[start + 1] & 0xF) == 15)
-        return result
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.run, name='RFDecode',
+                                       daemon=True)
+        self.thread.start()
 
-    @staticmethod
-    def isOFL5(buf, start, startOnHiNibble):
-        if startOnHiNibble:
-            result = ((buf[start + 0] >>  4) == 15 or
-                      (buf[start + 0] & 0xF) == 15 or
-                      (buf[start + 1] >>  4) == 15 or
-                      (buf[start + 1] & 0xF) == 15 or
-                      (buf[start + 2] >>  4) == 15)
-        else:
-            result = ((buf[start + 0] & 0xF) == 15 or
-                      (buf[start + 1] >>  4) == 15 or
-                      (buf[start + 1] & 0xF) == 15 or
-                      (buf[start + 2] >>  4) == 15 or
-                      (buf[start + 2] & 0xF) == 15)
-        return result
+    def stop(self):
+        if self.thread is None:
+            return
+        self.jobs.put(None)
+        self.thread.join()
+        self.thread = None
 
-    @staticmethod
-    def isErr2(buf, start, startOnHiNibble):
-        if startOnHiNibble:
-            result = ((buf[start + 0] >>  4) >= 10 and
-                      (buf[start + 0] >>  4) != 15 or
-                      (buf[start + 0] & 0xF) >= 10 and
-                      (buf[start + 0] & 0xF) != 15)
-        else:
-            result = ((buf[start + 0] & 0xF) >= 10 and
-                      (buf[start + 0] & 0xF) != 15 or
-                      (buf[start + 1] >>  4) >= 10 and
-                      (buf[start + 1] >>  4) != 15)
-        return result
-        
-    @staticmethod
-    def isErr3(buf, start, startOnHiNibble):
-        if startOnHiNibble:
-            result = ((buf[start + 0] >>  4) >= 10 and
-                      (buf[start + 0] >>  4) != 15 or
-                      (buf[start + 0] & 0xF) >= 10 and
-                      (buf[start + 0] & 0xF) != 15 or
-                      (buf[start + 1] >>  4) >= 10 and
-                      (buf[start + 1] >>  4) != 15)
-        else:
-            result = ((buf[start + 0] & 0xF) >= 10 and
-                      (buf[start + 0] & 0xF) != 15 or
-                      (buf[start + 1] >>  4) >= 10 and
-                      (buf[start + 1] >>  4) != 15 or
-                      (buf[start + 1] & 0xF) >= 10 and
-                      (buf[start + 1] & 0xF) != 15)
-        return result
-        
-    @staticmethod
-    def isErr5(buf, start, startOnHiNibble):
-        if startOnHiNibble:
-            result = ((buf[start + 0] >>  4) >= 10 and
-                      (buf[start + 0] >>  4) != 15 or
-                      (buf[start + 0] & 0xF) >= 10 and
-                      (buf[start + 0] & 0xF) != 15 or
-                      (buf[start + 1] >>  4) >= 10 and
-                      (buf[start + 1] >>  4) != 15 or
-                      (buf[start + 1] & 0xF) >= 10 and
-                      (buf[start + 1] & 0xF) != 15 or
-                      (buf[start + 2] >>  4) >= 10 and
-                      (buf[start + 2] >>  4) != 15)
-        else:
-            result = ((buf[start + 0] & 0xF) >= 10 and
-                      (buf[start + 0] & 0xF) != 15 or
-                      (buf[start + 1] >>  4) >= 10 and
-                      (buf[start + 1] >>  4) != 15 or
-                      (buf[start + 1] & 0xF) >= 10 and
-                      (buf[start + 1] & 0xF) != 15 or
-                      (buf[start + 2] >>  4) >= 10 and
-                      (buf[start + 2] >>  4) != 15 or
-                      (buf[start + 2] & 0xF) >= 10 and
-                      (buf[start + 2] & 0xF) != 15)
-        return result
+    def put(self, fn, *args):
+        self.jobs.put((fn, args))
 
-    @staticmethod
-    def isErr8(buf, start, startOnHiNibble):
-        if startOnHiNibble:
-            result = ((buf[start + 0] >>  4) == 10 and
-                      (buf[start + 0] & 0xF) == 10 and
-                      (buf[start + 1] >>  4) == 4  and
-                      (buf[start + 1] & 0xF) == 10 and
-                      (buf[start + 2] >>  4) == 10 and
-                      (buf[start + 2] & 0xF) == 4  and
-                      (buf[start + 3] >>  4) == 10 and
-                      (buf[start + 3] & 0xF) == 10)
-        else:
-            result = ((buf[start + 0] & 0xF) == 10 and
-                      (buf[start + 1] >>  4) == 10 and
-                      (buf[start + 1] & 0xF) == 4  and
-                      (buf[start + 2] >>  4) == 10 and
-                      (buf[start + 2] & 0xF) == 10 and
-                      (buf[start + 3] >>  4) == 4  and
-                      (buf[start + 3] & 0xF) == 10 and
-                      (buf[start + 4] >>  4) == 10)
-        return result
+    def flush(self):
+        """wait until the queued jobs are done"""
+        if self.thread is not None:
+            self.jobs.join()
 
-    @staticmethod
-    def toInt_1(buf, start, startOnHiNibble):
-        """read 1 nibble"""
-        if startOnHiNibble:
-            rawpre = (buf[start] >> 4)
-        else:
-            rawpre = (buf[start] & 0xF)
-        return rawpre
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                if job is None:
+                    return
+                fn, args = job
+                fn(*args)
+            except Exception as e:
+                logerr('decode failed: %s', e)
+            finally:
+                self.jobs.task_done()
 
-    @staticmethod
-    def toInt_2(buf, start, startOnHiNibble):
-        """read 2 nibbles"""
-        if startOnHiNibble:
-            rawpre = (buf[start] >> 4) * 10 + (buf[start + 0] & 0xF) * 1
-        else:
-            rawpre = (buf[start] & 0xF) * 10 + (buf[start + 1] >> 4) * 1
-        return rawpre
 
-    @staticmethod
-    def toDateTime10(buf, start, startOnHiNibble, label):
-        """read 10 nibbles, presentation as DateTime"""
-        result = None
-        if (Decode.isErr2(buf, start + 0, startOnHiNibble) or
-            Decode.isErr2(buf, start + 1, startOnHiNibble) or
-            Decode.isErr2(buf, start + 2, startOnHiNibble) or
-            Decode.isErr2(buf, start + 3, startOnHiNibble) or
-            Decode.isErr2(buf, start + 4, startOnHiNibble)):
-            logerr('ToDateTime: bogus date for %s: error status in buffer' %
-                   label)
-        else:
-            year    = Decode.toInt_2(buf, start + 0, startOnHiNibble) + 2000
-            month   = Decode.toInt_2(buf, start + 1, startOnHiNibble)
-            days    = Decode.toInt_2(buf, start + 2, startOnHiNibble)
-            hours   = Decode.toInt_2(buf, start + 3, startOnHiNibble)
-            minutes = Decode.toInt_2(buf, start + 4, startOnHiNibble)
-            try:
-                result = datetime(year, month, days, hours, minutes)
-            except ValueError:
-                logerr(('ToDateTime: bogus date for %s:'
-                        ' bad date conversion from'
-                        ' %s %s %s %s %s') %
-                       (label, minutes, hours, days, month, year))
-        if result is None:
-            # FIXME: use None instead of a really old date to indicate invalid
-            result = datetime(1900, 1, 1, 0, 0)
-        return result
+class HistoryCache:
+    def __init__(self):
+        self.wait_at_start = 1
+        self.clear_records()
 
-    @staticmethod
-    def toDateTime8(buf, start, startOnHiNibble, label):
-        """read 8 nibbles, presentation as DateTime"""
-        result = None
-        if Decode.isErr8(buf, start + 0, startOnHiNibble):
-            logerr('ToDateTime: %s: no valid date' % label)
-        else:
-            if startOnHiNibble:
-                year  = Decode.toInt_2(buf, start + 0, 1) + 2000
-                month = Decode.toInt_1(buf, start + 1, 1)
-                days  = Decode.toInt_2(buf, start + 1, 0)
-                tim1  = Decode.toInt_1(buf, start + 2, 0)
-                tim2  = Decode.toInt_1(buf, start + 3, 1)
-                tim3  = Decode.toInt_1(buf, start + 3, 0)
-            else:
-                year  = Decode.toInt_2(buf, start + 0, 0) + 2000
-                month = Decode.toInt_1(buf, start + 1, 0)
-                days  = Decode.toInt_2(buf, start + 2, 1)
-                tim1  = Decode.toInt_1(buf, start + 3, 1)
-                tim2  = Decode.toInt_1(buf, start + 3, 0)
-                tim3  = Decode.toInt_1(buf, start + 4, 1)
-            if tim1 >= 10:
-                hours = tim1 + 10
+    def clear_records(self):
+        self.since_ts = 0
+        self.num_rec = 0
+        self.start_index = None
+        self.next_index = None
+        self.records = []
+        self.num_outstanding_records = None
+        self.num_cached_records = 0
+        self.last_index = None
+        self.last_ts = 0
+        # index of the last record to read, None to read up to the latest
+        self.end_index = None
+        # index and last record timestamp of a resumed download
+        self.resume_index = None
+        self.resume_ts = 0
+
+
+def validate_history_batch(timestamps, since_ts, ts_last_rec, now, limit=None,
+                           ts_floor=0):
+    """Apply the history record checks to a batch of record timestamps.
+
+    The checks that depend only on the record itself are applied to the
+    whole batch first; the checks against the previous good record are then
+    done in one pass that tracks the timestamp of the last accepted record.
+    At most limit records are accepted, good records beyond that are
+    returned as deferred.  Records up to ts_floor are skipped like those up
+    to ts_last_rec, but a gap after ts_floor is accepted: it is the last
+    record of an earlier read, not of this one.
+
+    Returns a tuple (accepted, deferred, skipped, ts_last_rec) with the
+    positions of the accepted and deferred timestamps, a dict with the
+    number of skipped records per reason and the timestamp of the last
+    accepted record."""
+    eldest_ts = CommunicationService.TS_2010_07
+    future_ts = now + 300
+    reasons = [SKIP_TOO_OLD if ts < eldest_ts else
+               SKIP_BEFORE_START if ts < since_ts else
+               SKIP_FUTURE if ts > future_ts else None
+               for ts in timestamps]
+    accepted = []
+    deferred = []
+    skipped = dict()
+    for i, ts in enumerate(timestamps):
+        reason = reasons[i]
+        if reason is None:
+            floor = max(ts_last_rec, ts_floor)
+            if ts == floor:
+                reason = SKIP_DUPLICATE
+            elif ts < floor:
+                reason = SKIP_PAST
+            elif ts_last_rec != 0 and ts > ts_last_rec + 604800:
+                reason = SKIP_GAP
+            elif limit is not None and len(accepted) >= limit:
+                deferred.append(i)
+                continue
             else:
-                hours = tim1
-            if tim2 >= 10:
-                hours += 10
-                minutes = (tim2 - 10) * 10
+                accepted.append(i)
+                ts_last_rec = ts
+                continue
+        skipped[reason] = skipped.get(reason, 0) + 1
+    return accepted, deferred, skipped, ts_last_rec
+
+
+class SensorProjection(object):
+    """A sensor map compiled into the operations that copy the decoded
+    values into a packet.
+
+    Temperatures and humidities are checked against their not-present and
+    outside-factory-limits values, other labels are copied as they are.
+    The battery status of sensor n is a flag that is set when the byte of
+    AlarmData for that sensor equals its mask."""
+
+    def __init__(self, sensor_map):
+        self.limited = []   # (key, label, not present, outside limits)
+        self.plain = []     # (key, label)
+        self.battery = []   # (key, index in AlarmData, mask)
+        for k, label in sensor_map.items():
+            if label.startswith('BatteryStatus'):
+                n = int(label[-1])
+                if n == 0:
+                    self.battery.append((k, 1, 0x80))
+                else:
+                    self.battery.append((k, 0, 1 << (n - 1)))
+            elif label.startswith('Temp'):
+                self.limited.append((k, label, SensorLimits.temperature_NP,
+                                     SensorLimits.temperature_OFL))
+            elif label.startswith('Humidity'):
+                self.limited.append((k, label, SensorLimits.humidity_NP,
+                                     SensorLimits.humidity_OFL))
             else:
-                minutes = tim2 * 10
-            minutes += tim3
-            try:
-                result = datetime(year, month, days, hours, minutes)
-            except ValueError:
-                logerr('ToDateTime: bogus date for %s:'
-                       ' bad date conversion from'
-                       ' %s %s %s %s %s' %
-                       (label, minutes, hours, days, month, year))
-        if result is None:
-            # FIXME: use None instead of a really old date to indicate invalid
-            result = datetime(1900, 1, 1, 0, 0)
-        return result
-
-    @staticmethod
-    def toHumidity_2_0(buf, start, startOnHiNibble):
-        """read 2 nibbles, presentation with 0 decimal"""
-        if Decode.isErr2(buf, start, startOnHiNibble):
-            result = SensorLimits.humidity_NP
-        elif Decode.isOFL2(buf, start, startOnHiNibble):
-            result = SensorLimits.humidity_OFL
-        else:
-            result = Decode.toInt_2(buf, start, startOnHiNibble)
-        return result
-
-    @staticmethod
-    def toTemperature_3_1(buf, start, startOnHiNibble):
-        """read 3 nibbles, presentation with 1 decimal; units of degree C"""
-        if Decode.isErr3(buf, start, startOnHiNibble):
-            result = SensorLimits.temperature_NP
-        elif Decode.isOFL3(buf, start, startOnHiNibble):
-            result = SensorLimits.temperature_OFL
-        else:
-            if startOnHiNibble:
-                rawtemp = (buf[start] >> 4) * 10 \
-                    + (buf[start + 0] & 0xF) * 1 \
-                    + (buf[start + 1] >> 4) * 0.1
+                self.plain.append((k, label))
+        # for CurrentData the readings are taken from its arrays:
+        # (key, array, sensor, not present, outside limits); the other
+        # labels are read through CurrentData.values
+        self.current = []
+        self.current_other = []     # (key, label, not present, outside limits)
+        for k, label, np, ofl in self.limited:
+            field = CurrentData.FIELDS.get(label)
+            if field is not None and field[1] is not None and not field[2]:
+                self.current.append((k, field[0], field[1], np, ofl))
             else:
-                rawtemp = (buf[start] & 0xF) * 10 \
-                    + (buf[start + 1] >> 4) * 1 \
-                    + (buf[start + 1] & 0xF) * 0.1
-            result = rawtemp - SensorLimits.temperature_offset
-        return result
-
-
-
-
+                self.current_other.append((k, label, np, ofl))
+        self.current_other.extend((k, label, None, None)
+                                  for k, label in self.plain)
+
+    def apply(self, values, packet):
+        """add the mapped values to packet and return it"""
+        for k, label, np, ofl in self.limited:
+            if label in values:
+                packet[k] = get_datum_diff(values[label], np, ofl)
+        for k, label in self.plain:
+            if label in values:
+                packet[k] = values[label]
+        if self.battery and 'AlarmData' in values:
+            alarm = values['AlarmData']
+            for k, i, mask in self.battery:
+                packet[k] = 1 if alarm[i] == mask else 0
+        return packet
 
+    def apply_current(self, data, packet):
+        """like apply for a CurrentData, without going through its values"""
+        for k, name, x, np, ofl in self.current:
+            packet[k] = get_datum_diff(getattr(data, name)[x], np, ofl)
+        if self.current_other:
+            values = data.values
+            for k, label, np, ofl in self.current_other:
+                if label in values:
+                    v = values[label]
+                    packet[k] = v if np is None else get_datum_diff(v, np, ofl)
+        alarm = data.alarm_data
+        if alarm is not None:
+            for k, i, mask in self.battery:
+                packet[k] = 1 if alarm[i] == mask else 0
+        return packet
 
 
 class KlimaLoggDriver():
@@ -1542,9 +1666,9 @@ class KlimaLoggDriver():
     # maximum number of history records
     # record number range: 0-51199
     # address range: 0x070000-0x1fffe0
-    max_records = 51200
+    max_records = MAX_RECORDS
 
-    def __init__(self):
+    def __init__(self, **stn_dict):
         """Initialize the station object.
 
         model: Which station model is this?
@@ -1586,26 +1710,150 @@ class KlimaLoggDriver():
         batch_size: Number of records to read in each tranche while reading
         records from the logger.
         [Optional.  Default is 1800]
+
+        timing: Time in ms to wait before polling the transceiver for the
+        next frame.
+        [Optional.  Default is 300]
+
+        transceiver: An object to use instead of the USB transceiver, e.g. a
+        simulated console.
+        [Optional.  Default is None]
+
+        delta_packets: Let genLoopPackets yield only the fields that changed
+        since the previous packet, with a full keyframe every
+        keyframe_interval seconds.  See kloggpro.observation.
+        [Optional.  Default is False]
+
+        keyframe_interval: Seconds between keyframes in delta mode.
+        [Optional.  Default is 300]
+
+        deadband: Minimum change of a sensor value before the new value is
+        passed on; smaller changes are replaced by the last value passed
+        on.  A number for all sensors or a dict from packet key (or
+        pattern like 'temp*') to number.
+        [Optional.  Default is None, no filtering]
+
+        min_interval: Minimum seconds between two values of a sensor, a
+        number or a dict like deadband.
+        [Optional.  Default is None]
+
+        max_interval: Seconds after which a sensor value is passed on even
+        if it did not change, a number or a dict like deadband.
+        [Optional.  Default is None]
+
+        response_deadline: Time in ms from a frame being ready to the reply
+        being sent after which the reply counts as late in the metrics.
+        [Optional.  Default is 100]
+
+        decode_worker: Decode current data and history records in a worker
+        thread instead of the RF thread, which then only reads what it needs
+        to reply to the console.
+        [Optional.  Default is False]
+
+        rf_process: Run the RF communication in a child process, so that the
+        load of the host process does not delay the answers to the console.
+        True for the default multiprocessing start method or the name of a
+        start method.  See kloggpro.rfprocess.
+        [Optional.  Default is False]
+
+        checkpoint_file: File in which the progress of the history download
+        is saved, so that a download that was cut short by a restart goes on
+        where it stopped instead of from an estimate.
+        [Optional.  Default is None]
+
+        checkpoint_interval: Seconds between checkpoints while the records of
+        a batch are handed out.
+        [Optional.  Default is 60]
+
+        catchup_mode: Read the history in genStartupRecords as fast as the
+        console allows: current weather is asked for only every
+        catchup_weather_refresh seconds and a changed config is sent after
+        the catch-up.
+        [Optional.  Default is False]
+
+        catchup_weather_refresh: Seconds between current weather updates in
+        catch-up mode.
+        [Optional.  Default is 300]
+
+        history_order: Order in which genStartupRecords reads the history,
+        oldest_first or newest_first.  newest_first reads the newest
+        history_chunk records first and then the older ones chunk by chunk,
+        so the recent records are there within a minute.  With
+        checkpoint_file a restart reads the older records that are still
+        missing; without it an interrupted newest_first download loses them.
+        A checkpoint of one order is not resumed with the other.
+        [Optional.  Default is oldest_first]
+
+        history_chunk: Number of records read per chunk with newest_first;
+        batch_size does not apply to these chunks.
+        [Optional.  Default is 288]
+
+        state_file: File in which the last current data, station config and
+        link stats are saved at shutdown and every state_interval seconds.
+        They are restored at startup: the observation is available at once,
+        marked stale until the console sends new data, and the config is not
+        read again while its checksum matches.
+        [Optional.  Default is None]
+
+        state_interval: Seconds between saves of the state_file.
+        [Optional.  Default is 300]
         """
         loginf('driver version is %s' % DRIVER_VERSION)
         self.vendor_id          = 0x6666
         self.product_id         = 0x5555
-        self.model              = 'TFA KlimaLogg Pro'
-        self.polling_interval   = 10
-        self.comm_interval      = 8
-        self.logger_channel     = 1
+        self.model              = stn_dict.get('model', 'TFA KlimaLogg Pro')
+        self.polling_interval   = int(stn_dict.get('polling_interval', 10))
+        self.comm_interval      = int(stn_dict.get('comm_interval', 8))
+        self.logger_channel     = int(stn_dict.get('logger_channel', 1))
         logdbg('channel is %s' % self.logger_channel)
-        self.frequency          = 'EU'
+        self.frequency          = stn_dict.get('transceiver_frequency', 'EU')
         logdbg('frequency is %s' % self.frequency)
-        self.config_serial      = None
+        self.config_serial      = stn_dict.get('serial', None)
         if self.config_serial is not None:
             logdbg('serial is %s' % self.config_serial)
-        self.sensor_map         = KL_SENSOR_MAP
+        self.sensor_map         = stn_dict.get('sensor_map', KL_SENSOR_MAP)
         logdbg('sensor map is: %s' % self.sensor_map)
-        self.max_history_records = 51200
+        self.max_history_records = int(stn_dict.get('max_history_records', 51200))
         logdbg('catchup limited to %s records' % self.max_history_records)
-        self.batch_size         = 1800
-        timing                  = 300
+        self.batch_size         = int(stn_dict.get('batch_size', 1800))
+        timing                  = int(stn_dict.get('timing', 300))
+        self.response_deadline  = float(stn_dict.get('response_deadline', 100)) / 1000.0
+        self.transceiver        = stn_dict.get('transceiver', None)
+        self.rf_process         = stn_dict.get('rf_process', False)
+        self.decode_worker      = stn_dict.get('decode_worker', False)
+        self.checkpoint_file    = stn_dict.get('checkpoint_file', None)
+        self.checkpoint_interval = int(stn_dict.get('checkpoint_interval', 60))
+        self.catchup_mode       = stn_dict.get('catchup_mode', False)
+        self.catchup_weather_refresh = int(stn_dict.get('catchup_weather_refresh', 300))
+        self.catchup_report     = None
+        self.state_file         = stn_dict.get('state_file', None)
+        self.state_interval     = int(stn_dict.get('state_interval', 300))
+        self.warm_start = None
+        if self.state_file is not None:
+            self.warm_start = WarmStart(self.state_file)
+        self._last_state_save_ts = 0
+        self.history_order      = stn_dict.get('history_order', 'oldest_first')
+        self.history_chunk      = int(stn_dict.get('history_chunk', 288))
+        self.checkpoint = None
+        if self.checkpoint_file is not None:
+            self.checkpoint = Checkpoint(self.checkpoint_file)
+        self.observation_filter = None
+        if any(stn_dict.get(k) is not None
+               for k in ('deadband', 'min_interval', 'max_interval')):
+            self.observation_filter = DeadbandFilter(
+                stn_dict.get('deadband') or 0,
+                stn_dict.get('min_interval') or 0,
+                stn_dict.get('max_interval'))
+            logdbg('observation filter: deadband=%s min_interval=%s'
+                   ' max_interval=%s', self.observation_filter.deadband,
+                   self.observation_filter.min_interval,
+                   self.observation_filter.max_interval)
+        self.delta_encoder      = None
+        if stn_dict.get('delta_packets', False):
+            self.delta_encoder = DeltaEncoder(
+                int(stn_dict.get('keyframe_interval', 300)))
+            logdbg('delta packets with keyframes every %s s',
+                   self.delta_encoder.keyframe_interval)
         self.first_sleep = float(timing) / 1000.0
         loginf('timing is %s ms (%0.3f s)' % (timing, self.first_sleep))
         self.values = dict()
@@ -1614,6 +1862,7 @@ class KlimaLoggDriver():
 
         now = int(time.time())
         self._service = None
+        self.broker = Broker()
         self._last_obs_ts = None
         self._last_nodata_log_ts = now
         self._nodata_interval = 300  # how often to check for no data
@@ -1685,6 +1934,12 @@ class KlimaLoggDriver():
                     self._empty_packet_count = 0
                     self._last_nodata_log_ts = now
                     self._last_contact_log_ts = now
+                    force = ()
+                    if self.observation_filter is not None:
+                        packet = self.observation_filter.apply(packet)
+                        force = self.observation_filter.emitted
+                    if self.delta_encoder is not None:
+                        packet = self.delta_encoder.encode(packet, force)
                 else:
                     self._empty_packet_count += 1
                     if DEBUG_WEATHER_DATA > 0 and self._empty_packet_count > 1:
@@ -1718,6 +1973,10 @@ class KlimaLoggDriver():
                         loginf(msg)
                         self._last_nodata_log_ts = now
 
+            if (self.warm_start is not None and
+                    now - self._last_state_save_ts >= self.state_interval):
+                self.save_state()
+
             # if no contact with console for awhile, log it
             ts = self.get_last_contact()
             if ts is None or now - ts > self._nocontact_interval:
@@ -1733,9 +1992,40 @@ class KlimaLoggDriver():
             time.sleep(self.polling_interval)                    
 
     def genStartupRecords(self, ts):
+        if self.catchup_mode:
+            self._service.setCatchupMode(self.catchup_weather_refresh)
+        started_ts = time.time()
+        count = 0
+        if self.history_order == 'newest_first':
+            records = self.genHistoryNewestFirst(ts)
+        else:
+            records = self.genHistoryBatches(ts)
+        try:
+            for rec in records:
+                yield rec
+                count += 1
+        finally:
+            if self.catchup_mode and self._service is not None:
+                self._service.setCatchupMode(None)
+            elapsed = time.time() - started_ts
+            rate = count / elapsed if elapsed > 0 else 0.0
+            self.catchup_report = {'records': count,
+                                   'seconds': round(elapsed, 1),
+                                   'records_per_sec': round(rate, 2)}
+            loginf('history catch-up: %d records in %.0f s (%.2f records/s)',
+                   count, elapsed, rate)
+
+    def genHistoryBatches(self, ts):
         loginf('Scanning historical records')
         self.clear_wait_at_start()  # let rf communication start
         first_ts = ts
+        # each batch reads the records after start_index; ts_last_rec is the
+        # timestamp of the last record handed out, so the records up to it
+        # are skipped by the RF thread
+        start_index, committed = self.load_checkpoint(ts)
+        ts_last_rec = ts if start_index is not None else 0
+        prev_ts = ts or None
+        last_save_ts = time.time()
         max_store_period = 300  # do another batch when period to save records is more than max_store_period
         batch_started = False
         records_handled = 0
@@ -1746,7 +2036,9 @@ class KlimaLoggDriver():
             ntries = 0
             last_n = nrem = None
             last_ts = int(time.time())
-            self.start_caching_history(since_ts=first_ts)
+            self.start_caching_history(since_ts=first_ts,
+                                       start_index=start_index,
+                                       ts_last_rec=ts_last_rec)
             while nrem is None or nrem > 0:
                 if ntries >= maxtries:
                     logerr('No historical data after %d tries' % ntries)
@@ -1777,41 +2069,49 @@ class KlimaLoggDriver():
                     break
             self.stop_caching_history()
             records = self.get_history_cache_records()
+            # the records of this batch are after batch_index; until the
+            # batch is done a restart has to read them again
+            batch_index = self.get_history_start_index()
+            end_index = self.get_last_cached_history_index()
+            read_index = self.get_next_history_index()
             self.clear_history_cache()
-            num_received = len(records) - 1
+            num_received = len(records)
+            if records and (prev_ts is None or
+                            records[0]['dateTime'] <= prev_ts):
+                # the first record only gives the interval of the next one
+                num_received -= 1
             logtee('Found %d historical records' % num_received)
-            last_ts = None
             this_ts = None
             for r in records:
                 this_ts = r['dateTime']
                 records_handled += 1
                 logtee("Handle record {}: {}".format(records_handled, this_ts))
-                if last_ts is not None:
+                if prev_ts is not None and this_ts > prev_ts:
                     rec = dict()
                     rec['usUnits'] = 0
                     rec['dateTime'] = this_ts
-                    rec['interval'] = (this_ts - last_ts) / 60
+                    rec['interval'] = (this_ts - prev_ts) / 60
 
                     # get values requested from the sensor map
-                    for k in self.sensor_map:
-                        label = self.sensor_map[k]
-                        if label in r:
-                            if label.startswith('Temp'):
-                                x = get_datum_diff(r[label],
-                                                   SensorLimits.temperature_NP,
-                                                   SensorLimits.temperature_OFL)
-                            elif label.startswith('Humidity'):
-                                x = get_datum_diff(r[label],
-                                                   SensorLimits.humidity_NP,
-                                                   SensorLimits.humidity_OFL)
-                            else:
-                                x = r[label]
-                            rec[k] = x
-                    yield rec
-                last_ts = this_ts
+                    yield self._projection.apply(r, rec)
+                    # the owner asks for the next record after it stored
+                    # this one
+                    committed += 1
+                    if time.time() - last_save_ts >= self.checkpoint_interval:
+                        self.save_checkpoint(batch_index, this_ts, committed)
+                        last_save_ts = time.time()
+                if prev_ts is None or this_ts > prev_ts:
+                    prev_ts = this_ts
+            # continue after the last record of this batch; without one the
+            # next batch starts from an estimate again
+            start_index = end_index
+            if end_index is not None:
+                ts_last_rec = prev_ts
             # go for another scan when store_period is greater than
             # max_store_period
             if this_ts is not None:
+                self.save_checkpoint(end_index, prev_ts, committed)
+                last_save_ts = time.time()
                 store_period = int(time.time()) - this_ts
                 logtee("Saved {} historical records; ts last saved record {}".format(
                        num_received, this_ts))
@@ -1824,20 +2124,264 @@ class KlimaLoggDriver():
                     logtee('Scan the historical records missed during the store period of %d s' % store_period)
                     logtee("The scan will start after the next historical record is received.")
             else:
+                if (not records and batch_index is not None and
+                        read_index is not None and read_index != batch_index):
+                    logerr('No historical record accepted after index %s up'
+                           ' to %s, the records read were all skipped',
+                           batch_index, read_index)
                 store_period = 0
+        # caught up, a restart starts after the owner's last record
+        if self.checkpoint is not None:
+            self.checkpoint.clear()
+
+    def genHistoryNewestFirst(self, ts):
+        """Read the records since ts in chunks of history_chunk records,
+        the newest chunk first, then the records stored meanwhile.  The
+        records of a chunk are oldest first; the first one gets the archive
+        interval of the station as interval.
+
+        After the first chunk the owner's last record is the newest one, so
+        a restart with its timestamp would not read the older records.  The
+        older records still to read are kept in the checkpoint and a restart
+        goes on with them; without checkpoint_file they are lost."""
+        loginf('Scanning historical records, newest first')
+        self.clear_wait_at_start()  # let rf communication start
+        ts = ts or 0
+        if self.wait_for_history(
+                lambda: self.get_latest_history_index() is not None) is None:
+            return
+        if self.checkpoint is None:
+            loginf('no checkpoint_file: if the download is cut short, the'
+                   ' records older than the ones read are not read later')
+        interval = (self.get_config_view().history_interval_seconds or
+                    60 * 15) // 60
+        limit = min(self.max_history_records, KlimaLoggDriver.max_records - 2)
+        state = self.load_backfill(ts)
+        if state is None:
+            # the records after since and up to latest are read back to
+            # front: the chunk before end is next, the records of the
+            # chunks read so far are from oldest_ts on
+            latest = self.get_latest_history_index()
+            since = ts
+            end = latest
+            newest_ts = None
+            oldest_ts = None
+            covered = 0
+        else:
+            latest = state['latest_index']
+            since = state['since_ts']
+            end = state['end_index']
+            newest_ts = state['newest_ts']
+            oldest_ts = state['oldest_ts']
+            covered = state['covered']
+        while end is not None:
+            self.save_backfill(latest, since, end, newest_ts, oldest_ts,
+                               covered)
+            # each record stored meanwhile overwrites the eldest one
+            stored = KlimaLoggDriver.max_records - 2 - get_index(
+                self.get_latest_history_index() - latest)
+            size = min(self.history_chunk, min(limit, stored) - covered)
+            if size <= 0:
+                break
+            start = get_index(end - size)
+            records = self.read_history_chunk(since, start, end)
+            if records is None:
+                return
+            # nothing of a chunk is deferred, see handleHistoryData
+            covered += size
+            end = start
+            # records newer than the previous chunk were stored meanwhile
+            records = [r for r in records if r['dateTime'] > since and
+                       (oldest_ts is None or r['dateTime'] < oldest_ts)]
+            if not records:
+                break
+            oldest_ts = records[0]['dateTime']
+            logtee('Found %d historical records before index %s',
+                   len(records), get_index(start + size))
+            if newest_ts is None:
+                newest_ts = records[-1]['dateTime']
+            prev_ts = records[0]['dateTime'] - 60 * interval
+            for r in records:
+                rec = {'usUnits': 0, 'dateTime': r['dateTime'],
+                       'interval': (r['dateTime'] - prev_ts) / 60}
+                prev_ts = r['dateTime']
+                yield self._projection.apply(r, rec)
+            if records[0]['dateTime'] <= since + 60 * interval:
+                # the next chunk is older than since
+                break
+        # only the records stored while the older ones were read are left
+        self.save_backfill(latest, since, None, newest_ts, oldest_ts, covered)
+        current = self.get_latest_history_index()
+        if newest_ts is not None and current != latest:
+            # after a restart the owner may have some of them already
+            last_ts = max(newest_ts, ts)
+            records = self.read_history_chunk(since, latest, current, last_ts)
+            if records is None:
+                return
+            prev_ts = last_ts
+            for r in records:
+                rec = {'usUnits': 0, 'dateTime': r['dateTime'],
+                       'interval': (r['dateTime'] - prev_ts) / 60}
+                prev_ts = r['dateTime']
+                yield self._projection.apply(r, rec)
+        if self.checkpoint is not None:
+            self.checkpoint.clear()
+
+    def read_history_chunk(self, since_ts, start, end, ts_last_rec=0):
+        """return the records after index start up to index end, None
+        when the console does not send them"""
+        self.start_caching_history(since_ts=since_ts, start_index=start,
+                                   ts_last_rec=ts_last_rec, end_index=end)
+        try:
+            if self.wait_for_history(
+                    lambda: self.get_uncached_history_count() == 0) is None:
+                return None
+        finally:
+            self.stop_caching_history()
+        records = self.get_history_cache_records()
+        self.clear_history_cache()
+        return records
+
+    def wait_for_history(self, done, poll=5, timeout=900):
+        """poll until done() is true or nothing was cached for timeout
+        seconds; return True, or None on timeout"""
+        last_n = None
+        last_ts = time.time()
+        while not done():
+            time.sleep(poll)
+            n = self.get_cached_history_count()
+            if n != last_n:
+                last_n = n
+                last_ts = time.time()
+            elif time.time() - last_ts > timeout:
+                logerr('No historical data for %d seconds', timeout)
+                return None
+        return True
+
+    def restore_state(self):
+        if self.warm_start is None:
+            return
+        state = self.warm_start.load()
+        if state is None:
+            return
+        try:
+            self._service.restoreWarmState(state)
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            logerr('cannot restore state from %s: %s', self.state_file, e)
+            return
+        # the restored observation is not a new one for genLoopPackets
+        self._last_obs_ts = state.get('current_ts')
+        self._last_state_save_ts = time.time()
+        loginf('restored state saved at %s from %s', state.get('saved_ts'),
+               self.state_file)
+
+    def save_state(self):
+        if self.warm_start is None:
+            return
+        self._last_state_save_ts = time.time()
+        try:
+            self.warm_start.save(self._service.getWarmState())
+        except (OSError, RuntimeError) as e:
+            logerr('cannot save state to %s: %s', self.state_file, e)
+
+    def load_checkpoint(self, ts):
+        """return (index, records committed) of the checkpoint if the
+        download after ts can resume from it, else (None, 0).  The owner may
+        have stored records after the checkpoint was saved; these are read
+        again and skipped as they are not after ts."""
+        if self.checkpoint is None:
+            return None, 0
+        cp = self.checkpoint.load()
+        if cp is None:
+            return None, 0
+        last_ts = cp.get('last_ts')
+        if (cp.get('order', 'oldest_first') != 'oldest_first' or
+                last_ts is None or not ts or last_ts > ts or
+                cp.get('logger_channel') != self.logger_channel or
+                cp.get('serial') != self.get_transceiver_serial()):
+            loginf('checkpoint %s is not for record %s of this logger,'
+                   ' not resumed', self.checkpoint.path, ts)
+            return None, 0
+        committed = cp.get('records_committed', 0)
+        loginf('resume history download after index %s (%s records'
+               ' committed)', cp['next_index'], committed)
+        return cp['next_index'], committed
+
+    def load_backfill(self, ts):
+        """return the state of a newest_first download cut short that the
+        download after ts can resume, else None"""
+        if self.checkpoint is None:
+            return None
+        cp = self.checkpoint.load()
+        if cp is None or cp.get('order') != 'newest_first':
+            return None
+        if (cp.get('since_ts', 0) > ts or
+                cp.get('logger_channel') != self.logger_channel or
+                cp.get('serial') != self.get_transceiver_serial()):
+            loginf('checkpoint %s is not for record %s of this logger,'
+                   ' not resumed', self.checkpoint.path, ts)
+            return None
+        loginf('resume newest first history download: records before'
+               ' index %s, %s to %s', cp['end_index'], cp['since_ts'],
+               cp['oldest_ts'])
+        return cp
+
+    def save_backfill(self, latest, since, end, newest_ts, oldest_ts,
+                      covered):
+        if self.checkpoint is None:
+            return
+        try:
+            self.checkpoint.save(
+                order='newest_first', latest_index=latest, since_ts=since,
+                end_index=end, newest_ts=newest_ts, oldest_ts=oldest_ts,
+                covered=covered, logger_channel=self.logger_channel,
+                serial=self.get_transceiver_serial())
+        except OSError as e:
+            logerr('cannot save checkpoint %s: %s', self.checkpoint.path, e)
+
+    def save_checkpoint(self, next_index, last_ts, committed):
+        if self.checkpoint is None or next_index is None:
+            return
+        try:
+            self.checkpoint.save(
+                order='oldest_first', next_index=next_index, last_ts=last_ts,
+                records_committed=committed,
+                latest_index=self.get_latest_history_index(),
+                logger_channel=self.logger_channel,
+                serial=self.get_transceiver_serial())
+        except OSError as e:
+            logerr('cannot save checkpoint %s: %s', self.checkpoint.path, e)
 
     def startUp(self):
         if self._service is not None:
             return
-        self._service = CommunicationService(self.first_sleep, self.values,
-                                             self.max_history_records,
-                                             self.batch_size)
+        if self.rf_process:
+            # imported here, multiprocessing is only needed in this mode
+            from .rfprocess import RFProcess
+            start_method = None if self.rf_process is True else self.rf_process
+            self._service = RFProcess(self.first_sleep, self.values,
+                                      self.max_history_records,
+                                      self.batch_size, self.transceiver,
+                                      self.response_deadline,
+                                      self.decode_worker, start_method)
+        else:
+            self._service = CommunicationService(self.first_sleep, self.values,
+                                                 self.max_history_records,
+                                                 self.batch_size,
+                                                 self.transceiver,
+                                                 self.response_deadline,
+                                                 self.decode_worker)
         self._service.setup(self.frequency, self.comm_interval,
                             self.logger_channel, self.vendor_id,
                             self.product_id, self.config_serial)
+        self.restore_state()
+        self._service.publish = self._publish
         self._service.startRFThread()
 
     def shutDown(self):
+        self.broker.close()
+        self.save_state()
+        self._service.metrics.shutdown()
         self._service.stopRFThread()
         self._service.teardown()
         self._service = None
@@ -1869,7 +2413,7 @@ class KlimaLoggDriver():
 
     def get_observation(self):
         data = self._service.getCurrentData()
-        ts = data.values['timestamp']
+        ts = data.timestamp
         if ts is None:
             return None
 
@@ -1877,32 +2421,22 @@ class KlimaLoggDriver():
         # instead of packet = {'usUnits': weewx.METRIC, 'dateTime': ts} i'll use
         # usUnits=0, also on other occurences of usUnits
         packet = {'usUnits': 0, 'dateTime': ts}
+        if data.stale:
+            # restored at startup, the console did not send data yet
+            packet['stale'] = True
 
         # extract the values from the data object
-        for k in self.sensor_map:
-            label = self.sensor_map[k]
-            if label.startswith('BatteryStatus') and 'AlarmData' in data.values:
-                if label == 'BatteryStatus0':
-                    x = 1 if data.values['AlarmData'][1] ^ 0x80 == 0 else 0
-                else:
-                    n = int(label[-1]) - 1
-                    bitmask = 1 << n
-                    x = 1 if data.values['AlarmData'][0] ^ bitmask == 0 else 0
-                packet[k] = x
-            elif label in data.values:
-                if label.startswith('Temp'):
-                    x = get_datum_diff(data.values[label],
-                                       SensorLimits.temperature_NP,
-                                       SensorLimits.temperature_OFL)
-                elif label.startswith('Humidity'):
-                    x = get_datum_diff(data.values[label],
-                                       SensorLimits.humidity_NP,
-                                       SensorLimits.humidity_OFL)
-                else:
-                    x = data.values[label]
-                packet[k] = x
+        return self._projection.apply_current(data, packet)
 
-        return packet
+    @property
+    def sensor_map(self):
+        return self._sensor_map
+
+    @sensor_map.setter
+    def sensor_map(self, sensor_map):
+        """compile the projection whenever a new map is assigned"""
+        self._sensor_map = sensor_map
+        self._projection = SensorProjection(sensor_map)
 
     def get_config(self):
         logdbg('get station configuration')
@@ -1912,8 +2446,14 @@ class KlimaLoggDriver():
             return None
         return cfg
 
-    def start_caching_history(self, since_ts=0, num_rec=0):
-        self._service.startCachingHistory(since_ts, num_rec)
+    def get_config_view(self):
+        """the decoded settings of the station config"""
+        return self._service.getConfigData().getView()
+
+    def start_caching_history(self, since_ts=0, num_rec=0, start_index=None,
+                              ts_last_rec=0, end_index=None):
+        self._service.startCachingHistory(since_ts, num_rec, start_index,
+                                          ts_last_rec, end_index)
 
     def stop_caching_history(self):
         self._service.stopCachingHistory()
@@ -1924,6 +2464,12 @@ class KlimaLoggDriver():
     def get_next_history_index(self):
         return self._service.getNextHistoryIndex()
 
+    def get_history_start_index(self):
+        return self._service.getHistoryStartIndex()
+
+    def get_last_cached_history_index(self):
+        return self._service.getLastCachedHistoryIndex()
+
     def get_latest_history_index(self):
         return self._service.getLatestHistoryIndex()
 
@@ -1939,6 +2485,53 @@ class KlimaLoggDriver():
     def clear_wait_at_start(self):
         self._service.clearWaitAtStart()
 
+    def subscribe(self, name=None, topics=TOPICS, maxsize=1000,
+                  overflow=OVERFLOW_DROP_OLDEST, block_timeout=0.05):
+        """Return a Subscription that receives each new observation packet
+        and each cached history record as (topic, packet) tuples; see
+        kloggpro.broker for the overflow policies."""
+        return self.broker.subscribe(name, topics, maxsize, overflow,
+                                     block_timeout)
+
+    def _publish(self, topic, item):
+        """called in the RF thread with new current data or a history
+        record"""
+        if not self.broker.wants(topic):
+            return
+        if topic == TOPIC_OBSERVATION:
+            ts = item.timestamp
+            if ts is None:
+                return
+            packet = self._projection.apply_current(
+                item, {'usUnits': 0, 'dateTime': ts})
+        else:
+            packet = self._projection.apply(item,
+                                            {'usUnits': 0,
+                                             'dateTime': item['dateTime']})
+        self.broker.publish(topic, packet)
+
+    def get_metrics(self):
+        """Return the RF loop metrics in Prometheus text format."""
+        return self._service.metrics.to_prometheus()
+
+    def start_metrics_server(self, port, host='127.0.0.1'):
+        """Serve the RF loop metrics on http://host:port/metrics."""
+        return self._service.metrics.serve(port, host)
+
+    def enable_trace(self, size=1024):
+        """Keep the last size handled frames in a trace buffer; the trace
+        is logged when a frame is rejected."""
+        self._service.enableTrace(size)
+
+    def disable_trace(self):
+        self._service.disableTrace()
+
+    def dump_trace(self):
+        """Return the trace as a list of lines, oldest first."""
+        if self._service.trace is None:
+            return []
+        return self._service.trace.lines()
+
 
 
 
@@ -1947,6 +2540,21 @@ class KlimaLoggDriver():
 
 
 class CurrentData(object):
+    """The decoded current data.  The readings are kept in arrays indexed
+    by sensor, 0 for the base station.  The times of the minimum and
+    maximum are epoch seconds, None while there is no minimum or maximum.
+
+    values is a read-only mapping with the names used before, e.g.
+    values['Temp1Max'] is temp_max[1] and values['Temp1MaxDT'] is
+    temp_max_ts[1] as a datetime."""
+
+    __slots__ = ('timestamp', 'signal_quality',
+                 'temp', 'temp_min', 'temp_max', 'temp_min_ts', 'temp_max_ts',
+                 'humidity', 'humidity_min', 'humidity_max',
+                 'humidity_min_ts', 'humidity_max_ts',
+                 'alarm_data', 'stale')
+
+    NUM_SENSORS = 9
 
     BUFMAP = {0: ( 26, 28, 29, 18, 22, 15, 16, 17,  7, 11),
               1: ( 50, 52, 53, 42, 46, 39, 40, 41, 31, 35),
@@ -1958,71 +2566,174 @@ class CurrentData(object):
               7: (194,196,197,186,190,183,184,185,175,179),
               8: (218,220,221,210,214,207,208,209,199,203)}
 
+    # labels of the min/max times in the log messages of Decode
+    LABELS = tuple(('Temp%dMax' % x, 'Temp%dMin' % x,
+                    'Humidity%dMax' % x, 'Humidity%dMin' % x)
+                   for x in range(0, 9))
+
+    # the names of values: name -> (slot, sensor or None, is a time)
+    FIELDS = dict(
+        [('timestamp', ('timestamp', None, False)),
+         ('SignalQuality', ('signal_quality', None, False))] +
+        [('%s%d%s' % (kind, x, suffix), (slot, x, suffix.endswith('DT')))
+         for x in range(0, 9)
+         for kind, suffix, slot in (
+             ('Temp', '', 'temp'),
+             ('Temp', 'Max', 'temp_max'),
+             ('Temp', 'MaxDT', 'temp_max_ts'),
+             ('Temp', 'Min', 'temp_min'),
+             ('Temp', 'MinDT', 'temp_min_ts'),
+             ('Humidity', '', 'humidity'),
+             ('Humidity', 'Max', 'humidity_max'),
+             ('Humidity', 'MaxDT', 'humidity_max_ts'),
+             ('Humidity', 'Min', 'humidity_min'),
+             ('Humidity', 'MinDT', 'humidity_min_ts'))] +
+        [('AlarmData', ('alarm_data', None, False))])
+
     def __init__(self):
-        self.values = dict()
-        self.values['timestamp'] = None
-        self.values['SignalQuality'] = None
-        for i in range(0, 9):
-            self.values['Temp%d' % i] = SensorLimits.temperature_NP
-            self.values['Temp%dMax' % i] = SensorLimits.temperature_NP
-            self.values['Temp%dMaxDT'] = None
-            self.values['Temp%dMin' % i] = SensorLimits.temperature_NP
-            self.values['Temp%dMinDT'] = None
-            self.values['Humidity%d' % i] = SensorLimits.humidity_NP
-            self.values['Humidity%dMax' % i] = SensorLimits.humidity_NP
-            self.values['Humidity%dMaxDT'] = None
-            self.values['Humidity%dMin' % i] = SensorLimits.humidity_NP
-            self.values['Humidity%dMinDT'] = None
+        n = self.NUM_SENSORS
+        self.timestamp = None
+        self.signal_quality = None
+        self.temp = [SensorLimits.temperature_NP] * n
+        self.temp_min = [SensorLimits.temperature_NP] * n
+        self.temp_max = [SensorLimits.temperature_NP] * n
+        self.temp_min_ts = [None] * n
+        self.temp_max_ts = [None] * n
+        self.humidity = [SensorLimits.humidity_NP] * n
+        self.humidity_min = [SensorLimits.humidity_NP] * n
+        self.humidity_max = [SensorLimits.humidity_NP] * n
+        self.humidity_min_ts = [None] * n
+        self.humidity_max_ts = [None] * n
+        # None until a frame was read
+        self.alarm_data = None
+        # True for data restored from a warm start file
+        self.stale = False
+
+    @property
+    def values(self):
+        return CurrentValues(self)
 
     def read(self, buf):
-        values = dict()
-        values['timestamp'] = int(time.time() + 0.5)
-        values['SignalQuality'] = buf[4] & 0x7F
+        self.timestamp = int(time.time() + 0.5)
+        self.signal_quality = buf[4] & 0x7F
+        temp_limits = (SensorLimits.temperature_NP,
+                       SensorLimits.temperature_OFL)
+        humidity_limits = (SensorLimits.humidity_NP, SensorLimits.humidity_OFL)
+        to_temp = Decode.toTemperature_3_1
+        to_humidity = Decode.toHumidity_2_0
+        to_dt = Decode.toDateTime8
         for x in range(0, 9):
-            lbl = 'Temp%s' % x
-            values[lbl + 'Max'] = Decode.toTemperature_3_1(buf, self.BUFMAP[x][0], 0)
-            values[lbl + 'Min'] = Decode.toTemperature_3_1(buf, self.BUFMAP[x][1], 1)
-            values[lbl] = Decode.toTemperature_3_1(buf, self.BUFMAP[x][2], 0)
-            values[lbl + 'MaxDT'] = None if values[lbl + 'Max'] == SensorLimits.temperature_NP or values[lbl + 'Max'] == SensorLimits.temperature_OFL else Decode.toDateTime8(buf, self.BUFMAP[x][3], 0, lbl + 'Max')
-            values[lbl + 'MinDT'] = None if values[lbl + 'Min'] == SensorLimits.temperature_NP or values[lbl + 'Min'] == SensorLimits.temperature_OFL else Decode.toDateTime8(buf, self.BUFMAP[x][4], 0, lbl + 'Min')
-            lbl = 'Humidity%s' % x
-            values[lbl + 'Max'] = Decode.toHumidity_2_0(buf, self.BUFMAP[x][5], 1)
-            values[lbl + 'Min'] = Decode.toHumidity_2_0(buf, self.BUFMAP[x][6], 1)
-            values[lbl] = Decode.toHumidity_2_0(buf, self.BUFMAP[x][7], 1)
-            values[lbl + 'MaxDT'] = None if values[lbl + 'Max'] == SensorLimits.humidity_NP or values[lbl + 'Max'] == SensorLimits.humidity_OFL else Decode.toDateTime8(buf, self.BUFMAP[x][8], 1, lbl + 'Max')
-            values[lbl + 'MinDT'] = None if values[lbl + 'Min'] == SensorLimits.humidity_NP or values[lbl + 'Min'] == SensorLimits.humidity_OFL else Decode.toDateTime8(buf, self.BUFMAP[x][9], 1, lbl + 'Min')
-        values['AlarmData'] = buf[223:223 + 12]
-        self.values = values
+            m = self.BUFMAP[x]
+            labels = self.LABELS[x]
+            v = to_temp(buf, m[0], 0)
+            self.temp_max[x] = v
+            self.temp_max_ts[x] = None if v in temp_limits else \
+                datetime_to_ts(to_dt(buf, m[3], 0, labels[0]))
+            v = to_temp(buf, m[1], 1)
+            self.temp_min[x] = v
+            self.temp_min_ts[x] = None if v in temp_limits else \
+                datetime_to_ts(to_dt(buf, m[4], 0, labels[1]))
+            self.temp[x] = to_temp(buf, m[2], 0)
+            v = to_humidity(buf, m[5], 1)
+            self.humidity_max[x] = v
+            self.humidity_max_ts[x] = None if v in humidity_limits else \
+                datetime_to_ts(to_dt(buf, m[8], 1, labels[2]))
+            v = to_humidity(buf, m[6], 1)
+            self.humidity_min[x] = v
+            self.humidity_min_ts[x] = None if v in humidity_limits else \
+                datetime_to_ts(to_dt(buf, m[9], 1, labels[3]))
+            self.humidity[x] = to_humidity(buf, m[7], 1)
+        self.alarm_data = buf[223:223 + 12]
 
     def to_log(self):
-        logdbg("timestamp: %s" % self.values['timestamp'])
-        logdbg("SignalQuality: %3.0f " % self.values['SignalQuality'])
+        values = self.values
+        logdbg("timestamp: %s" % self.timestamp)
+        logdbg("SignalQuality: %3.0f " % self.signal_quality)
         for x in range(0, 9):
-            if self.values['Temp%d' % x] != SensorLimits.temperature_NP:
+            if self.temp[x] != SensorLimits.temperature_NP:
                 logdbg("Temp%d:     %5.1f   Min: %5.1f (%s)   Max: %5.1f (%s)"
-                       % (x, self.values['Temp%s' % x],
-                          self.values['Temp%sMin' % x],
-                          self.values['Temp%sMinDT' % x],
-                          self.values['Temp%sMax' % x],
-                          self.values['Temp%sMaxDT' % x]))
-            if self.values['Humidity%d' % x] != SensorLimits.humidity_NP:
+                       % (x, self.temp[x],
+                          self.temp_min[x], values['Temp%sMinDT' % x],
+                          self.temp_max[x], values['Temp%sMaxDT' % x]))
+            if self.humidity[x] != SensorLimits.humidity_NP:
                 logdbg("Humidity%d: %5.0f   Min: %5.0f (%s)   Max: %5.0f (%s)"
-                       % (x, self.values['Humidity%s' % x],
-                          self.values['Humidity%sMin' % x],
-                          self.values['Humidity%sMinDT' % x],
-                          self.values['Humidity%sMax' % x],
-                          self.values['Humidity%sMaxDT' % x]))
-        byte_str = ' '.join(['%02x' % x for x in self.values['AlarmData']])
+                       % (x, self.humidity[x],
+                          self.humidity_min[x], values['Humidity%sMinDT' % x],
+                          self.humidity_max[x], values['Humidity%sMaxDT' % x]))
+        byte_str = ' '.join(['%02x' % x for x in self.alarm_data])
         logdbg('AlarmData: %s' % byte_str)
 
 
+class CurrentValues(Mapping):
+    """read-only view of a CurrentData by the names in CurrentData.FIELDS.
+    AlarmData is missing until a frame was read."""
+
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __getitem__(self, key):
+        slot, x, is_time = CurrentData.FIELDS[key]
+        v = getattr(self.data, slot)
+        if x is not None:
+            v = v[x]
+            if is_time and v is not None:
+                v = datetime.fromtimestamp(v)
+        elif v is None and slot == 'alarm_data':
+            raise KeyError(key)
+        return v
+
+    def __contains__(self, key):
+        if key == 'AlarmData':
+            return self.data.alarm_data is not None
+        return key in CurrentData.FIELDS
+
+    def __iter__(self):
+        for key in CurrentData.FIELDS:
+            if key in self:
+                yield key
 
+    def __len__(self):
+        n = len(CurrentData.FIELDS)
+        return n if self.data.alarm_data is not None else n - 1
 
 
 
 
 
 
+
+
+
+class StationConfigView(object):
+    """The decoded settings of a StationConfig.  Built once per config
+    received, not per frame.  history_interval_seconds is None until a
+    config was read."""
+
+    def __init__(self, values):
+        settings = int(values['Settings'])
+        self.settings = settings
+        self.contrast = (settings >> 4) & 0x0F
+        self.alert = settings & 0x8 == 0
+        self.dcf_reception = settings & 0x4 != 0
+        self.time_format = '24h' if settings & 0x2 == 0 else '12h'
+        self.temp_format = 'C' if settings & 0x1 == 0 else 'F'
+        time_zone = int(values.get('TimeZone', 0))
+        self.time_zone = time_zone if time_zone <= 12 else time_zone - 256
+        self.history_interval = values['HistoryInterval']
+        self.history_interval_minutes = history_intervals.get(
+            self.history_interval)
+        self.checksum_in = values['InBufCS']
+        if self.checksum_in == 0 or self.history_interval_minutes is None:
+            self.history_interval_seconds = None
+        else:
+            self.history_interval_seconds = 60 * self.history_interval_minutes
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
 class StationConfig(object):
 
     BUFMAP = {0: ( 8, 11, 14, 17, 20, 23, 26, 29, 32),
@@ -2035,6 +2746,7 @@ class StationConfig(object):
         self.values = dict()
         self.set_values = dict()
         self.read_config_sensor_texts = True
+        self.view = None
         self.values['InBufCS'] = 0  # checksum of received config
         self.values['OutBufCS'] = 0  # calculated checksum from outbuf config
         self.values['Settings'] = 0
@@ -2059,6 +2771,12 @@ class StationConfig(object):
     def getInBufCS(self):
         return self.values['InBufCS']
 
+    def getView(self):
+        """the decoded settings, rebuilt after a new config was read"""
+        if self.view is None:
+            self.view = StationConfigView(self.values)
+        return self.view
+
     def setAlarmClockOffset(self):
         # set Humidity Lo alarm when stations clock is too way off
         self.values['Humidity0Min'] = 99
@@ -2184,6 +2902,7 @@ class StationConfig(object):
         # checksum is not calculated for ResetHiLo (Output only)
         values['OutBufCS'] = calc_checksum(buf, 5, end=122) + 7
         self.values = values
+        self.view = None
 
     # FIXME: this has side effects that should be removed
     # FIXME: self.values['HistoryInterval']
@@ -2195,6 +2914,7 @@ class StationConfig(object):
         if self.values['HistoryInterval'] > HI_05MIN:
             logdbg('change HistoryInterval to 5 minutes')
             self.values['HistoryInterval'] = HI_05MIN
+            self.view = None
         newbuf[5] = self.values['Settings']
         newbuf[6] = self.values['TimeZone']
         newbuf[7] = self.values['HistoryInterval']
@@ -2236,19 +2956,16 @@ class StationConfig(object):
         return changed, newbuf
 
     def to_log(self):
-        contrast = (int(self.values['Settings']) >> 4) & 0x0F
-        alert = 'ON' if int(self.values['Settings']) & 0x8 == 0 else 'OFF'
-        dcf_recep = 'OFF' if int(self.values['Settings']) & 0x4 == 0 else 'ON'
-        time_form = '24h' if int(self.values['Settings']) & 0x2 == 0 else '12h'
-        temp_form = 'C' if int(self.values['Settings']) & 0x1 == 0 else 'F'
-        time_zone = self.values['TimeZone'] if int(self.values['TimeZone']) <= 12 else int(self.values['TimeZone']) - 256
-        history_interval = history_intervals.get(self.values['HistoryInterval'])
+        view = self.getView()
         logdbg('OutBufCS: %04x' % self.values['OutBufCS'])
         logdbg('InBufCS:  %04x' % self.values['InBufCS'])
         logdbg('Settings: %02x: contrast: %s, alert: %s, DCF reception: %s, time format: %s, temp format: %s' %
-               (self.values['Settings'], contrast, alert, dcf_recep, time_form, temp_form))
-        logdbg('TimeZone difference with Frankfurt (CET): %02x (tz: %s hour)' % (self.values['TimeZone'], time_zone))
-        logdbg('HistoryInterval: %02x, period: %s minute(s)' % (self.values['HistoryInterval'], history_interval))
+               (view.settings, view.contrast,
+                'ON' if view.alert else 'OFF',
+                'ON' if view.dcf_reception else 'OFF',
+                view.time_format, view.temp_format))
+        logdbg('TimeZone difference with Frankfurt (CET): %02x (tz: %s hour)' % (self.values['TimeZone'], view.time_zone))
+        logdbg('HistoryInterval: %02x, period: %s minute(s)' % (view.history_interval, view.history_interval_minutes))
         byte_str = ' '.join(['%02x' % x for x in self.values['AlarmSet']])
         logdbg('AlarmSet:     %s' % byte_str)
         logdbg('ResetHiLo:    %02x' % self.values['ResetHiLo'])
@@ -2283,6 +3000,11 @@ class TransceiverSettings(object):
         self.device_id = None
 
 
+# the LastStat fields that restoreWarmState restores
+WARM_LAST_STAT = ('last_link_quality', 'last_seen_ts', 'last_weather_ts',
+                  'last_history_ts', 'last_config_ts')
+
+
 class LastStat(object):
     def __init__(self):
         self.last_link_quality = None
@@ -2316,15 +3038,27 @@ class LastStat(object):
 
 
 
+def load_usb():
+    """import pyusb on first use, so that importing the driver does not
+    load the USB backend"""
+    global usb
+    if usb is None:
+        import usb
+    return usb
+
 class Transceiver(object):
     """USB dongle abstraction"""
 
+    # padding for the frame buffers, which are copied by slices
+    zeros = [0] * 0x131
+
     def __init__(self):
         self.devh = None
         self.timeout = 1000
         self.last_dump = None
 
     def open(self, vid, pid, serial):
+        load_usb()
         device = Transceiver._find_device(vid, pid, serial)
         if device is None:
             logerr('Cannot find USB device with Vendor=0x%04x ProdID=0x%04x Serial=%s' % 
@@ -2515,12 +3249,9 @@ class Transceiver(object):
                              timeout=self.timeout)
 
     def setFrame(self, nbytes, data):
-        buf = [0] * 0x111
-        buf[0] = 0xd5
-        buf[1] = nbytes >> 8
-        buf[2] = nbytes
-        for i in range(0, nbytes):
-            buf[i + 3] = data[i]
+        buf = [0xd5, nbytes >> 8, nbytes]
+        buf.extend(data[:nbytes])
+        buf.extend(self.zeros[len(buf):0x111])
         if DEBUG_COMM == 1:
             self.dump('setFrame', buf, 'short')
         elif DEBUG_COMM > 1:
@@ -2540,10 +3271,9 @@ class Transceiver(object):
             value=0x00003d6,
             index=0x0000000,
             timeout=self.timeout)
-        data = [0] * 0x131
         nbytes = (buf[1] << 8 | buf[2]) & 0x1ff
-        for i in range(0, nbytes):
-            data[i] = buf[i + 3]
+        data = list(buf[3:3 + nbytes])
+        data.extend(self.zeros[len(data):0x131])
         if DEBUG_COMM == 1:
             self.dump('getFrame', buf, 'short')
         elif DEBUG_COMM > 1:
@@ -2597,7 +3327,8 @@ class Transceiver(object):
     # as indicated by the length in the message itself for setFrame and
     # getFrame, or the first 16 bytes for any other message.
     def dump(self, cmd, buf, fmt='auto', length=301):
-        strbuf = ''
+        if not isdbg():
+            return
         if fmt == 'auto':
             if buf[0] in [0xd5, 0x00]:
                 msglen = buf[2] + 3        # use msg length for set/get frame
@@ -2607,26 +3338,20 @@ class Transceiver(object):
             msglen = 16
         else:
             msglen = length                # dedicated 'long' length
-        for i, x in enumerate(buf):
-            strbuf += str('%02x ' % x)
-            if (i + 1) % 16 == 0:
-                self.dumpstr(cmd, strbuf)
-                strbuf = ''
-            if msglen is not None and i + 1 >= msglen:
-                break
-        if strbuf:
-            self.dumpstr(cmd, strbuf)
+        data = bytes(bytearray(buf[:msglen]))
+        for i in range(0, len(data), 16):
+            self.dumpstr(cmd, data[i:i + 16].hex(' '))
 
     # filter output that we do not care about, pad the command string.
     def dumpstr(self, cmd, strbuf):
         pad = ' ' * (15 - len(cmd))
         # de15 is idle, de14 is intermediate
-        if strbuf in ['de 15 00 00 00 00 ', 'de 14 00 00 00 00 ']:
+        if strbuf in ['de 15 00 00 00 00', 'de 14 00 00 00 00']:
             if strbuf != self.last_dump or DEBUG_COMM > 2:
-                logdbg('%s: %s%s' % (cmd, pad, strbuf))
+                logdbg('%s: %s%s', cmd, pad, strbuf)
             self.last_dump = strbuf
         else:
-            logdbg('%s: %s%s' % (cmd, pad, strbuf))
+            logdbg('%s: %s%s', cmd, pad, strbuf)
             self.last_dump = None
 
     @staticmethod
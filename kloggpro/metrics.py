@@ -0,0 +1,259 @@
+# Metrics for the KlimaLogg driver
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+# See http://www.gnu.org/licenses/
+
+"""Counters and histograms for the RF loop, exported in Prometheus text
+format.  Updating a metric is a dict lookup and an addition, so the metrics
+are always enabled."""
+
+import threading
+
+# default histogram buckets for durations in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5)
+
+# default histogram buckets for poll counts
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = ['%s="%s"' % (n, v) for n, v in zip(labelnames, labelvalues)]
+    if extra is not None:
+        pairs.append('%s="%s"' % extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(pairs)
+
+
+def _format_value(v):
+    if v == float('inf'):
+        return '+Inf'
+    if isinstance(v, float) and v.is_integer():
+        return '%d' % v
+    return '%s' % v
+
+
+class Counter(object):
+    """a monotonically increasing value, optionally split by labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, doc, labelnames=()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self.values = dict()
+
+    def inc(self, *labelvalues, amount=1):
+        self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def get(self, *labelvalues):
+        return self.values.get(labelvalues, 0)
+
+    def samples(self):
+        for labelvalues, v in list(self.values.items()):
+            yield self.name, _format_labels(self.labelnames, labelvalues), v
+
+
+class Gauge(Counter):
+    """a value that can go up and down, or is read from a function"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, doc, labelnames=(), fn=None):
+        super(Gauge, self).__init__(name, doc, labelnames)
+        self.fn = fn
+
+    def set(self, value, *labelvalues):
+        self.values[labelvalues] = value
+
+    def samples(self):
+        if self.fn is not None:
+            v = self.fn()
+            if v is not None:
+                yield self.name, '', v
+            return
+        for s in super(Gauge, self).samples():
+            yield s
+
+
+class Histogram(object):
+    """counts of observations in cumulative buckets, optionally split by
+    labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.values = dict()
+
+    def observe(self, value, *labelvalues):
+        series = self.values.get(labelvalues)
+        if series is None:
+            # per-bucket counts followed by the count above the last bucket
+            series = [[0] * (len(self.buckets) + 1), 0.0]
+            self.values[labelvalues] = series
+        counts = series[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        series[1] += value
+
+    def count(self, *labelvalues):
+        series = self.values.get(labelvalues)
+        return 0 if series is None else sum(series[0])
+
+    def samples(self):
+        for labelvalues, series in list(self.values.items()):
+            counts, total = list(series[0]), series[1]
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                yield (self.name + '_bucket',
+                       _format_labels(self.labelnames, labelvalues,
+                                      ('le', _format_value(float(bound)))),
+                       cumulative)
+            yield (self.name + '_sum',
+                   _format_labels(self.labelnames, labelvalues), total)
+            yield (self.name + '_count',
+                   _format_labels(self.labelnames, labelvalues), cumulative)
+
+
+class MetricsRegistry(object):
+    """collection of metrics that can be rendered in Prometheus text format"""
+
+    def __init__(self, prefix='kloggpro_'):
+        self.prefix = prefix
+        self.metrics = []
+        self.server = None
+        self.server_thread = None
+
+    def register(self, metric):
+        metric.name = self.prefix + metric.name
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, doc, labelnames=()):
+        return self.register(Counter(name, doc, labelnames))
+
+    def gauge(self, name, doc, labelnames=(), fn=None):
+        return self.register(Gauge(name, doc, labelnames, fn))
+
+    def histogram(self, name, doc, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, doc, labelnames, buckets))
+
+    def to_prometheus(self):
+        """return all metrics in the Prometheus text exposition format"""
+        lines = []
+        for m in self.metrics:
+            lines.append('# HELP %s %s' % (m.name, m.doc))
+            lines.append('# TYPE %s %s' % (m.name, m.kind))
+            for name, labels, value in m.samples():
+                lines.append('%s%s %s' % (name, labels, _format_value(value)))
+        lines.append('')
+        return '\n'.join(lines)
+
+    def export(self, callback):
+        """hand the current metrics text to a callback, e.g. a push gateway
+        client or a file writer"""
+        callback(self.to_prometheus())
+
+    def serve(self, port, host='127.0.0.1'):
+        """serve the metrics on http://host:port/metrics from a daemon
+        thread"""
+        if self.server is not None:
+            return self.server.server_address
+        # imported here, http.server is slow to import and rarely needed
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        self.server = HTTPServer((host, port), Handler)
+        self.server_thread = threading.Thread(target=self.server.serve_forever,
+                                              name='Metrics', daemon=True)
+        self.server_thread.start()
+        return self.server.server_address
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            self.server_thread = None
+
+
+# labels for the response types of the frames received from the console
+RESPONSE_NAMES = {
+    0x10: 'data_written',
+    0x20: 'config',
+    0x30: 'current',
+    0x40: 'history',
+    0x50: 'request',
+}
+
+
+class RFMetrics(MetricsRegistry):
+    """the metrics collected by the CommunicationService"""
+
+    def __init__(self, prefix='kloggpro_'):
+        super(RFMetrics, self).__init__(prefix)
+        self.frames = self.counter(
+            'frames_total', 'Frames received per response type', ('type',))
+        self.bad_responses = self.counter(
+            'bad_responses_total', 'Frames rejected with BadResponse')
+        self.unknown_devices = self.counter(
+            'unknown_device_total', 'Frames from an unknown device ID')
+        self.polls = self.histogram(
+            'state_polls', 'getState polls per received frame',
+            buckets=COUNT_BUCKETS)
+        self.response_latency = self.histogram(
+            'response_latency_seconds',
+            'Time from frame ready (state 0x16) to setTX', ('type',))
+        self.deadline_misses = self.counter(
+            'deadline_misses_total',
+            'Replies sent after the response deadline', ('type',))
+        self.exchange_outcomes = self.counter(
+            'exchange_outcomes_total',
+            'What followed an on-time or late reply: the next frame (ok),'
+            ' a BadResponse, an unknown device ID or silence',
+            ('reply', 'outcome'))
+        self.handler_time = self.histogram(
+            'handler_seconds', 'Time to decode a frame and build the reply',
+            ('type',))
+        self.history_records = self.counter(
+            'history_records_total', 'History records accepted')
+        self.history_skipped = self.counter(
+            'history_skipped_total', 'History records skipped per reason',
+            ('reason',))
+        self.history_rate = self.gauge(
+            'history_records_per_second',
+            'History records accepted per second since caching started')
@@ -0,0 +1,175 @@
+# Observation packet encoding for the KlimaLogg driver
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+# See http://www.gnu.org/licenses/
+
+"""Filtering and delta encoding of the observation packets of
+genLoopPackets.
+
+DeadbandFilter holds a sensor value until it changes by more than a
+deadband, with a minimum and maximum interval between the values it lets
+through.
+
+A delta packet holds usUnits, dateTime and only the fields whose value
+changed since the previous packet.  Every keyframe_interval seconds a
+keyframe with all fields is sent instead.  The 'keyframe' key tells the
+two apart; ObservationState rebuilds the full packets on the receiving
+side."""
+
+import fnmatch
+
+# key that marks a delta packet, True for a keyframe
+KEYFRAME = 'keyframe'
+
+# keys that are part of every packet
+HEADER_KEYS = ('usUnits', 'dateTime')
+
+
+class DeltaEncoder(object):
+    """turns full observation packets into delta packets"""
+
+    def __init__(self, keyframe_interval=300):
+        self.keyframe_interval = keyframe_interval
+        self.last = None
+        self.last_keyframe_ts = None
+
+    def reset(self):
+        """make the next packet a keyframe"""
+        self.last = None
+        self.last_keyframe_ts = None
+
+    def encode(self, packet, force=()):
+        """return the delta packet for packet; the fields in force are
+        included even if they did not change"""
+        ts = packet['dateTime']
+        if (self.last is None or ts < self.last_keyframe_ts or
+                ts - self.last_keyframe_ts >= self.keyframe_interval or
+                packet.keys() != self.last.keys()):
+            self.last = dict(packet)
+            self.last_keyframe_ts = ts
+            delta = dict(packet)
+            delta[KEYFRAME] = True
+            return delta
+        delta = {'usUnits': packet['usUnits'], 'dateTime': ts,
+                 KEYFRAME: False}
+        last = self.last
+        for k, v in packet.items():
+            if (last[k] != v or k in force) and k not in HEADER_KEYS:
+                delta[k] = v
+                last[k] = v
+        last['dateTime'] = ts
+        return delta
+
+
+class DeadbandFilter(object):
+    """Holds each sensor value until it differs from the last emitted value
+    by at least the deadband.
+
+    A value is not emitted sooner than min_interval seconds after the
+    previous one, and is emitted again after max_interval seconds even if
+    it did not change.  A change from or to None (sensor not present) is
+    always a change.  Each option is a number that applies to all sensors
+    or a dict from packet key, or fnmatch pattern like 'temp*', to number.
+
+    apply() returns the packet with the last emitted value of each held
+    sensor; the keys emitted by the last call are in emitted."""
+
+    def __init__(self, deadband=0, min_interval=0, max_interval=None):
+        self.deadband = deadband
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.settings = dict()  # key: (deadband, min_interval, max_interval)
+        self.last = dict()      # key: (value, ts) of the last emitted value
+        self.emitted = []
+
+    @staticmethod
+    def lookup(option, key, default):
+        if not isinstance(option, dict):
+            return default if option is None else option
+        if key in option:
+            return option[key]
+        for pattern, v in option.items():
+            if fnmatch.fnmatchcase(key, pattern):
+                return v
+        return default
+
+    def settings_for(self, key):
+        settings = self.settings.get(key)
+        if settings is None:
+            settings = (self.lookup(self.deadband, key, 0),
+                        self.lookup(self.min_interval, key, 0),
+                        self.lookup(self.max_interval, key, None))
+            self.settings[key] = settings
+        return settings
+
+    def reset(self):
+        self.last.clear()
+        self.emitted = []
+
+    def emit(self, key, value, ts):
+        """True if value is to be emitted for key at ts"""
+        last = self.last.get(key)
+        if last is None:
+            return True
+        deadband, min_interval, max_interval = self.settings_for(key)
+        last_value, last_ts = last
+        elapsed = ts - last_ts
+        if elapsed < 0:
+            # the clock was set back
+            return True
+        if max_interval is not None and elapsed >= max_interval:
+            return True
+        if elapsed < min_interval or value == last_value:
+            return False
+        if value is None or last_value is None:
+            return True
+        try:
+            # allow for the rounding of values with one decimal
+            return abs(value - last_value) + 1e-9 >= deadband
+        except TypeError:
+            return True
+
+    def apply(self, packet):
+        ts = packet['dateTime']
+        result = dict(packet)
+        emitted = []
+        for k, v in packet.items():
+            if k in HEADER_KEYS:
+                continue
+            if self.emit(k, v, ts):
+                self.last[k] = (v, ts)
+                emitted.append(k)
+            else:
+                result[k] = self.last[k][0]
+        self.emitted = emitted
+        return result
+
+
+class ObservationState(object):
+    """rebuilds the full observation from delta packets"""
+
+    def __init__(self):
+        self.state = None
+
+    def apply(self, packet):
+        """update the state with a packet from genLoopPackets and return a
+        copy of the full observation, or None until the first keyframe
+        arrived.  Packets without the 'keyframe' key (the empty packets
+        sent when there is no new data) leave the state unchanged."""
+        if KEYFRAME in packet:
+            if packet[KEYFRAME]:
+                self.state = dict(packet)
+                del self.state[KEYFRAME]
+            elif self.state is not None:
+                self.state.update(packet)
+                del self.state[KEYFRAME]
+        if self.state is None:
+            return None
+        return dict(self.state)
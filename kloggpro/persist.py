@@ -0,0 +1,108 @@
+# Persistent state for the KlimaLogg driver
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+# See http://www.gnu.org/licenses/
+
+"""Crash-safe storage of driver state.
+
+The state is kept in small JSON files.  A file is written to a temporary
+file in the same directory, synced and renamed over the old one, so after
+a crash it holds either the previous or the new state, never a mix.
+
+Checkpoint holds the progress of a history download: the logger index to
+continue from and the timestamp of the last record the owner took; see
+KlimaLoggDriver.genStartupRecords.  WarmStart holds the last current data
+and config frames and the link stats, which the driver restores at startup
+so that it has values before the console is heard from."""
+
+import json
+import os
+import tempfile
+import time
+
+# bumped when the meaning of the fields changes
+VERSION = 1
+
+
+def read_json(path):
+    """return the saved dict, None if there is no valid file"""
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        # missing, unreadable or cut short
+        return None
+    if not isinstance(state, dict) or state.get('version') != VERSION:
+        return None
+    return state
+
+
+def write_json(path, state):
+    state['version'] = VERSION
+    state['saved_ts'] = int(time.time())
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(
+        prefix='.%s.' % os.path.basename(path), dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    # make the rename itself durable
+    try:
+        dirfd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dirfd)
+    except OSError:
+        pass
+    finally:
+        os.close(dirfd)
+
+
+class Checkpoint(object):
+    """the download progress in a JSON file"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        return read_json(self.path)
+
+    def save(self, **state):
+        write_json(self.path, state)
+
+    def clear(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class WarmStart(object):
+    """the state of a CommunicationService in a JSON file, see
+    CommunicationService.getWarmState"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        return read_json(self.path)
+
+    def save(self, state):
+        write_json(self.path, dict(state))
@@ -0,0 +1,487 @@
+# Protocol definitions for the KlimaLogg driver
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+# See http://www.gnu.org/licenses/
+
+"""Constants, helpers and decoders of the KlimaLogg radio protocol.
+
+This module does not import pyusb, so the constants and decoders can be
+used without a transceiver.  Everything is also available from
+kloggpro.klimalogg."""
+
+from datetime import datetime
+import functools
+import logging
+import time
+
+# the decoders log as part of the driver
+log = logging.getLogger(__package__ + '.klimalogg')
+
+def logerr(msg, *args):
+    log.error(msg, *args)
+
+# maximum number of history records
+# record number range: 0-51199
+# address range: 0x070000-0x1fffe0
+MAX_RECORDS = 51200
+
+ACTION_GET_HISTORY = 0x00
+ACTION_REQ_SET_TIME = 0x01
+ACTION_REQ_SET_CONFIG = 0x02
+ACTION_GET_CONFIG = 0x03    #in use!
+ACTION_GET_CURRENT = 0x04
+ACTION_SEND_CONFIG = 0x20
+ACTION_SEND_TIME = 0x60
+
+RESPONSE_DATA_WRITTEN = 0x10
+RESPONSE_GET_CONFIG = 0x20
+RESPONSE_GET_CURRENT = 0x30
+RESPONSE_GET_HISTORY = 0x40
+RESPONSE_REQUEST = 0x50  # the group of all 0x5x requests
+RESPONSE_REQ_READ_HISTORY = 0x50
+RESPONSE_REQ_FIRST_CONFIG = 0x51
+RESPONSE_REQ_SET_CONFIG = 0x52
+RESPONSE_REQ_SET_TIME = 0x53
+
+HI_01MIN = 0
+HI_05MIN = 1
+HI_10MIN = 2
+HI_15MIN = 3
+HI_30MIN = 4
+HI_01STD = 5
+HI_02STD = 6
+HI_03STD = 7
+HI_06STD = 8
+
+history_intervals = {
+    HI_01MIN: 1,
+    HI_05MIN: 5,
+    HI_10MIN: 10,
+    HI_15MIN: 15,
+    HI_30MIN: 30,
+    HI_01STD: 60,
+    HI_02STD: 120,
+    HI_03STD: 180,
+    HI_06STD: 360}
+
+# frequency standards and their associated transmission frequencies
+frequencies = {
+    'US': 905000000,
+    'EU': 868300000,
+}
+
+def bytes_to_addr(a, b, c):
+    return (((a << 8) | b) << 8) | c
+
+def addr_to_index(addr):
+    return (addr - 0x070000) / 32
+
+def index_to_addr(idx):
+    return 32 * idx + 0x070000
+
+def get_datum_diff(v, np, ofl):
+    if abs(np - v) < 0.001 or abs(ofl - v) < 0.001:
+        return None
+    return v
+
+def calc_checksum(buf, start, end=None):
+    if end is None:
+        end = len(buf)
+    cs = 0
+    for i in range(start, end):
+        cs += buf[i]
+    return cs
+
+def get_index(idx):
+    if idx < 0:
+        return idx + MAX_RECORDS
+    elif idx >= MAX_RECORDS:
+        return idx - MAX_RECORDS
+    return idx
+
+def tstr_to_ts(tstr):
+    try:
+        return int(time.mktime(time.strptime(tstr, "%Y-%m-%d %H:%M:%S")))
+    except (OverflowError, ValueError, TypeError):
+        pass
+    return None
+
+def tuple_to_ts(year, month, day, hour=0, minute=0, second=0):
+    """like tstr_to_ts, without parsing a string"""
+    try:
+        return int(time.mktime((year, month, day, hour, minute, second,
+                                0, 1, -1)))
+    except (OverflowError, ValueError):
+        pass
+    return None
+
+@functools.lru_cache(maxsize=256)
+def datetime_to_ts(dt):
+    """like tuple_to_ts for a naive datetime.  Cached, as the same few
+    minimum and maximum times arrive in every current data frame."""
+    return tuple_to_ts(dt.year, dt.month, dt.day, dt.hour, dt.minute,
+                       dt.second)
+
+# date-time of an empty history record
+TS_1900 = tuple_to_ts(1900, 1, 1)
+# eldest valid date-time of a history record
+TS_2010_07 = tuple_to_ts(2010, 7, 1)
+
+# The following classes and methods are adapted from the implementation by
+# eddie de pieri, which is in turn based on the HeavyWeather implementation.
+class BadResponse(Exception):
+    """raised when unexpected data found in frame buffer"""
+    pass
+
+class UnknownDeviceId(Exception):
+    """raised when unknown device ID found in frame buffer"""
+    pass
+
+class DataWritten(Exception):
+    """raised when message 'data written' in frame buffer"""
+    pass
+
+# NP - not present
+# OFL - outside factory limits
+class SensorLimits:
+    temperature_offset = 40.0
+    temperature_NP = 81.1
+    temperature_OFL = 136.0
+    humidity_NP = 110.0
+    humidity_OFL = 121.0
+
+class AX5051RegisterNames:
+    REVISION     = 0x0
+    SCRATCH      = 0x1
+    POWERMODE    = 0x2
+    XTALOSC      = 0x3
+    FIFOCTRL     = 0x4
+    FIFODATA     = 0x5
+    IRQMASK      = 0x6
+    IFMODE       = 0x8
+    PINCFG1      = 0x0C
+    PINCFG2      = 0x0D
+    MODULATION   = 0x10
+    ENCODING     = 0x11
+    FRAMING      = 0x12
+    CRCINIT3     = 0x14
+    CRCINIT2     = 0x15
+    CRCINIT1     = 0x16
+    CRCINIT0     = 0x17
+    FREQ3        = 0x20
+    FREQ2        = 0x21
+    FREQ1        = 0x22
+    FREQ0        = 0x23
+    FSKDEV2      = 0x25
+    FSKDEV1      = 0x26
+    FSKDEV0      = 0x27
+    IFFREQHI     = 0x28
+    IFFREQLO     = 0x29
+    PLLLOOP      = 0x2C
+    PLLRANGING   = 0x2D
+    PLLRNGCLK    = 0x2E
+    TXPWR        = 0x30
+    TXRATEHI     = 0x31
+    TXRATEMID    = 0x32
+    TXRATELO     = 0x33
+    MODMISC      = 0x34
+    FIFOCONTROL2 = 0x37
+    ADCMISC      = 0x38
+    AGCTARGET    = 0x39
+    AGCATTACK    = 0x3A
+    AGCDECAY     = 0x3B
+    AGCCOUNTER   = 0x3C
+    CICDEC       = 0x3F
+    DATARATEHI   = 0x40
+    DATARATELO   = 0x41
+    TMGGAINHI    = 0x42
+    TMGGAINLO    = 0x43
+    PHASEGAIN    = 0x44
+    FREQGAIN     = 0x45
+    FREQGAIN2    = 0x46
+    AMPLGAIN     = 0x47
+    TRKFREQHI    = 0x4C
+    TRKFREQLO    = 0x4D
+    XTALCAP      = 0x4F
+    SPAREOUT     = 0x60
+    TESTOBS      = 0x68
+    APEOVER      = 0x70
+    TMMUX        = 0x71
+    PLLVCOI      = 0x72
+    PLLCPEN      = 0x73
+    PLLRNGMISC   = 0x74
+    AGCMANUAL    = 0x78
+    ADCDCLEVEL   = 0x79
+    RFMISC       = 0x7A
+    TXDRIVER     = 0x7B
+    REF          = 0x7C
+    RXMISC       = 0x7D
+
+
+class Decode(object):
+
+    CHARMAP = (' ', '1', '2', '3', '4', '5', '6', '7', '8', '9',
+               '0', 'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I',
+               'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S',
+               'T', 'U', 'V', 'W', 'X', 'Y', 'Z', '-', '+', '(',
+               ')', 'o', '*', ',', '/', '\\', ' ', '.', ' ', ' ',
+               ' ', ' ', ' ', ' ', ' ', ' ', ' ', ' ', ' ', ' ',
+               ' ', ' ', ' ', '@')
+
+    CHARSTR = "!1234567890ABCDEFGHIJKLMNOPQRSTUVWXYZ-+()o*,/\ ."
+
+    @staticmethod
+    def toCharacters3_2(buf, start, startOnHiNibble):
+        """read 3 (4 bits) nibbles, presentation as 2 (6 bit) characters"""
+        if startOnHiNibble:
+            idx1 = ((buf[start + 1] >> 2) & 0x3C) + ((buf[start] >> 2) & 0x3)
+            idx2 = ((buf[start] << 4) & 0x30) + ((buf[start] >> 4) & 0xF)
+        else:
+            idx1 = ((buf[start + 1] << 2) & 0x3C) + ((buf[start + 1] >> 6) & 0x3)
+            idx2 = (buf[start + 1] & 0x30) + (buf[start] & 0xF)
+        return Decode.CHARMAP[idx1] + Decode.CHARMAP[idx2]
+
+    @staticmethod
+    def isOFL2(buf, start, startOnHiNibble):
+        if startOnHiNibble:
+            result = ((buf[start + 0] >>  4) == 15 or
+                      (buf[start + 0] & 0xF) == 15)
+        else:
+            result = ((buf[start + 0] & 0xF) == 15 or
+                      (buf[start + 1] >>  4) == 15)
+        return result
+
+    @staticmethod
+    def isOFL3(buf, start, startOnHiNibble):
+        if startOnHiNibble:
+            result = ((buf[start + 0] >>  4) == 15 or
+                      (buf[start + 0] & 0xF) == 15 or
+                      (buf[start + 1] >>  4) == 15)
+        else:
+            result = ((buf[start + 0] & 0xF) == 15 or
+                      (buf[start + 1] >>  4) == 15 or
+                      (buf[start + 1] & 0xF) == 15)
+        return result
+
+    @staticmethod
+    def isOFL5(buf, start, startOnHiNibble):
+        if startOnHiNibble:
+            result = ((buf[start + 0] >>  4) == 15 or
+                      (buf[start + 0] & 0xF) == 15 or
+                      (buf[start + 1] >>  4) == 15 or
+                      (buf[start + 1] & 0xF) == 15 or
+                      (buf[start + 2] >>  4) == 15)
+        else:
+            result = ((buf[start + 0] & 0xF) == 15 or
+                      (buf[start + 1] >>  4) == 15 or
+                      (buf[start + 1] & 0xF) == 15 or
+                      (buf[start + 2] >>  4) == 15 or
+                      (buf[start + 2] & 0xF) == 15)
+        return result
+
+    @staticmethod
+    def isErr2(buf, start, startOnHiNibble):
+        if startOnHiNibble:
+            result = ((buf[start + 0] >>  4) >= 10 and
+                      (buf[start + 0] >>  4) != 15 or
+                      (buf[start + 0] & 0xF) >= 10 and
+                      (buf[start + 0] & 0xF) != 15)
+        else:
+            result = ((buf[start + 0] & 0xF) >= 10 and
+                      (buf[start + 0] & 0xF) != 15 or
+                      (buf[start + 1] >>  4) >= 10 and
+                      (buf[start + 1] >>  4) != 15)
+        return result
+        
+    @staticmethod
+    def isErr3(buf, start, startOnHiNibble):
+        if startOnHiNibble:
+            result = ((buf[start + 0] >>  4) >= 10 and
+                      (buf[start + 0] >>  4) != 15 or
+                      (buf[start + 0] & 0xF) >= 10 and
+                      (buf[start + 0] & 0xF) != 15 or
+                      (buf[start + 1] >>  4) >= 10 and
+                      (buf[start + 1] >>  4) != 15)
+        else:
+            result = ((buf[start + 0] & 0xF) >= 10 and
+                      (buf[start + 0] & 0xF) != 15 or
+                      (buf[start + 1] >>  4) >= 10 and
+                      (buf[start + 1] >>  4) != 15 or
+                      (buf[start + 1] & 0xF) >= 10 and
+                      (buf[start + 1] & 0xF) != 15)
+        return result
+        
+    @staticmethod
+    def isErr5(buf, start, startOnHiNibble):
+        if startOnHiNibble:
+            result = ((buf[start + 0] >>  4) >= 10 and
+                      (buf[start + 0] >>  4) != 15 or
+                      (buf[start + 0] & 0xF) >= 10 and
+                      (buf[start + 0] & 0xF) != 15 or
+                      (buf[start + 1] >>  4) >= 10 and
+                      (buf[start + 1] >>  4) != 15 or
+                      (buf[start + 1] & 0xF) >= 10 and
+                      (buf[start + 1] & 0xF) != 15 or
+                      (buf[start + 2] >>  4) >= 10 and
+                      (buf[start + 2] >>  4) != 15)
+        else:
+            result = ((buf[start + 0] & 0xF) >= 10 and
+                      (buf[start + 0] & 0xF) != 15 or
+                      (buf[start + 1] >>  4) >= 10 and
+                      (buf[start + 1] >>  4) != 15 or
+                      (buf[start + 1] & 0xF) >= 10 and
+                      (buf[start + 1] & 0xF) != 15 or
+                      (buf[start + 2] >>  4) >= 10 and
+                      (buf[start + 2] >>  4) != 15 or
+                      (buf[start + 2] & 0xF) >= 10 and
+                      (buf[start + 2] & 0xF) != 15)
+        return result
+
+    @staticmethod
+    def isErr8(buf, start, startOnHiNibble):
+        if startOnHiNibble:
+            result = ((buf[start + 0] >>  4) == 10 and
+                      (buf[start + 0] & 0xF) == 10 and
+                      (buf[start + 1] >>  4) == 4  and
+                      (buf[start + 1] & 0xF) == 10 and
+                      (buf[start + 2] >>  4) == 10 and
+                      (buf[start + 2] & 0xF) == 4  and
+                      (buf[start + 3] >>  4) == 10 and
+                      (buf[start + 3] & 0xF) == 10)
+        else:
+            result = ((buf[start + 0] & 0xF) == 10 and
+                      (buf[start + 1] >>  4) == 10 and
+                      (buf[start + 1] & 0xF) == 4  and
+                      (buf[start + 2] >>  4) == 10 and
+                      (buf[start + 2] & 0xF) == 10 and
+                      (buf[start + 3] >>  4) == 4  and
+                      (buf[start + 3] & 0xF) == 10 and
+                      (buf[start + 4] >>  4) == 10)
+        return result
+
+    @staticmethod
+    def toInt_1(buf, start, startOnHiNibble):
+        """read 1 nibble"""
+        if startOnHiNibble:
+            rawpre = (buf[start] >> 4)
+        else:
+            rawpre = (buf[start] & 0xF)
+        return rawpre
+
+    @staticmethod
+    def toInt_2(buf, start, startOnHiNibble):
+        """read 2 nibbles"""
+        if startOnHiNibble:
+            rawpre = (buf[start] >> 4) * 10 + (buf[start + 0] & 0xF) * 1
+        else:
+            rawpre = (buf[start] & 0xF) * 10 + (buf[start + 1] >> 4) * 1
+        return rawpre
+
+    @staticmethod
+    def toDateTime10(buf, start, startOnHiNibble, label):
+        """read 10 nibbles, presentation as DateTime"""
+        result = None
+        if (Decode.isErr2(buf, start + 0, startOnHiNibble) or
+            Decode.isErr2(buf, start + 1, startOnHiNibble) or
+            Decode.isErr2(buf, start + 2, startOnHiNibble) or
+            Decode.isErr2(buf, start + 3, startOnHiNibble) or
+            Decode.isErr2(buf, start + 4, startOnHiNibble)):
+            logerr('ToDateTime: bogus date for %s: error status in buffer' %
+                   label)
+        else:
+            year    = Decode.toInt_2(buf, start + 0, startOnHiNibble) + 2000
+            month   = Decode.toInt_2(buf, start + 1, startOnHiNibble)
+            days    = Decode.toInt_2(buf, start + 2, startOnHiNibble)
+            hours   = Decode.toInt_2(buf, start + 3, startOnHiNibble)
+            minutes = Decode.toInt_2(buf, start + 4, startOnHiNibble)
+            try:
+                result = datetime(year, month, days, hours, minutes)
+            except ValueError:
+                logerr(('ToDateTime: bogus date for %s:'
+                        ' bad date conversion from'
+                        ' %s %s %s %s %s') %
+                       (label, minutes, hours, days, month, year))
+        if result is None:
+            # FIXME: use None instead of a really old date to indicate invalid
+            result = datetime(1900, 1, 1, 0, 0)
+        return result
+
+    @staticmethod
+    def toDateTime8(buf, start, startOnHiNibble, label):
+        """read 8 nibbles, presentation as DateTime"""
+        result = None
+        if Decode.isErr8(buf, start + 0, startOnHiNibble):
+            logerr('ToDateTime: %s: no valid date' % label)
+        else:
+            if startOnHiNibble:
+                year  = Decode.toInt_2(buf, start + 0, 1) + 2000
+                month = Decode.toInt_1(buf, start + 1, 1)
+                days  = Decode.toInt_2(buf, start + 1, 0)
+                tim1  = Decode.toInt_1(buf, start + 2, 0)
+                tim2  = Decode.toInt_1(buf, start + 3, 1)
+                tim3  = Decode.toInt_1(buf, start + 3, 0)
+            else:
+                year  = Decode.toInt_2(buf, start + 0, 0) + 2000
+                month = Decode.toInt_1(buf, start + 1, 0)
+                days  = Decode.toInt_2(buf, start + 2, 1)
+                tim1  = Decode.toInt_1(buf, start + 3, 1)
+                tim2  = Decode.toInt_1(buf, start + 3, 0)
+                tim3  = Decode.toInt_1(buf, start + 4, 1)
+            if tim1 >= 10:
+                hours = tim1 + 10
+            else:
+                hours = tim1
+            if tim2 >= 10:
+                hours += 10
+                minutes = (tim2 - 10) * 10
+            else:
+                minutes = tim2 * 10
+            minutes += tim3
+            try:
+                result = datetime(year, month, days, hours, minutes)
+            except ValueError:
+                logerr('ToDateTime: bogus date for %s:'
+                       ' bad date conversion from'
+                       ' %s %s %s %s %s' %
+                       (label, minutes, hours, days, month, year))
+        if result is None:
+            # FIXME: use None instead of a really old date to indicate invalid
+            result = datetime(1900, 1, 1, 0, 0)
+        return result
+
+    @staticmethod
+    def toHumidity_2_0(buf, start, startOnHiNibble):
+        """read 2 nibbles, presentation with 0 decimal"""
+        if Decode.isErr2(buf, start, startOnHiNibble):
+            result = SensorLimits.humidity_NP
+        elif Decode.isOFL2(buf, start, startOnHiNibble):
+            result = SensorLimits.humidity_OFL
+        else:
+            result = Decode.toInt_2(buf, start, startOnHiNibble)
+        return result
+
+    @staticmethod
+    def toTemperature_3_1(buf, start, startOnHiNibble):
+        """read 3 nibbles, presentation with 1 decimal; units of degree C"""
+        if Decode.isErr3(buf, start, startOnHiNibble):
+            result = SensorLimits.temperature_NP
+        elif Decode.isOFL3(buf, start, startOnHiNibble):
+            result = SensorLimits.temperature_OFL
+        else:
+            if startOnHiNibble:
+                rawtemp = (buf[start] >> 4) * 10 \
+                    + (buf[start + 0] & 0xF) * 1 \
+                    + (buf[start + 1] >> 4) * 0.1
+            else:
+                rawtemp = (buf[start] & 0xF) * 10 \
+                    + (buf[start + 1] >> 4) * 1 \
+                    + (buf[start + 1] & 0xF) * 0.1
+            result = rawtemp - SensorLimits.temperature_offset
+        return result
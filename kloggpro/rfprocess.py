@@ -0,0 +1,536 @@
+# RF communication in a separate process for the KlimaLogg driver
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+# See http://www.gnu.org/licenses/
+
+"""Run the CommunicationService in a child process.
+
+The RF thread answers each frame of the console within a few milliseconds.
+In the host process it competes for the GIL with everything else the host
+does; in a child process it has an interpreter of its own.
+
+RFProcess has the interface of the CommunicationService that the
+KlimaLoggDriver uses.  The child writes the current data, LastStat, the
+station config and the history cache counters into shared memory in the
+fixed layout of Snapshot, guarded by a sequence lock, so that reading
+them in the host never waits for the child.  Commands go to the child over
+a pipe; history records and a notification for each new observation come
+back over a queue."""
+
+import math
+import multiprocessing
+import multiprocessing.connection
+from multiprocessing import shared_memory
+import queue
+import struct
+import threading
+import time
+
+from .broker import TOPIC_HISTORY, TOPIC_OBSERVATION
+from .klimalogg import (CommunicationService, CurrentData, LastStat,
+                        StationConfig, SensorLimits, logdbg, loginf, logerr)
+
+# the arrays of CurrentData with the readings, stored as doubles
+CURRENT_NUMBERS = ('temp', 'temp_max', 'temp_min',
+                   'humidity', 'humidity_max', 'humidity_min')
+
+# the arrays of CurrentData with the min/max times, stored as epoch seconds
+CURRENT_TIMES = ('temp_max_ts', 'temp_min_ts',
+                 'humidity_max_ts', 'humidity_min_ts')
+
+# the values of the station config that the driver uses
+CONFIG_VALUES = ('InBufCS', 'OutBufCS', 'Settings', 'HistoryInterval',
+                 'TimeZone')
+
+# commands the child passes on to its CommunicationService
+SERVICE_COMMANDS = ('startCachingHistory', 'stopCachingHistory',
+                    'setCatchupMode', 'clearHistoryCache', 'clearWaitAtStart',
+                    'enableTrace', 'disableTrace')
+
+
+def _int(v):
+    return -1 if v is None else v
+
+
+def _from_int(v):
+    return None if v == -1 else v
+
+
+def _number(v):
+    return float('nan') if v is None else v
+
+
+def _from_number(v):
+    return None if math.isnan(v) else v
+
+
+class Snapshot(object):
+    """The state of the CommunicationService in a shared buffer.
+
+    The buffer starts with a sequence number followed by the fields of
+    LAYOUT in little-endian byte order.  The writer makes the sequence
+    number odd while it writes; a reader retries until it gets the same
+    even number before and after copying the fields.  None is stored as -1
+    for integers, NaN for numbers and 0 for the min/max times.  The history indices
+    are numbers, as the driver computes them by division."""
+
+    SEQ = struct.Struct('<Q')
+    LAYOUT = struct.Struct('<' + ''.join((
+        '??i16s',       # transceiver present, registered, device id, serial
+        'idd4q',        # LastStat
+        'ddddiI',       # uncached, start index, next index, last cached
+                        # index, cached, cache generation
+        'iiiii',        # CONFIG_VALUES
+        'qi?',          # timestamp, signal quality, stale
+        'd' * len(CURRENT_NUMBERS) * CurrentData.NUM_SENSORS,
+        'q' * len(CURRENT_TIMES) * CurrentData.NUM_SENSORS,
+        '12s')))        # AlarmData
+    size = SEQ.size + LAYOUT.size
+
+    def __init__(self, buf):
+        self.buf = buf
+        self.seq = 0
+
+    @staticmethod
+    def pack(service, generation):
+        """return the fields for the state of service"""
+        ls = service.last_stat
+        hc = service.history_cache
+        cfg = service.station_config.values
+        cur = service.current
+        serial = service.getTransceiverSerNo() or ''
+        fields = [service.getTransceiverPresent(),
+                  service.getDeviceRegistered(),
+                  _int(service.getDeviceID()),
+                  serial.encode('ascii', 'replace'),
+                  _int(ls.last_link_quality), _number(ls.last_history_index),
+                  _number(ls.latest_history_index), _int(ls.last_seen_ts),
+                  ls.last_weather_ts, ls.last_history_ts, ls.last_config_ts,
+                  _number(hc.num_outstanding_records),
+                  _number(hc.start_index), _number(hc.next_index),
+                  _number(hc.last_index), hc.num_cached_records, generation]
+        fields.extend(cfg[k] for k in CONFIG_VALUES)
+        fields.append(_int(cur.timestamp))
+        fields.append(_int(cur.signal_quality))
+        fields.append(cur.stale)
+        for name in CURRENT_NUMBERS:
+            fields.extend(_number(v) for v in getattr(cur, name))
+        for name in CURRENT_TIMES:
+            fields.extend(v or 0 for v in getattr(cur, name))
+        fields.append(bytes(cur.alarm_data or b''))
+        return fields
+
+    def write(self, fields):
+        seq = self.seq + 1
+        self.SEQ.pack_into(self.buf, 0, seq)
+        self.LAYOUT.pack_into(self.buf, self.SEQ.size, *fields)
+        self.seq = seq + 1
+        self.SEQ.pack_into(self.buf, 0, self.seq)
+
+    def read(self):
+        """return (sequence number, fields) of a consistent copy"""
+        while True:
+            seq = self.SEQ.unpack_from(self.buf, 0)[0]
+            if not seq & 1:
+                data = bytes(self.buf[self.SEQ.size:self.size])
+                if self.SEQ.unpack_from(self.buf, 0)[0] == seq:
+                    return seq, self.LAYOUT.unpack(data)
+            time.sleep(0)
+
+
+class State(object):
+    """the decoded fields of a Snapshot"""
+
+    def __init__(self, fields):
+        it = iter(fields)
+        self.transceiver_present = next(it)
+        self.device_registered = next(it)
+        self.device_id = _from_int(next(it))
+        self.serial_number = next(it).rstrip(b'\0').decode('ascii') or None
+        self.last_stat = LastStat()
+        ls = self.last_stat
+        ls.last_link_quality = _from_int(next(it))
+        ls.last_history_index = _from_number(next(it))
+        ls.latest_history_index = _from_number(next(it))
+        ls.last_seen_ts = _from_int(next(it))
+        ls.last_weather_ts = next(it)
+        ls.last_history_ts = next(it)
+        ls.last_config_ts = next(it)
+        self.num_outstanding_records = _from_number(next(it))
+        self.start_index = _from_number(next(it))
+        self.next_index = _from_number(next(it))
+        self.last_index = _from_number(next(it))
+        self.num_cached_records = next(it)
+        self.generation = next(it)
+        self.station_config = StationConfig()
+        for k in CONFIG_VALUES:
+            self.station_config.values[k] = next(it)
+        cur = self.current = CurrentData()
+        n = CurrentData.NUM_SENSORS
+        timestamp = _from_int(next(it))
+        quality = _from_int(next(it))
+        cur.stale = next(it)
+        numbers = [[next(it) for _ in range(n)] for _ in CURRENT_NUMBERS]
+        times = [[next(it) for _ in range(n)] for _ in CURRENT_TIMES]
+        alarm = next(it)
+        if timestamp is not None:
+            limits = (SensorLimits.humidity_NP, SensorLimits.humidity_OFL)
+            cur.timestamp = timestamp
+            cur.signal_quality = quality
+            for name, array in zip(CURRENT_NUMBERS, numbers):
+                array = [_from_number(v) for v in array]
+                if name.startswith('humidity'):
+                    array = [v if v is None or v in limits else int(v)
+                             for v in array]
+                setattr(cur, name, array)
+            for name, array in zip(CURRENT_TIMES, times):
+                setattr(cur, name, [v or None for v in array])
+            cur.alarm_data = list(alarm)
+
+
+def run_service(shm, conn, events, service_args, setup_args,
+                warm_state=None):
+    """the main function of the child process"""
+    snapshot = Snapshot(shm.buf)
+    service = CommunicationService(*service_args)
+    lock = threading.Lock()
+    generation = [0]
+
+    def write():
+        with lock:
+            snapshot.write(Snapshot.pack(service, generation[0]))
+
+    def publish(topic, item):
+        # called in the RF thread
+        if topic == TOPIC_HISTORY:
+            events.put((generation[0], item))
+        else:
+            write()
+            events.put(None)
+
+    try:
+        service.setup(*setup_args)
+        if warm_state is not None:
+            service.restoreWarmState(warm_state)
+        service.publish = publish
+        service.startRFThread()
+        write()
+    except Exception as e:
+        conn.send(('error', '%s: %s' % (e.__class__.__name__, e)))
+        return
+    conn.send(('ok', None))
+    while True:
+        if not conn.poll(0.1):
+            write()
+            continue
+        name, args = conn.recv()
+        result = None
+        try:
+            if name == 'stop':
+                service.metrics.shutdown()
+                service.stopRFThread()
+                service.teardown()
+                write()
+                conn.send(('ok', None))
+                break
+            if name in ('startCachingHistory', 'clearHistoryCache'):
+                generation[0] += 1
+            if name in SERVICE_COMMANDS:
+                getattr(service, name)(*args)
+            elif name == 'getWarmState':
+                result = service.getWarmState()
+            elif name == 'metrics':
+                result = service.metrics.to_prometheus()
+            elif name == 'serve_metrics':
+                result = service.metrics.serve(*args)
+            elif name == 'shutdown_metrics':
+                service.metrics.shutdown()
+            elif name == 'trace_lines':
+                if service.trace is not None:
+                    result = service.trace.lines()
+            else:
+                raise ValueError('unknown command %s' % name)
+        except Exception as e:
+            conn.send(('error', '%s: %s' % (e.__class__.__name__, e)))
+            continue
+        write()
+        conn.send(('ok', result))
+
+
+class RemoteMetrics(object):
+    """the metrics of the RF loop in the child process"""
+
+    def __init__(self, rf):
+        self.rf = rf
+
+    def to_prometheus(self):
+        return self.rf.call('metrics')
+
+    def serve(self, port, host='127.0.0.1'):
+        return self.rf.call('serve_metrics', port, host)
+
+    def shutdown(self):
+        if self.rf.process is not None:
+            self.rf.call('shutdown_metrics')
+
+
+class RemoteTrace(object):
+    """the trace buffer of the RF loop in the child process"""
+
+    def __init__(self, rf):
+        self.rf = rf
+
+    def lines(self):
+        return self.rf.call('trace_lines') or []
+
+
+class RFProcess(object):
+    """A CommunicationService that runs in a child process.
+
+    start_method is a multiprocessing start method, None for the default
+    of the platform.  With 'spawn' or 'forkserver' the transceiver must
+    be picklable."""
+
+    def __init__(self, first_sleep, values, max_records=51200, batch_size=100,
+                 transceiver=None, response_deadline=0.1, decode_worker=False,
+                 start_method=None, start_timeout=60.0):
+        self.service_args = (first_sleep, dict(values), max_records,
+                             batch_size, transceiver, response_deadline,
+                             decode_worker)
+        self.setup_args = None
+        self.warm_state = None
+        self.context = multiprocessing.get_context(start_method)
+        self.start_timeout = start_timeout
+        self.process = None
+        self.shm = None
+        self.snapshot = None
+        self.conn = None
+        self.events = None
+        self.receiver = None
+        self.running = False
+        self.call_lock = threading.Lock()
+        self.records_cond = threading.Condition()
+        self.records = []
+        self.generation = 0
+        self.state_seq = None
+        self.state = None
+        self.metrics = RemoteMetrics(self)
+        self.trace = None
+        # called as publish(topic, item) with each new CurrentData and
+        # history record
+        self.publish = None
+
+    def setup(self, frequency_standard, comm_interval,
+              logger_channel, vendor_id, product_id, serial):
+        # the transceiver is opened in the child process
+        self.setup_args = (frequency_standard, comm_interval, logger_channel,
+                           vendor_id, product_id, serial)
+
+    def teardown(self):
+        if self.shm is not None:
+            self.snapshot = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def call(self, name, *args):
+        with self.call_lock:
+            if self.process is None:
+                raise RuntimeError('RF process is not running')
+            self.conn.send((name, args))
+            status, result = self.conn.recv()
+        if status != 'ok':
+            raise RuntimeError('RF process: %s' % result)
+        return result
+
+    def startRFThread(self):
+        if self.process is not None:
+            return
+        logdbg('startRFThread: spawning RF process')
+        self.shm = shared_memory.SharedMemory(create=True, size=Snapshot.size)
+        self.shm.buf[:Snapshot.size] = bytes(Snapshot.size)
+        self.snapshot = Snapshot(self.shm.buf)
+        self.conn, child_conn = self.context.Pipe()
+        self.events = self.context.Queue()
+        self.process = self.context.Process(
+            target=run_service, name='RFComm',
+            args=(self.shm, child_conn, self.events, self.service_args,
+                  self.setup_args, self.warm_state))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+        ready = multiprocessing.connection.wait(
+            [self.conn, self.process.sentinel], self.start_timeout)
+        if self.conn not in ready:
+            self.stopProcess()
+            self.teardown()
+            raise RuntimeError('RF process did not start within %s seconds'
+                               % self.start_timeout)
+        status, result = self.conn.recv()
+        if status != 'ok':
+            self.stopProcess()
+            self.teardown()
+            raise RuntimeError('RF process: %s' % result)
+        self.running = True
+        self.receiver = threading.Thread(target=self.receive,
+                                         name='RFEvents', daemon=True)
+        self.receiver.start()
+        loginf('RF communication runs in process %s', self.process.pid)
+
+    def stopRFThread(self):
+        if self.process is None:
+            return
+        loginf('stopRFThread: waiting for RF process to terminate')
+        try:
+            self.call('stop')
+        except (RuntimeError, EOFError, OSError) as e:
+            logerr('stopRFThread: %s', e)
+        self.stopProcess()
+
+    def stopProcess(self):
+        self.running = False
+        self.process.join(self.start_timeout)
+        if self.process.is_alive():
+            logerr('unable to terminate RF process after %d seconds',
+                   self.start_timeout)
+            self.process.terminate()
+        if self.receiver is not None:
+            self.receiver.join()
+            self.receiver = None
+        self.conn.close()
+        self.events.close()
+        self.process = None
+
+    def isRunning(self):
+        return self.running
+
+    def receive(self):
+        """hand the history records and observations of the child to the
+        cache and to publish"""
+        while self.running:
+            try:
+                event = self.events.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            publish = self.publish
+            if event is None:
+                if publish is not None:
+                    publish(TOPIC_OBSERVATION, self.getCurrentData())
+                continue
+            generation, record = event
+            with self.records_cond:
+                if generation != self.generation:
+                    continue
+                self.records.append(record)
+                self.records_cond.notify_all()
+            if publish is not None:
+                publish(TOPIC_HISTORY, record)
+
+    def getState(self):
+        """the decoded snapshot, decoded again only when it changed"""
+        seq, fields = self.snapshot.read()
+        if seq != self.state_seq:
+            self.state = State(fields)
+            self.state_seq = seq
+        return self.state
+
+    # the interface of CommunicationService
+
+    @property
+    def current(self):
+        return self.getCurrentData()
+
+    def getTransceiverPresent(self):
+        return self.getState().transceiver_present
+
+    def getDeviceRegistered(self):
+        return self.getState().device_registered
+
+    def getDeviceID(self):
+        return self.getState().device_id
+
+    def getTransceiverSerNo(self):
+        return self.getState().serial_number
+
+    def getCurrentData(self):
+        return self.getState().current
+
+    def getLastStat(self):
+        return self.getState().last_stat
+
+    def getConfigData(self):
+        return self.getState().station_config
+
+    def getWarmState(self):
+        return self.call('getWarmState')
+
+    def restoreWarmState(self, state):
+        # applied in the child before its RF thread starts
+        self.warm_state = state
+
+    def startCachingHistory(self, since_ts=0, num_rec=0, start_index=None,
+                            ts_last_rec=0, end_index=None):
+        with self.records_cond:
+            self.generation += 1
+            self.records = []
+        self.call('startCachingHistory', since_ts, num_rec, start_index,
+                  ts_last_rec, end_index)
+
+    def stopCachingHistory(self):
+        self.call('stopCachingHistory')
+
+    def setCatchupMode(self, weather_refresh):
+        self.call('setCatchupMode', weather_refresh)
+
+    def getUncachedHistoryCount(self):
+        return self.getState().num_outstanding_records
+
+    def getNextHistoryIndex(self):
+        return self.getState().next_index
+
+    def getHistoryStartIndex(self):
+        return self.getState().start_index
+
+    def getLastCachedHistoryIndex(self):
+        return self.getState().last_index
+
+    def getCachedHistoryCount(self):
+        return self.getState().num_cached_records
+
+    def getLatestHistoryIndex(self):
+        return self.getState().last_stat.latest_history_index
+
+    def getHistoryCacheRecords(self, timeout=2.0):
+        # the records are queued before the counter is updated, wait for
+        # the ones that are still on the way
+        state = self.getState()
+        with self.records_cond:
+            if state.generation == self.generation:
+                self.records_cond.wait_for(
+                    lambda: len(self.records) >= state.num_cached_records,
+                    timeout)
+            return list(self.records)
+
+    def clearHistoryCache(self):
+        with self.records_cond:
+            self.generation += 1
+            self.records = []
+        self.call('clearHistoryCache')
+
+    def clearWaitAtStart(self):
+        self.call('clearWaitAtStart')
+
+    def enableTrace(self, size=1024):
+        self.call('enableTrace', size)
+        self.trace = RemoteTrace(self)
+
+    def disableTrace(self):
+        self.call('disableTrace')
+        self.trace = None
@@ -0,0 +1,340 @@
+# Local socket server for the KlimaLogg driver
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+# See http://www.gnu.org/licenses/
+
+"""Share one transceiver between several local processes.
+
+Only one process can claim the USB transceiver.  Server owns the
+KlimaLoggDriver and answers requests on a Unix domain socket from what the
+driver already received, so clients never touch the radio.
+
+The protocol is line based.  A client sends one request per line and gets
+one JSON document per line back:
+
+    observation             the latest observation packet
+    config                  the station configuration
+    status                  transceiver and cache status
+    history [since [until]] history records with since <= dateTime < until
+
+Errors are answered with {"error": "..."}.  The answers are serialized
+when the data arrives, not per request: observation, config and status
+are kept as ready-made lines and each history record is serialized once,
+so a request costs a dict lookup or a bisect and a join.
+
+    python -m kloggpro.server /run/kloggpro.sock"""
+
+import bisect
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import stat
+import threading
+import time
+
+from .broker import TOPIC_HISTORY, TOPIC_OBSERVATION, OVERFLOW_DROP_OLDEST
+
+log = logging.getLogger(__name__)
+
+REQUESTS = ('observation', 'config', 'status', 'history')
+
+# longest request line accepted
+MAX_REQUEST = 256
+
+
+def serialize(obj):
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+class Server(object):
+    """serves the data of a KlimaLoggDriver on a Unix domain socket
+
+    history_size: number of history records kept for history requests.
+    history_poll: seconds between reads of the new history records from
+    the console, None to keep only the records that the driver reads for
+    its owner."""
+
+    def __init__(self, driver, path, history_size=10000, history_poll=None,
+                 history_timeout=900):
+        self.driver = driver
+        self.path = path
+        self.history_size = history_size
+        self.history_poll = history_poll
+        self.history_timeout = history_timeout
+        self.responses = {'observation': serialize(None),
+                          'config': serialize(None),
+                          'status': serialize(None)}
+        self.history_lock = threading.Lock()
+        self.history_ts = []    # sorted timestamps of the records
+        self.history_json = []  # the serialized records, same order
+        self.fetch_started_ts = None
+        self.last_fetch_ts = 0
+        self.requests = 0
+        self.subscription = None
+        self.server = None
+        self.threads = []
+        self.running = False
+
+    # requests
+
+    def handle(self, line):
+        """return the answer to one request line"""
+        self.requests += 1
+        line = line.strip()
+        fields = line.split()
+        if not fields or fields[0] not in REQUESTS:
+            return serialize({'error': 'unknown request %s' % line[:40]})
+        if fields[0] != 'history':
+            return self.responses[fields[0]]
+        try:
+            since = int(fields[1]) if len(fields) > 1 else 0
+            until = int(fields[2]) if len(fields) > 2 else None
+        except ValueError:
+            return serialize({'error': 'bad history range %s' % line[:40]})
+        return self.history_range(since, until)
+
+    def history_range(self, since, until=None):
+        with self.history_lock:
+            first = bisect.bisect_left(self.history_ts, since)
+            last = (len(self.history_ts) if until is None else
+                    bisect.bisect_left(self.history_ts, until))
+            records = self.history_json[first:last]
+        return b'[' + b','.join(records) + b']\n'
+
+    # data from the driver
+
+    def set_observation(self, packet):
+        self.responses['observation'] = serialize(packet)
+
+    def add_history(self, record):
+        ts = record['dateTime']
+        data = serialize(record)[:-1]
+        with self.history_lock:
+            i = bisect.bisect_left(self.history_ts, ts)
+            if i < len(self.history_ts) and self.history_ts[i] == ts:
+                self.history_json[i] = data
+            else:
+                self.history_ts.insert(i, ts)
+                self.history_json.insert(i, data)
+            extra = len(self.history_ts) - self.history_size
+            if extra > 0:
+                del self.history_ts[:extra]
+                del self.history_json[:extra]
+
+    def refresh(self):
+        """serialize the config and status; called about once a second"""
+        driver = self.driver
+        self.responses['config'] = serialize(driver.get_config())
+        with self.history_lock:
+            n = len(self.history_ts)
+            first_ts = self.history_ts[0] if n else None
+            last_ts = self.history_ts[-1] if n else None
+        self.responses['status'] = serialize({
+            'transceiver_present': driver.transceiver_is_present(),
+            'transceiver_paired': driver.transceiver_is_paired(),
+            'last_contact': driver.get_last_contact(),
+            'history_records': n,
+            'history_first_ts': first_ts,
+            'history_last_ts': last_ts,
+            'fetching_history': self.fetch_started_ts is not None,
+            'dropped': self.subscription.dropped,
+            'requests': self.requests})
+
+    def poll_history(self, now):
+        """read the history records stored since the last poll"""
+        driver = self.driver
+        if self.fetch_started_ts is None:
+            if now - self.last_fetch_ts < self.history_poll:
+                return
+            with self.history_lock:
+                since_ts = self.history_ts[-1] if self.history_ts else 0
+            self.fetch_started_ts = now
+            if since_ts:
+                driver.start_caching_history(since_ts=since_ts)
+            else:
+                driver.start_caching_history(num_rec=self.history_size)
+            return
+        done = (driver.get_uncached_history_count() == 0 and
+                driver.get_next_history_index() ==
+                driver.get_latest_history_index())
+        full = driver.get_cached_history_count() >= driver.batch_size
+        if done or full or now - self.fetch_started_ts > self.history_timeout:
+            if not done and not full:
+                log.info('history read timed out after %d seconds',
+                         now - self.fetch_started_ts)
+            driver.stop_caching_history()
+            driver.clear_history_cache()
+            self.fetch_started_ts = None
+            # a full batch is continued right away
+            self.last_fetch_ts = 0 if full else now
+
+    def feed(self):
+        last_refresh = 0
+        while self.running:
+            try:
+                topic, packet = self.subscription.get(timeout=1.0)
+            except queue.Empty:
+                topic = None
+            if topic == TOPIC_OBSERVATION:
+                self.set_observation(packet)
+            elif topic == TOPIC_HISTORY:
+                self.add_history(packet)
+            now = time.time()
+            if now - last_refresh >= 1.0:
+                last_refresh = now
+                try:
+                    self.refresh()
+                    if self.history_poll is not None:
+                        self.poll_history(now)
+                except Exception as e:
+                    log.error('server: %s', e)
+
+    # socket
+
+    def start(self):
+        if self.running:
+            return
+        self.remove_stale_socket()
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                while True:
+                    line = self.rfile.readline(MAX_REQUEST)
+                    if not line:
+                        return
+                    self.wfile.write(server.handle(
+                        line.decode('utf-8', 'replace')))
+
+        self.subscription = self.driver.subscribe(
+            'server', maxsize=self.history_size, overflow=OVERFLOW_DROP_OLDEST)
+        self.server = socketserver.ThreadingUnixStreamServer(self.path, Handler)
+        self.server.daemon_threads = True
+        self.running = True
+        self.refresh()
+        self.threads = [
+            threading.Thread(target=self.feed, name='ServerFeed', daemon=True),
+            threading.Thread(target=self.server.serve_forever, name='Server',
+                             daemon=True)]
+        for t in self.threads:
+            t.start()
+        log.info('serving on %s', self.path)
+
+    def remove_stale_socket(self):
+        """remove a socket left behind by a server that did not shut down;
+        raise FileExistsError if path is something else or a server still
+        listens on it"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(st.st_mode):
+            raise FileExistsError('%s exists and is not a socket' % self.path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except ConnectionRefusedError:
+            # nobody listens
+            pass
+        else:
+            raise FileExistsError('a server is listening on %s' % self.path)
+        finally:
+            sock.close()
+        os.unlink(self.path)
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self.subscription.close()
+        self.server.shutdown()
+        self.server.server_close()
+        for t in self.threads:
+            t.join()
+        self.threads = []
+        if self.fetch_started_ts is not None:
+            self.driver.stop_caching_history()
+            self.fetch_started_ts = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class Client(object):
+    """a connection to a Server"""
+
+    def __init__(self, path, timeout=10):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.rfile = self.sock.makefile('rb')
+
+    def request(self, line):
+        self.sock.sendall(line.encode('utf-8') + b'\n')
+        answer = json.loads(self.rfile.readline().decode('utf-8'))
+        if isinstance(answer, dict) and 'error' in answer:
+            raise ValueError(answer['error'])
+        return answer
+
+    def observation(self):
+        return self.request('observation')
+
+    def config(self):
+        return self.request('config')
+
+    def status(self):
+        return self.request('status')
+
+    def history(self, since=0, until=None):
+        if until is None:
+            return self.request('history %d' % since)
+        return self.request('history %d %d' % (since, until))
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+def main():
+    import argparse
+    from .klimalogg import KlimaLoggDriver
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('path', help='path of the Unix domain socket')
+    parser.add_argument('--frequency', default='EU')
+    parser.add_argument('--serial', default=None)
+    parser.add_argument('--history-size', type=int, default=10000)
+    parser.add_argument('--history-poll', type=int, default=300,
+                        help='seconds between history reads, 0 to disable')
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    driver = KlimaLoggDriver(transceiver_frequency=options.frequency,
+                             serial=options.serial)
+    driver.clear_wait_at_start()
+    server = Server(driver, options.path, options.history_size,
+                    options.history_poll or None)
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        driver.shutDown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# Trace buffer for the KlimaLogg driver
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+# See http://www.gnu.org/licenses/
+
+"""Fixed-size in-memory trace of the frames handled by the RF loop.
+
+The trace is opt-in: TraceBuffer.attach() wraps generateResponse and the
+handle* methods of a CommunicationService instance, detach() removes the
+wrappers again, so a service without a trace runs the unwrapped methods."""
+
+import collections
+import functools
+import time
+
+# the methods of CommunicationService that are traced
+TRACED_METHODS = ('generateResponse', 'handleConfig', 'handleCurrentData',
+                  'handleHistoryData', 'handleNextAction')
+
+
+class TraceBuffer(object):
+    """ring buffer of (start, duration, method, response type, frame length,
+    action sent) tuples; start is time.monotonic(), the action is the
+    command byte of the reply or the name of the exception raised"""
+
+    def __init__(self, size=1024):
+        self.records = collections.deque(maxlen=size)
+        self.service = None
+
+    def record(self, start, duration, method, resp, length, action):
+        self.records.append((start, duration, method, resp, length, action))
+
+    def wrap(self, method, fn):
+        records = self.records
+
+        @functools.wraps(fn)
+        def traced(length, buf):
+            start = time.monotonic()
+            try:
+                newlen, newbuf = fn(length, buf)
+            except Exception as e:
+                records.append((start, time.monotonic() - start, method,
+                                buf[3] if length > 3 else None, length,
+                                e.__class__.__name__))
+                raise
+            records.append((start, time.monotonic() - start, method,
+                            buf[3] if length > 3 else None, length,
+                            newbuf[3] if newlen > 3 else None))
+            return newlen, newbuf
+        return traced
+
+    def attach(self, service):
+        for method in TRACED_METHODS:
+            setattr(service, method, self.wrap(method, getattr(service, method)))
+        self.service = service
+
+    def detach(self):
+        if self.service is not None:
+            for method in TRACED_METHODS:
+                self.service.__dict__.pop(method, None)
+            self.service = None
+
+    def clear(self):
+        self.records.clear()
+
+    def lines(self):
+        """format the trace, oldest record first"""
+        lines = []
+        for start, duration, method, resp, length, action in list(self.records):
+            lines.append('%.6f %8.3f ms %-17s resp=%s len=%s action=%s' % (
+                start, duration * 1000.0, method,
+                '%02x' % resp if resp is not None else '-', length,
+                '%02x' % action if isinstance(action, int) else action))
+        return lines
+
+    def dump(self, logfn):
+        for line in self.lines():
+            logfn('trace: %s' % line)